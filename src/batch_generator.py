@@ -9,71 +9,234 @@
 import json
 import os
 import sys
+import io
 import argparse
-from cli_generator import generate_image_from_config
+import contextlib
+import itertools
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cli_generator import generate_image_from_config, save_generated_image
+from core.font_manager import font_manager
+from core.manifest import (RenderJournal, RenderManifest, SHARD_MODES, find_shard_manifests, manifest_entry,
+                           parse_shard, scene_hash, shard_journal_name, shard_manifest_name, shard_of)
+from core.spool import DEFAULT_LEASE_SECONDS, LeaseKeeper, SpoolQueue
+from core.output import (EncodeStats, ImageWriter, OUTPUT_PROFILES, palette_summary, profile_extension,
+                         remove_stale_temp_files)
 
 
-def generate_batch_scenes(config_file, output_dir):
+# 每隔多少个场景额外按RGB编码一次，估算调色板PNG节省的大小
+PALETTE_SAMPLE_INTERVAL = 16
+
+# 场景结果：断点续传日志中已完成
+RESUMED = object()
+
+# 按JSON Lines格式读取的配置文件扩展名（"-" 表示从标准输入读取）
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+
+# 队列清空后合并渲染清单的锁名
+QUEUE_MERGE_LOCK = "manifest"
+
+# 渲染进程池的启动方式（multiprocessing 上下文），None 表示使用平台默认方式
+POOL_CONTEXT = None
+
+
+def generate_batch_scenes(config_file, output_dir, jobs=1, force=False, encode_threads=None,
+                          output_profile=None, palette=None, resume=False, shard=None, shard_by='index'):
     """
     根据配置文件批量生成场景图片
     
+    场景逐个读取、渲染后即释放；并行模式下同时在途的场景数量有上限，
+    内存占用不随批量大小增长。
+    
     Args:
-        config_file (str): JSON配置文件路径
+        config_file (str): JSON或JSON Lines配置文件路径，"-" 表示从标准输入读取JSON Lines
         output_dir (str): 输出目录路径
+        jobs (int): 并行渲染的进程数，1为逐个生成，0或负数表示使用全部CPU核心
+        force (bool): 忽略渲染清单，重新生成所有场景
+        encode_threads (int, optional): 逐个生成时后台编码/写入的线程数，0表示渲染后立即在当前线程保存；
+            默认在多核CPU上使用2个线程，单核时不使用
+        output_profile (str, optional): 默认输出配置，覆盖基础模板中的 output_profile（场景中的设置仍然优先）
+        palette (bool, optional): 颜色数不超过256时保存为调色板PNG，覆盖基础模板中的 palette（场景中的设置仍然优先）
+        resume (bool): 从上次中断运行的断点续传日志继续，日志中已完成且输出文件完好的场景不再生成
+        shard (tuple, optional): (i, N)，只生成N个分片中第i个分片的场景；各分片使用独立的清单和日志，
+            可以在共享同一输出目录的多台机器上同时运行，完成后用 merge_shard_manifests 合并
+        shard_by (str): 分片方式，index 按场景序号轮流分配，name 按场景名称哈希分配
     """
     
-    # 读取配置文件
-    if not os.path.exists(config_file):
-        raise FileNotFoundError(f"配置文件不存在: {config_file}")
+    base_template, scenes, total = load_scene_source(config_file)
+    if output_profile:
+        base_template = dict(base_template, output_profile=output_profile)
+    if palette is not None:
+        base_template = dict(base_template, palette=palette)
     
-    try:
-        with open(config_file, 'r', encoding='utf-8') as f:
-            batch_config = json.load(f)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"JSON格式错误: {e}")
-    except Exception as e:
-        raise Exception(f"读取配置文件失败: {e}")
-    
-    # 获取基础模板和场景列表
-    base_template = batch_config.get('base_template', {})
-    scenes = batch_config.get('scenes', [])
-    
-    if not scenes:
+    if total == 0:
         raise ValueError("配置文件中没有定义任何场景")
+    if shard is not None:
+        shard_index, shard_count = shard
+        shard_of(1, '', shard_count, shard_by)  # 尽早报告未知的分片方式
+        if total is not None:
+            total = sum(1 for position, scene in enumerate(scenes, 1)
+                        if shard_of(position, _scene_name(scene, position), shard_count, shard_by) == shard_index)
     
-    # 创建输出目录
+    # 创建输出目录，清理上次运行崩溃时留下的临时文件
     os.makedirs(output_dir, exist_ok=True)
+    remove_stale_temp_files(output_dir)
+    
+    if jobs is None or jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if total is not None:
+        jobs = max(1, min(jobs, total))
     
-    print(f"开始批量生成，共 {len(scenes)} 个场景...")
+    if total is not None:
+        print(f"开始批量生成，共 {total} 个场景...")
+    else:
+        print("开始批量生成（流式读取场景）...")
+    if shard is not None:
+        print(f"分片: {shard_index}/{shard_count}（{'按场景序号' if shard_by == 'index' else '按场景名称哈希'}分配）")
+    if jobs > 1:
+        print(f"并行进程数: {jobs}")
     print("=" * 50)
     
+    if shard is None:
+        manifest = RenderManifest(output_dir)
+        # 每完成一个场景追加一条记录，进程中途崩溃后可以用 --resume 继续
+        journal = RenderJournal(output_dir, resume=resume)
+    else:
+        # 各分片只读写自己的清单和日志，不同机器上的分片互不干扰
+        manifest = RenderManifest(output_dir, name=shard_manifest_name(shard_index, shard_count))
+        journal = RenderJournal(output_dir, resume=resume, name=shard_journal_name(shard_index, shard_count))
+    if resume and journal.entries:
+        print(f"断点续传: 日志中已完成 {len(journal.entries)} 个场景")
+    scene_count = 0
+    seen_count = 0
     successful_count = 0
+    rebuilt_count = 0
+    skipped_count = 0
     failed_scenes = []
+    encode_stats = EncodeStats()
     
-    # 生成每个场景
-    for i, scene in enumerate(scenes, 1):
-        scene_name = scene.get('name', f'scene_{i:03d}')
-        print(f"[{i}/{len(scenes)}] 生成场景: {scene_name}")
+    def finish(i, scene_name, digest, output_path, result):
+        """按场景顺序输出一个场景的结果"""
+        nonlocal successful_count, rebuilt_count, skipped_count
+        progress = f"[{i}/{total}]" if total is not None else f"[{i}]"
+        if result is None:
+            print(f"{progress} 跳过未变化场景: {scene_name}")
+            successful_count += 1
+            skipped_count += 1
+            return
+        if result is RESUMED:
+            print(f"{progress} 已完成（断点续传）: {scene_name}")
+            manifest.scenes[scene_name] = journal.entries[scene_name]
+            successful_count += 1
+            skipped_count += 1
+            return
         
-        try:
-            # 构建单个场景的完整配置
-            scene_config = build_scene_config(base_template, scene)
-            
-            # 生成图片
-            output_path = os.path.join(output_dir, f"{scene_name}.png")
-            image = generate_image_from_config(scene_config, output_path)
-            
+        print(f"{progress} 生成场景: {scene_name}")
+        if isinstance(result, Future):
+            try:
+                result = result.result()
+            except BrokenProcessPool:
+                # 某个渲染进程被系统终止（内存不足等）或崩溃，进程池中同时在途的场景都会失败；
+                # 之后的场景在新的进程池中生成，失败的场景重新运行时会再次生成
+                result = (output_path, '', "渲染进程意外退出（可能因内存不足被终止或崩溃），"
+                                           "与其同时在途的场景一并失败", None)
+            except Exception as e:
+                result = (output_path, '', str(e), None)
+        _, log, error, encode = result
+        rebuilt_count += 1
+        if log:
+            print(log, end='')
+        
+        if error is None:
             print(f"✅ 成功生成: {output_path}")
             successful_count += 1
-            
-        except Exception as e:
-            print(f"❌ 生成失败: {e}")
+            if digest is not None:
+                journal.append(scene_name, manifest.record(scene_name, digest, output_path))
+            if encode is not None:
+                encode_stats.add(*encode)
+        else:
+            print(f"❌ 生成失败: {error}")
             failed_scenes.append(scene_name)
+            manifest.discard(scene_name)
+    
+    executor = None
+    font_specs = None
+    writer = None
+    max_in_flight = jobs * 2
+    if encode_threads is None:
+        encode_threads = min(2, (os.cpu_count() or 1) - 1)
+    if jobs == 1 and encode_threads > 0:
+        # 逐个生成时，PNG编码和写文件交给后台线程，与下一个场景的渲染重叠
+        writer = ImageWriter(workers=encode_threads, max_pending=encode_threads * 2)
+        max_in_flight = writer.capacity
+    # 已提交但尚未输出的场景，按场景顺序排列
+    pending = deque()
+    completed = False
+    try:
+        for position, scene in enumerate(scenes, 1):
+            seen_count = position
+            scene_name = _scene_name(scene, position)
+            if shard is not None and shard_of(position, scene_name, shard_count, shard_by) != shard_index:
+                continue
+            scene_count += 1
+            i = scene_count
+            digest, output_path = _scene_output(base_template, scene, scene_name, output_dir)
+            # 抽样场景额外按RGB编码一次，用于估算调色板PNG节省的大小
+            compare_rgb = (i - 1) % PALETTE_SAMPLE_INTERVAL == 0
+            
+            # 内容哈希和输出文件都未变化的场景直接跳过
+            if not force and digest is not None and manifest.is_current(scene_name, digest, output_path):
+                result = None
+            elif resume and digest is not None and journal.is_complete(scene_name, digest, output_path):
+                result = RESUMED
+            elif jobs > 1:
+                while True:
+                    if executor is None:
+                        if font_specs is None:
+                            font_specs = _collect_font_specs(base_template, scenes)
+                        executor = ProcessPoolExecutor(max_workers=jobs, mp_context=POOL_CONTEXT,
+                                                       initializer=_init_worker, initargs=(font_specs,))
+                    try:
+                        result = executor.submit(render_scene, (base_template, scene, output_path, compare_rgb))
+                        break
+                    except BrokenProcessPool:
+                        print("⚠️ 渲染进程意外退出，重新启动进程池")
+                        executor.shutdown(wait=False)
+                        executor = None
+            else:
+                result = render_scene((base_template, scene, output_path, compare_rgb), writer)
+            
+            pending.append((i, scene_name, digest, output_path, result))
+            # 输出已完成的场景；在途场景超出上限时等待最早的场景完成
+            while pending and (len(pending) > max_in_flight or _is_ready(pending[0][-1])):
+                finish(*pending.popleft())
+        
+        while pending:
+            finish(*pending.popleft())
+        completed = True
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if writer is not None:
+            writer.close()
+        manifest.save()
+        # 正常结束时清单已包含全部结果，不再需要日志；中断时保留日志供 --resume 使用
+        journal.close(remove=completed)
+    
+    if seen_count == 0:
+        raise ValueError("配置文件中没有定义任何场景")
     
     # 输出统计信息
     print("\n" + "=" * 50)
     print(f"批量生成完成！")
-    print(f"成功: {successful_count}/{len(scenes)} 个场景")
+    print(f"成功: {successful_count}/{scene_count} 个场景")
+    print(f"重新生成: {rebuilt_count} 个场景，跳过未变化: {skipped_count} 个场景")
+    if encode_stats.profiles:
+        print("编码统计（按输出配置）:")
+        for line in encode_stats.report():
+            print(f"  {line}")
     
     if failed_scenes:
         print(f"失败: {len(failed_scenes)} 个场景")
@@ -82,6 +245,419 @@ def generate_batch_scenes(config_file, output_dir):
         print("🎉 所有场景都生成成功！")
 
 
+def _scene_name(scene, position):
+    """场景名称，未指定时按场景在配置中的序号命名"""
+    return scene.get('name', f'scene_{position:03d}')
+
+
+def _scene_output(base_template, scene, scene_name, output_dir):
+    """
+    计算场景的内容哈希和输出路径
+
+    Returns:
+        tuple: (内容哈希；配置无法解析时为None, 输出文件路径)
+    """
+    try:
+        scene_config = build_scene_config(base_template, scene)
+        digest = scene_hash(scene_config)
+        extension = profile_extension(scene_config.get('output', {}).get('profile'))
+    except Exception:
+        # 配置无法解析时交给渲染阶段报告错误
+        digest = None
+        extension = '.png'
+    return digest, os.path.join(output_dir, f"{scene_name}{extension}")
+
+
+def merge_shard_manifests(config_file, output_dir, output_profile=None, palette=None):
+    """
+    合并各分片的渲染清单，并核对每个场景恰好由一个分片生成
+
+    逐个核对配置中的场景：必须恰好出现在一个分片清单中，且记录的内容哈希
+    与当前配置一致、输出文件未被改动。全部通过后把合并结果写入输出目录的
+    render_manifest.json，之后不分片运行会直接跳过这些场景。
+
+    Args:
+        config_file (str): 生成时使用的配置文件（JSON或JSON Lines）
+        output_dir (str): 各分片共享的输出目录
+        output_profile (str, optional): 生成时使用的 --output-profile
+        palette (bool, optional): 生成时使用的 --palette
+
+    Returns:
+        bool: 核对是否全部通过
+    """
+    base_template, scenes, _ = load_scene_source(config_file)
+    if output_profile:
+        base_template = dict(base_template, output_profile=output_profile)
+    if palette is not None:
+        base_template = dict(base_template, palette=palette)
+    
+    found = find_shard_manifests(output_dir)
+    if not found:
+        raise ValueError(f"输出目录中没有分片清单: {output_dir}")
+    if len(found) > 1:
+        counts = ", ".join(str(count) for count in sorted(found))
+        raise ValueError(f"输出目录中存在不同分片总数的清单（N = {counts}），请删除过期的分片清单")
+    shard_count, names = next(iter(found.items()))
+    
+    problems = []
+    missing_shards = [index for index in range(1, shard_count + 1) if index not in names]
+    if missing_shards:
+        problems.append("缺少分片清单: " + ", ".join(f"{index}/{shard_count}" for index in missing_shards))
+    
+    # 场景名称 -> 记录了该场景的分片序号列表
+    owners = {}
+    shard_manifests = {}
+    for index, name in sorted(names.items()):
+        manifest = shard_manifests[index] = RenderManifest(output_dir, name=name)
+        for scene_name in manifest.scenes:
+            owners.setdefault(scene_name, []).append(index)
+    
+    merged = {}
+    seen = set()
+    scene_count = 0
+    for position, scene in enumerate(scenes, 1):
+        scene_count += 1
+        scene_name = _scene_name(scene, position)
+        if scene_name in seen:
+            problems.append(f"配置中场景名称重复: {scene_name}")
+            continue
+        seen.add(scene_name)
+        shards = owners.get(scene_name, [])
+        if not shards:
+            problems.append(f"场景未生成: {scene_name}")
+            continue
+        if len(shards) > 1:
+            problems.append(f"场景被多个分片生成: {scene_name}（分片 {', '.join(map(str, shards))}）")
+            continue
+        digest, output_path = _scene_output(base_template, scene, scene_name, output_dir)
+        manifest = shard_manifests[shards[0]]
+        if digest is None or not manifest.is_current(scene_name, digest, output_path):
+            problems.append(f"场景记录已过期或输出文件已改动: {scene_name}（分片 {shards[0]}）")
+            continue
+        merged[scene_name] = manifest.scenes[scene_name]
+    
+    extra = sorted(set(owners) - seen)
+    
+    print(f"合并 {len(names)}/{shard_count} 个分片清单，配置中共 {scene_count} 个场景")
+    if extra:
+        print(f"忽略不在配置中的场景记录: {len(extra)} 个（{', '.join(extra[:10])}{' ...' if len(extra) > 10 else ''}）")
+    if problems:
+        print(f"❌ 核对失败: {len(problems)} 个问题")
+        for problem in problems:
+            print(f"  {problem}")
+        return False
+    
+    manifest = RenderManifest(output_dir)
+    manifest.scenes = merged
+    manifest.save()
+    print(f"✅ 每个场景都恰好由一个分片生成，合并清单已保存: {manifest.path}")
+    return True
+
+
+def enqueue_scenes(config_file, spool_dir, output_dir, force=False, output_profile=None, palette=None):
+    """
+    把场景加入共享目录中的任务队列，由任意数量的 run_queue_worker 进程领取生成
+
+    与静态分片相比，队列按需分配场景，各场景耗时差别很大时负载依然均衡。
+    渲染清单中内容哈希和输出文件都未变化的场景不入队（force 为True时全部入队）。
+
+    Args:
+        config_file (str): JSON或JSON Lines配置文件路径
+        spool_dir (str): 队列目录，所有工作进程都能访问的共享目录
+        output_dir (str): 输出目录，所有工作进程都能访问的共享目录
+
+    Returns:
+        int: 入队的场景数
+    """
+    base_template, scenes, _ = load_scene_source(config_file)
+    if output_profile:
+        base_template = dict(base_template, output_profile=output_profile)
+    if palette is not None:
+        base_template = dict(base_template, palette=palette)
+    
+    os.makedirs(output_dir, exist_ok=True)
+    queue = SpoolQueue(spool_dir)
+    queue.create({'base_template': base_template, 'output_dir': os.path.abspath(output_dir)})
+    manifest = RenderManifest(output_dir)
+    
+    queued = 0
+    skipped = 0
+    for position, scene in enumerate(scenes, 1):
+        scene_name = _scene_name(scene, position)
+        digest, output_path = _scene_output(base_template, scene, scene_name, output_dir)
+        if not force and digest is not None and manifest.is_current(scene_name, digest, output_path):
+            skipped += 1
+            continue
+        # 任务名按场景序号补零，领取顺序与配置中的顺序一致
+        queue.put(f"{position:08d}", {'name': scene_name, 'scene': scene})
+        queued += 1
+    
+    if queued + skipped == 0:
+        raise ValueError("配置文件中没有定义任何场景")
+    print(f"已加入队列: {queued} 个场景，跳过未变化: {skipped} 个场景")
+    print(f"队列目录: {spool_dir}")
+    return queued
+
+
+def run_queue_worker(spool_dir, lease_seconds=DEFAULT_LEASE_SECONDS, poll_seconds=1.0):
+    """
+    工作进程：循环领取队列中的场景并生成，直到队列中没有等待和处理中的任务
+
+    处理场景期间后台线程定期续约；进程崩溃后其任务的租约过期，由其它工作进程收回重新生成。
+    队列处理完毕时把所有完成记录写入输出目录的渲染清单。
+
+    Args:
+        spool_dir (str): 队列目录
+        lease_seconds (float): 租约时长（秒）
+        poll_seconds (float): 没有可领取的任务、但其它进程仍在处理时的轮询间隔
+
+    Returns:
+        tuple: (本进程完成的场景数, 本进程失败的场景数)
+    """
+    queue = SpoolQueue(spool_dir, lease_seconds=lease_seconds)
+    job = queue.load_job()
+    base_template = job['base_template']
+    output_dir = job['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    remove_stale_temp_files(output_dir)
+    
+    done_count = 0
+    failed_count = 0
+    print(f"[{queue.worker}] 开始处理队列: {spool_dir}")
+    while True:
+        task = queue.claim()
+        if task is None:
+            if queue.recover_expired():
+                continue
+            if queue.is_drained():
+                break
+            time.sleep(poll_seconds)
+            continue
+        
+        scene_name = task.data['name']
+        scene = task.data['scene']
+        digest, output_path = _scene_output(base_template, scene, scene_name, output_dir)
+        start = time.perf_counter()
+        with LeaseKeeper(queue, task):
+            _, log, error, _ = render_scene((base_template, scene, output_path, False))
+        seconds = time.perf_counter() - start
+        
+        if error is None:
+            entry = manifest_entry(digest, output_path) if digest is not None else None
+            queue.complete(task, {'scene': scene_name, 'entry': entry, 'seconds': seconds})
+            done_count += 1
+            print(f"[{queue.worker}] ✅ {scene_name} ({seconds * 1000:.0f} 毫秒)")
+        else:
+            queue.fail(task, error)
+            failed_count += 1
+            if log:
+                print(log, end='')
+            print(f"[{queue.worker}] ❌ {scene_name}: {error}")
+    
+    if _save_queue_manifest(queue, output_dir):
+        print(f"[{queue.worker}] 已把队列结果合并到渲染清单")
+    print(f"[{queue.worker}] 队列已处理完毕，本进程完成 {done_count} 个场景，失败 {failed_count} 个")
+    return done_count, failed_count
+
+
+def _save_queue_manifest(queue, output_dir):
+    """
+    把队列的完成记录合并到输出目录的渲染清单
+
+    队列清空后完成记录不再变化，只需合并一次：取得合并锁的进程读取记录并保存清单，
+    完成后写入标记；其余进程（同时清空或之后才退出的）不再重写清单。
+
+    Returns:
+        bool: 本进程是否执行了合并
+    """
+    if not queue.acquire_lock(QUEUE_MERGE_LOCK):
+        return False
+    try:
+        if queue.is_merged():
+            return False
+        manifest = RenderManifest(output_dir)
+        for record in queue.results('done').values():
+            if record.get('entry'):
+                manifest.scenes[record['scene']] = record['entry']
+        manifest.save()
+        queue.mark_merged()
+    finally:
+        queue.release_lock(QUEUE_MERGE_LOCK)
+    return True
+
+
+def print_queue_status(spool_dir):
+    """输出队列中各状态的任务数和失败的场景"""
+    queue = SpoolQueue(spool_dir)
+    queue.load_job()
+    counts = queue.counts()
+    print(f"等待: {counts['pending']}  处理中: {counts['claimed']}  "
+          f"完成: {counts['done']}  失败: {counts['failed']}")
+    failed = queue.results('failed')
+    for record in failed.values():
+        print(f"  ❌ {record.get('name', '?')}: {record.get('error')}")
+    return counts
+
+
+def _is_ready(result):
+    """场景结果是否可以立即输出"""
+    return not isinstance(result, Future) or result.done()
+
+
+def load_scene_source(config_file):
+    """
+    打开批量配置的场景来源
+    
+    支持两种格式：
+    - JSON：{"base_template": {...}, "scenes": [...]}，一次性读入
+    - JSON Lines（.jsonl/.ndjson 或 "-" 表示标准输入）：每行一个场景，
+      第一行可以是 {"base_template": {...}} 头记录；场景在迭代时逐行解析
+    
+    Args:
+        config_file (str): 配置文件路径
+    
+    Returns:
+        tuple: (基础模板, 场景迭代器, 场景总数；JSON Lines来源为None)
+    """
+    if config_file == '-' or os.path.splitext(config_file)[1].lower() in JSONL_EXTENSIONS:
+        return _open_jsonl_source(config_file)
+    
+    # 读取配置文件
+    if not os.path.exists(config_file):
+        raise FileNotFoundError(f"配置文件不存在: {config_file}")
+    
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            batch_config = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON格式错误: {e}")
+    except Exception as e:
+        raise Exception(f"读取配置文件失败: {e}")
+    
+    # 获取基础模板和场景列表
+    base_template = batch_config.get('base_template', {})
+    scenes = batch_config.get('scenes', [])
+    return base_template, scenes, len(scenes)
+
+
+def _open_jsonl_source(config_file):
+    """打开JSON Lines场景流，读取可选的基础模板头记录"""
+    if config_file == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    elif not os.path.exists(config_file):
+        raise FileNotFoundError(f"配置文件不存在: {config_file}")
+    else:
+        stream = open(config_file, 'r', encoding='utf-8')
+    
+    records = _iter_jsonl(stream, close=config_file != '-')
+    first = next(records, None)
+    if first is None:
+        return {}, iter(()), None
+    if 'base_template' in first:
+        return first['base_template'], records, None
+    return {}, itertools.chain([first], records), None
+
+
+def _iter_jsonl(stream, close=True):
+    """逐行解析JSON Lines，跳过空行"""
+    try:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"JSON Lines格式错误（第{line_number}行）: {e}")
+            if not isinstance(record, dict):
+                raise ValueError(f"JSON Lines格式错误（第{line_number}行）: 每行必须是一个JSON对象")
+            yield record
+    finally:
+        if close:
+            stream.close()
+
+
+def render_scene(task, writer=None):
+    """
+    渲染并保存单个场景（可在子进程中执行）
+    
+    Args:
+        task (tuple): (base_template, scene, output_path, compare_rgb)
+        writer (ImageWriter, optional): 后台编码/写入阶段，提供时渲染完成即返回，不等待保存
+    
+    Returns:
+        tuple: (输出路径, 渲染过程中的输出文本, 错误信息；成功时为None,
+        编码统计 (输出配置, EncodeResult)；失败时为None)；
+        提供 writer 且渲染成功时返回保存完成后得到该元组的 Future
+    """
+    base_template, scene, output_path, compare_rgb = task
+    log = io.StringIO()
+    try:
+        # 捕获输出，交给主进程按场景顺序打印
+        with contextlib.redirect_stdout(log):
+            # 构建单个场景的完整配置
+            scene_config = build_scene_config(base_template, scene)
+            output = scene_config.get('output', {})
+            profile = output.get('profile')
+            
+            # 生成图片
+            image = generate_image_from_config(scene_config)
+            if writer is None:
+                encoded = save_generated_image(image, output_path, profile, output.get('palette'), compare_rgb)
+            else:
+                saved = writer.submit(image, output_path, profile=profile, palette=output.get('palette'),
+                                      compare_rgb=compare_rgb)
+    except Exception as e:
+        return output_path, log.getvalue(), str(e), None
+    
+    if writer is not None:
+        return _when_saved(saved, output_path, log.getvalue(), profile)
+    return output_path, log.getvalue(), None, (profile, encoded)
+
+
+def _when_saved(saved, output_path, log, profile):
+    """把写入任务的 Future 转换为 render_scene 的结果"""
+    done = Future()
+    
+    def on_saved(future):
+        error = future.exception()
+        if error is None:
+            encoded = future.result()
+            log_text = log + f"图片已保存到: {output_path}\n"
+            summary = palette_summary(encoded)
+            if summary:
+                log_text += summary + "\n"
+            done.set_result((output_path, log_text, None, (profile, encoded)))
+        else:
+            done.set_result((output_path, log, str(error), None))
+    
+    saved.add_done_callback(on_saved)
+    return done
+
+
+def _collect_font_specs(base_template, scenes):
+    """
+    收集批量任务中用到的 (字体路径, 字号) 组合，用于预热工作进程
+    
+    流式场景来源无法预先遍历，只预热备用字体，其余字体在工作进程首次使用时缓存。
+    """
+    specs = set()
+    if isinstance(scenes, list):
+        for scene in scenes:
+            for layer in scene.get('text_layers', []):
+                size = layer.get('size', 48)
+                if isinstance(size, int):
+                    specs.add((layer.get('font_path', ''), size))
+    return list(specs)
+
+
+def _init_worker(font_specs):
+    """工作进程初始化：解析备用字体并预先加载本批次用到的字体"""
+    font_manager.resolve_fallback()
+    for font_path, size in font_specs:
+        font_manager.get_font(font_path, size)
+
+
 def build_scene_config(base_template, scene):
     """
     构建单个场景的完整配置
@@ -112,6 +688,19 @@ def build_scene_config(base_template, scene):
         "text_layers": []
     }
     
+    # 渐变背景：场景配置优先，否则使用基础模板
+    gradient = scene.get('gradient', base_template.get('gradient'))
+    if gradient:
+        config["gradient"] = gradient
+    
+    # 输出配置：场景配置优先，否则使用基础模板
+    output_profile = scene.get('output_profile', base_template.get('output_profile'))
+    if output_profile:
+        config.setdefault("output", {})["profile"] = output_profile
+    palette = scene.get('palette', base_template.get('palette'))
+    if palette is not None:
+        config.setdefault("output", {})["palette"] = palette
+    
     # 转换文字层配置
     scene_text_layers = scene.get('text_layers', [])
     for layer in scene_text_layers:
@@ -266,11 +855,46 @@ def create_example_batch_config():
     }
 
 
+def _run_queue_workers(spool_dir, jobs, lease_seconds):
+    """在本机启动 jobs 个工作进程处理队列，返回失败的场景数"""
+    if jobs is None or jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if jobs == 1:
+        return run_queue_worker(spool_dir, lease_seconds)[1]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_queue_worker, spool_dir, lease_seconds) for _ in range(jobs)]
+        return sum(future.result()[1] for future in futures)
+
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description="批量生成新房风格场景图片")
-    parser.add_argument("-c", "--config", help="JSON配置文件路径")
+    parser.add_argument("-c", "--config", help="JSON或JSON Lines配置文件路径（\"-\" 表示从标准输入读取JSON Lines）")
     parser.add_argument("-o", "--output", default="output/batch_scenes", help="输出目录（默认：output/batch_scenes）")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                       help="并行渲染的进程数（默认：1，0表示使用全部CPU核心）")
+    parser.add_argument("--encode-threads", type=int, default=None,
+                       help="逐个生成时后台编码/写入的线程数（默认：多核CPU上为2，0表示不使用后台写入）")
+    parser.add_argument("--output-profile", choices=list(OUTPUT_PROFILES),
+                       help="默认输出配置: default / fast（最快编码）/ small（最小体积）/ webp-lossless / raw（不压缩PPM）")
+    parser.add_argument("--palette", action="store_true", default=None,
+                       help="颜色数不超过256时无损保存为调色板PNG，并报告节省的大小")
+    parser.add_argument("--resume", action="store_true",
+                       help="从上次中断运行的断点续传日志继续，跳过已完成的场景")
+    parser.add_argument("--force", action="store_true", help="忽略渲染清单，重新生成所有场景")
+    parser.add_argument("--shard", metavar="i/N",
+                       help="只生成N个分片中的第i个（从1开始），各分片可在共享输出目录的不同机器上同时运行")
+    parser.add_argument("--shard-by", choices=SHARD_MODES, default="index",
+                       help="分片方式: index 按场景序号轮流分配（默认）/ name 按场景名称哈希分配")
+    parser.add_argument("--merge-shards", action="store_true",
+                       help="合并输出目录中的分片清单，并核对每个场景恰好生成一次")
+    parser.add_argument("--enqueue", metavar="SPOOL_DIR",
+                       help="把场景加入共享目录中的任务队列，由 --worker 进程领取生成")
+    parser.add_argument("--worker", metavar="SPOOL_DIR",
+                       help="作为工作进程处理任务队列直到队列清空（-j 指定在本机启动的进程数）")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS,
+                       help=f"工作进程的租约时长（秒，默认：{DEFAULT_LEASE_SECONDS}），超时未续约的任务会被重新分配")
+    parser.add_argument("--queue-status", metavar="SPOOL_DIR", help="查看任务队列的状态")
     parser.add_argument("--example", action="store_true", help="生成示例批量配置文件")
     parser.add_argument("--example-output", default="configs/batch_config_example.json", 
                        help="示例配置文件输出路径（默认：configs/batch_config_example.json）")
@@ -285,12 +909,50 @@ def main():
         print(f"示例批量配置文件已生成: {args.example_output}")
         return
     
+    if args.worker or args.queue_status:
+        try:
+            if args.queue_status:
+                print_queue_status(args.queue_status)
+                return
+            failed = _run_queue_workers(args.worker, args.jobs, args.lease)
+        except Exception as e:
+            print(f"处理任务队列失败: {e}")
+            sys.exit(1)
+        sys.exit(1 if failed else 0)
+    
     if not args.config:
         print("错误：请提供配置文件路径 (-c/--config) 或使用 --example 生成示例配置")
         sys.exit(1)
     
+    if args.enqueue:
+        try:
+            enqueue_scenes(args.config, args.enqueue, args.output, force=args.force,
+                           output_profile=args.output_profile, palette=args.palette)
+        except Exception as e:
+            print(f"加入任务队列失败: {e}")
+            sys.exit(1)
+        return
+    
+    if args.merge_shards:
+        try:
+            ok = merge_shard_manifests(args.config, args.output, output_profile=args.output_profile,
+                                       palette=args.palette)
+        except Exception as e:
+            print(f"合并分片清单失败: {e}")
+            sys.exit(1)
+        sys.exit(0 if ok else 1)
+    
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    
     try:
-        generate_batch_scenes(args.config, args.output)
+        generate_batch_scenes(args.config, args.output, jobs=args.jobs, force=args.force,
+                              encode_threads=args.encode_threads, output_profile=args.output_profile,
+                              palette=args.palette, resume=args.resume, shard=shard, shard_by=args.shard_by)
     except Exception as e:
         print(f"批量生成失败: {e}")
         sys.exit(1)
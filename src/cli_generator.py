@@ -1,24 +1,31 @@
 import json
 import argparse
 import os
-from PIL import Image
 from core.image_generator import ImageGenerator
+from core.instrumentation import RenderTimings
+from core.output import OUTPUT_PROFILES, check_profile_extension, encode_image, palette_summary, profile_extension
 
 
-def generate_image_from_config(config, output_path=None):
+def generate_image_from_config(config, output_path=None, timings=None):
     """
     根据配置字典生成图片
     
     Args:
         config (dict): 包含图片生成配置的字典
         output_path (str, optional): 输出文件路径，如果不提供则使用配置中的路径
+        timings (RenderTimings, optional): 提供时记录各渲染阶段和编码的耗时与内存分配
     
     Returns:
         PIL.Image: 生成的图片对象
     """
     
+    if output_path:
+        # 渲染前检查，扩展名与输出配置不符时不必白白渲染
+        check_profile_extension(output_path, config.get('output', {}).get('profile'))
+    
     # 创建图片生成器实例
     generator = ImageGenerator()
+    generator.timings = timings
     
     # 设置背景参数
     background = config.get('background', {})
@@ -35,6 +42,14 @@ def generate_image_from_config(config, output_path=None):
     generator.line_color = lines.get('color', '#666666')
     generator.line_spacing = lines.get('spacing', 3)
     
+    # 设置渐变背景参数
+    gradient = config.get('gradient', {})
+    generator.enable_gradient = gradient.get('enabled', False)
+    generator.gradient_color1 = gradient.get('color1', '#f8f9fa')
+    generator.gradient_color2 = gradient.get('color2', '#e9ecef')
+    generator.gradient_direction = gradient.get('direction', 'horizontal')
+    generator.gradient_stops = gradient.get('stops')
+    
     # 设置文字层
     text_layers = config.get('text_layers', [])
     generator.text_layers = []
@@ -58,37 +73,53 @@ def generate_image_from_config(config, output_path=None):
     
     # 如果提供了输出路径，保存图片
     if output_path:
-        # 确保输出目录存在
-        output_dir = os.path.dirname(output_path)
-        if output_dir:  # 只有当有目录路径时才创建
-            os.makedirs(output_dir, exist_ok=True)
-        
-        # 根据文件扩展名确定格式
-        if output_path.lower().endswith('.png'):
-            image.save(output_path, 'PNG')
-        elif output_path.lower().endswith(('.jpg', '.jpeg')):
-            # JPEG不支持透明度，转换为RGB
-            if image.mode == 'RGBA':
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[-1])  # 使用alpha通道作为mask
-                image = background
-            image.save(output_path, 'JPEG', quality=95)
-        else:
-            # 默认保存为PNG
-            image.save(output_path, 'PNG')
-        
-        print(f"图片已保存到: {output_path}")
+        output = config.get('output', {})
+        with generator.stage('encode'):
+            save_generated_image(image, output_path, output.get('profile'), output.get('palette'), compare_rgb=True)
     
     return image
 
 
-def generate_image_from_json(json_path, output_path=None):
+def save_generated_image(image, output_path, profile=None, palette=None, compare_rgb=False):
+    """
+    按输出配置保存生成的图片
+    
+    Args:
+        image (PIL.Image): 生成的图片
+        output_path (str): 输出文件路径
+        profile (str, optional): 输出配置名称（default/fast/small/webp-lossless/raw）
+        palette (bool, optional): 颜色数不超过256时保存为调色板PNG，默认由输出配置决定
+        compare_rgb (bool): 保存为调色板PNG时额外按RGB编码一次，报告节省的字节数
+    
+    Returns:
+        EncodeResult: 编码结果
+    """
+    # 确保输出目录存在
+    output_dir = os.path.dirname(output_path)
+    if output_dir:  # 只有当有目录路径时才创建
+        os.makedirs(output_dir, exist_ok=True)
+    
+    # 格式由输出配置决定（扩展名与之不符时报错），default配置根据文件扩展名确定（未知扩展名保存为PNG），
+    # JPEG在编码时才去除透明度
+    result = encode_image(image, output_path, profile=profile, palette=palette, compare_rgb=compare_rgb)
+    
+    print(f"图片已保存到: {output_path}")
+    summary = palette_summary(result)
+    if summary:
+        print(summary)
+    return result
+
+
+def generate_image_from_json(json_path, output_path=None, output_profile=None, palette=None, timings=None):
     """
     从JSON文件生成图片
     
     Args:
         json_path (str): JSON配置文件路径
         output_path (str, optional): 输出文件路径
+        output_profile (str, optional): 输出配置名称，覆盖配置文件中的 output.profile
+        palette (bool, optional): 是否尝试保存为调色板PNG，覆盖配置文件中的 output.palette
+        timings (RenderTimings, optional): 提供时记录各渲染阶段和编码的耗时与内存分配
     
     Returns:
         PIL.Image: 生成的图片对象
@@ -105,6 +136,11 @@ def generate_image_from_json(json_path, output_path=None):
     except Exception as e:
         raise Exception(f"读取JSON文件失败: {e}")
     
+    if output_profile:
+        config.setdefault('output', {})['profile'] = output_profile
+    if palette is not None:
+        config.setdefault('output', {})['palette'] = palette
+    
     # 如果没有指定输出路径，从配置文件中获取
     if not output_path:
         output_path = config.get('output_path')
@@ -112,9 +148,10 @@ def generate_image_from_json(json_path, output_path=None):
             # 如果配置文件中也没有，则根据输入文件名生成一个默认路径
             base_name = os.path.basename(json_path)
             file_name, _ = os.path.splitext(base_name)
-            output_path = os.path.join("output", f"{file_name}.png")
+            extension = profile_extension(config.get('output', {}).get('profile'))
+            output_path = os.path.join("output", f"{file_name}{extension}")
     
-    return generate_image_from_config(config, output_path)
+    return generate_image_from_config(config, output_path, timings)
 
 
 def _map_direction(direction_str):
@@ -193,6 +230,10 @@ def create_example_config():
                 "rotation": "0°"
             }
         ],
+        "output": {
+            "profile": "default",
+            "palette": False
+        },
         "output_path": "output/example.png"
     }
 
@@ -202,6 +243,11 @@ def main():
     parser = argparse.ArgumentParser(description='新房风格背景生成器 - 命令行版本')
     parser.add_argument('--config', '-c', type=str, help='JSON配置文件路径')
     parser.add_argument('--output', '-o', type=str, help='输出图片路径')
+    parser.add_argument('--output-profile', type=str, choices=list(OUTPUT_PROFILES),
+                       help='输出配置: default / fast（最快编码）/ small（最小体积）/ webp-lossless / raw（不压缩PPM）')
+    parser.add_argument('--palette', action='store_true', default=None,
+                       help='颜色数不超过256时无损保存为调色板PNG，并报告节省的大小')
+    parser.add_argument('--profile', action='store_true', help='输出各渲染阶段的耗时和内存分配表')
     parser.add_argument('--example', action='store_true', help='生成示例配置文件')
     parser.add_argument('--example-output', type=str, default='configs/example_config.json', 
                        help='示例配置文件输出路径 (默认: configs/example_config.json)')
@@ -222,10 +268,15 @@ def main():
     
     try:
         # 从JSON文件生成图片
-        image = generate_image_from_json(args.config, args.output)
-        image.save(args.output, format='PNG')
+        # generate_image_from_json 已经保存了图片，无需再次编码
+        timings = RenderTimings() if args.profile else None
+        generate_image_from_json(args.config, args.output, args.output_profile, args.palette, timings)
         print("图片生成成功!")
         
+        if timings is not None:
+            print()
+            print(timings.format_table())
+        
     except Exception as e:
         print(f"生成图片失败: {e}")
 
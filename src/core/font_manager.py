@@ -0,0 +1,107 @@
+from PIL import ImageFont
+import os
+from .render_cache import LRUCache
+
+# 未指定字体时依次尝试的字体（本地宋体 → Windows → macOS → Linux）
+FALLBACK_FONTS = [
+    os.path.join("assets", "fonts", "Songti.ttc"),
+    "C:/Windows/Fonts/simhei.ttf",
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/Arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+]
+
+
+class FontManager:
+    """
+    字体管理器
+
+    - 备用字体链每个进程只探测一次
+    - 字体路径是否存在每个路径只检查一次，渲染时不再访问文件系统
+    - FreeTypeFont 按 (路径, 字号, 索引) 缓存，超出数量时按LRU淘汰
+    """
+
+    def __init__(self, max_fonts=64, fallback_fonts=None):
+        self.fallback_fonts = list(fallback_fonts or FALLBACK_FONTS)
+        self.cache = LRUCache(max_entries=max_fonts, sizeof=None)
+        self._fallback_path = None
+        self._fallback_resolved = False
+        self._resolved_paths = {}
+
+    def resolve_fallback(self):
+        """解析备用字体链，返回第一个可加载的字体路径（都不可用时返回None）"""
+        if not self._fallback_resolved:
+            for path in self.fallback_fonts:
+                if not os.path.exists(path):
+                    continue
+                try:
+                    ImageFont.truetype(path, 12)
+                except OSError:
+                    continue
+                self._fallback_path = path
+                break
+            self._fallback_resolved = True
+        return self._fallback_path
+
+    def resolve_path(self, font_path):
+        """
+        返回实际使用的字体路径：为空或不存在时换成备用字体
+
+        结果按 font_path 缓存；之后才创建的字体文件在 clear() 之后生效。
+        """
+        try:
+            return self._resolved_paths[font_path]
+        except KeyError:
+            pass
+        if not font_path or not os.path.exists(font_path):
+            resolved = self.resolve_fallback()
+        else:
+            resolved = font_path
+        self._resolved_paths[font_path] = resolved
+        return resolved
+
+    def get_font(self, font_path, size, index=0):
+        """
+        获取字体对象
+
+        Args:
+            font_path (str): 字体文件路径，为空或不存在时使用备用字体
+            size (int): 字号
+            index (int): .ttc 字体集合中的字体索引
+
+        Returns:
+            ImageFont.FreeTypeFont: 字体对象（所有字体都不可用时为Pillow默认字体）
+        """
+        font_path = self.resolve_path(font_path)
+        key = (font_path, size, index)
+        font = self.cache.get(key)
+        if font is None:
+            font = self.cache.put(key, self._load(font_path, size, index))
+        return font
+
+    def stats(self):
+        """返回字体缓存统计信息"""
+        stats = self.cache.stats()
+        stats['fallback_font'] = self._fallback_path
+        return stats
+
+    def clear(self):
+        """清空字体缓存并重新探测备用字体"""
+        self.cache.clear()
+        self._resolved_paths.clear()
+        self._fallback_path = None
+        self._fallback_resolved = False
+
+    def _load(self, font_path, size, index):
+        """加载字体文件，失败时退回默认字体"""
+        if font_path is None:
+            return ImageFont.load_default()
+        try:
+            return ImageFont.truetype(font_path, size, index=index)
+        except Exception as e:
+            print(f"字体加载失败: {e}")
+            return ImageFont.load_default()
+
+
+# 进程级字体管理器
+font_manager = FontManager()
@@ -2,6 +2,21 @@ from PIL import Image, ImageDraw
 import math
 from typing import List, Tuple, Union
 from abc import ABC, abstractmethod
+from .gradient import normalize_stops, get_gradient
+from .output import flatten
+
+def _freeze(value):
+    """把列表/元组递归转换为可哈希的元组"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _points_bounds(points, pad):
+    """计算一组点的外接整数矩形，并向外扩展pad像素"""
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (math.floor(min(xs)) - pad, math.floor(min(ys)) - pad,
+            math.ceil(max(xs)) + pad + 1, math.ceil(max(ys)) + pad + 1)
 
 class Shape(ABC):
     """抽象形状基类"""
@@ -30,6 +45,20 @@ class Shape(ABC):
                 return (*self.stroke_color, self.alpha)
             return self.stroke_color
         return None
+    
+    def bounds(self):
+        """返回形状在画布上可能影响的整数矩形 (x0, y0, x1, y1)，右下角不包含"""
+        return _points_bounds(self.get_points(), self.stroke_width + 2)
+    
+    def get_points(self):
+        """返回决定形状范围的关键点"""
+        return [(self.x, self.y)]
+    
+    def signature(self):
+        """返回描述形状当前状态的可哈希元组，用于渲染缓存的键"""
+        return (type(self).__name__,) + tuple(
+            (name, _freeze(value)) for name, value in sorted(vars(self).items())
+        )
 
 class Circle(Shape):
     """圆形"""
@@ -48,6 +77,10 @@ class Circle(Shape):
         # 直接使用RGBA颜色绘制（PIL会自动处理透明度）
         draw.ellipse(bbox, fill=self.get_fill_color(), 
                     outline=self.get_stroke_color(), width=self.stroke_width)
+    
+    def get_points(self):
+        return [(self.x - self.radius, self.y - self.radius),
+                (self.x + self.radius, self.y + self.radius)]
 
 class Rectangle(Shape):
     """矩形"""
@@ -66,8 +99,18 @@ class Rectangle(Shape):
             # 旋转矩形需要计算四个角的坐标
             self._draw_rotated_rectangle(draw)
     
+    def get_points(self):
+        if self.rotation == 0:
+            return [(self.x, self.y), (self.x + self.width, self.y + self.height)]
+        return self._rotated_corners()
+    
     def _draw_rotated_rectangle(self, draw):
         """绘制旋转的矩形"""
+        draw.polygon(self._rotated_corners(), fill=self.get_fill_color(), 
+                    outline=self.get_stroke_color(), width=self.stroke_width)
+    
+    def _rotated_corners(self):
+        """计算旋转后的四个角坐标"""
         angle = math.radians(self.rotation)
         cos_a = math.cos(angle)
         sin_a = math.sin(angle)
@@ -88,8 +131,7 @@ class Rectangle(Shape):
             new_y = cy + x * sin_a + y * cos_a
             rotated_corners.append((new_x, new_y))
         
-        draw.polygon(rotated_corners, fill=self.get_fill_color(), 
-                    outline=self.get_stroke_color(), width=self.stroke_width)
+        return rotated_corners
 
 class Triangle(Shape):
     """三角形"""
@@ -101,6 +143,9 @@ class Triangle(Shape):
     def draw(self, draw: ImageDraw.Draw):
         draw.polygon(self.points, fill=self.get_fill_color(), 
                     outline=self.get_stroke_color(), width=self.stroke_width)
+    
+    def get_points(self):
+        return self.points
 
 class RegularPolygon(Shape):
     """正多边形"""
@@ -111,6 +156,10 @@ class RegularPolygon(Shape):
         self.rotation = rotation
     
     def draw(self, draw: ImageDraw.Draw):
+        draw.polygon(self.get_points(), fill=self.get_fill_color(), 
+                    outline=self.get_stroke_color(), width=self.stroke_width)
+    
+    def get_points(self):
         points = []
         angle_step = 2 * math.pi / self.sides
         start_angle = math.radians(self.rotation)
@@ -121,8 +170,7 @@ class RegularPolygon(Shape):
             y = self.y + self.radius * math.sin(angle)
             points.append((x, y))
         
-        draw.polygon(points, fill=self.get_fill_color(), 
-                    outline=self.get_stroke_color(), width=self.stroke_width)
+        return points
 
 class Line(Shape):
     """线条"""
@@ -135,6 +183,12 @@ class Line(Shape):
     def draw(self, draw: ImageDraw.Draw):
         draw.line([(self.x, self.y), (self.x2, self.y2)], 
                  fill=self.get_fill_color(), width=self.width)
+    
+    def get_points(self):
+        return [(self.x, self.y), (self.x2, self.y2)]
+    
+    def bounds(self):
+        return _points_bounds(self.get_points(), self.width + 2)
 
 class GeometricCanvas:
     """几何画布 - 管理图层和形状"""
@@ -192,66 +246,81 @@ class GeometricCanvas:
             return self.layers[layer_index].copy()
         return []
     
-    def create_gradient_background(self, color1, color2, direction='horizontal'):
-        """创建渐变背景"""
-        img = Image.new('RGBA', (self.width, self.height))
-        
-        if direction == 'horizontal':
-            for x in range(self.width):
-                ratio = x / self.width
-                r = int(color1[0] * (1 - ratio) + color2[0] * ratio)
-                g = int(color1[1] * (1 - ratio) + color2[1] * ratio)
-                b = int(color1[2] * (1 - ratio) + color2[2] * ratio)
-                
-                for y in range(self.height):
-                    img.putpixel((x, y), (r, g, b, 255))
+    def create_gradient_background(self, color1, color2, direction='horizontal', stops=None):
+        """创建渐变背景
+
+        Args:
+            color1 (tuple): 起始颜色
+            color2 (tuple): 结束颜色
+            direction (str): horizontal / vertical / diagonal / radial
+            stops (list, optional): 多色标列表 [(位置0~1, (r, g, b)), ...]，提供时忽略 color1/color2
         
-        elif direction == 'vertical':
-            for y in range(self.height):
-                ratio = y / self.height
-                r = int(color1[0] * (1 - ratio) + color2[0] * ratio)
-                g = int(color1[1] * (1 - ratio) + color2[1] * ratio)
-                b = int(color1[2] * (1 - ratio) + color2[2] * ratio)
-                
-                for x in range(self.width):
-                    img.putpixel((x, y), (r, g, b, 255))
+        Returns:
+            PIL.Image: 进程级缓存中的共享渐变底图，请勿原地修改（render 会先复制）
+        """
+        return get_gradient(self.width, self.height,
+                            normalize_stops(color1, color2, stops), direction)
+    
+    def render(self, gradient_bg=None, mode='RGBA'):
+        """渲染画布
         
-        elif direction == 'diagonal':
-            for x in range(self.width):
-                for y in range(self.height):
-                    ratio = (x + y) / (self.width + self.height)
-                    r = int(color1[0] * (1 - ratio) + color2[0] * ratio)
-                    g = int(color1[1] * (1 - ratio) + color2[1] * ratio)
-                    b = int(color1[2] * (1 - ratio) + color2[2] * ratio)
-                    img.putpixel((x, y), (r, g, b, 255))
+        每个图层的形状先画到同一块可复用的透明图层缓冲区上，再裁剪到该图层的
+        包围盒、一次性与下方内容做alpha合成。半透明形状会正确地与渐变混合，
+        合成次数只与图层数量有关，与形状数量无关。
         
-        return img
-    
-    def render(self, gradient_bg=None):
-        """渲染画布"""
+        Args:
+            gradient_bg (PIL.Image, optional): 渐变底图（不会被修改）
+            mode (str): 输出模式，'RGBA' 或 'RGB'（RGB时直接在不透明底图上合成）
+        """
         if gradient_bg:
-            img = gradient_bg.copy()
+            img = gradient_bg.copy() if mode == 'RGBA' else flatten(gradient_bg, self.background_color)
         else:
-            img = Image.new('RGBA', (self.width, self.height), (*self.background_color, 255))
+            fill = (*self.background_color, 255) if mode == 'RGBA' else tuple(self.background_color)
+            img = Image.new(mode, (self.width, self.height), fill)
         
-        draw = ImageDraw.Draw(img)
+        layer_buffer = None
+        dirty_box = None
         
-        # 按图层顺序绘制所有形状
+        # 按图层顺序合成所有形状
         for layer in self.layers:
+            box = self._layer_bounds(layer)
+            if box is None:
+                continue
+            
+            if layer_buffer is None:
+                layer_buffer = Image.new('RGBA', (self.width, self.height), (0, 0, 0, 0))
+            elif dirty_box:
+                # 清除上一个图层留下的内容
+                layer_buffer.paste((0, 0, 0, 0), dirty_box)
+            
+            draw = ImageDraw.Draw(layer_buffer)
             for shape in layer:
                 shape.draw(draw)
+            dirty_box = box
+            
+            if img.mode == 'RGBA':
+                img.alpha_composite(layer_buffer, dest=box[:2], source=box)
+            else:
+                region = layer_buffer.crop(box)
+                img.paste(region, box[:2], region)
         
         return img
     
+    def _layer_bounds(self, layer):
+        """计算图层内所有形状在画布内的包围盒，图层为空或完全在画布外时返回None"""
+        if not layer:
+            return None
+        boxes = [shape.bounds() for shape in layer]
+        box = (max(0, min(b[0] for b in boxes)), max(0, min(b[1] for b in boxes)),
+               min(self.width, max(b[2] for b in boxes)), min(self.height, max(b[3] for b in boxes)))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return None
+        return box
+    
     def save(self, filename, gradient_bg=None):
         """保存图片"""
-        img = self.render(gradient_bg)
         # 转换为RGB模式保存（去除alpha通道）
-        if img.mode == 'RGBA':
-            background = Image.new('RGB', img.size, self.background_color)
-            background.paste(img, mask=img.split()[3])  # 使用alpha通道作为mask
-            img = background
-        
+        img = flatten(self.render(gradient_bg), self.background_color)
         img.save(filename)
 
 # 使用示例和工具函数
@@ -0,0 +1,74 @@
+from collections import namedtuple
+from PIL import Image, ImageDraw
+from .render_cache import LRUCache, image_nbytes
+
+# 单个字符的度量和光栅化遮罩（空白字符的 mask 为 None）
+Glyph = namedtuple('Glyph', ['bbox', 'width', 'height', 'mask'])
+
+
+def font_key(font):
+    """生成字体的缓存键：文件字体使用 (路径, 字号, 索引)，其它字体使用对象id"""
+    path = getattr(font, 'path', None)
+    if isinstance(path, str):
+        return (path, font.size, getattr(font, 'index', 0))
+    return id(font)
+
+
+def _entry_nbytes(value):
+    """估算缓存条目占用的字节数"""
+    if isinstance(value, Glyph) and value.mask is not None:
+        return image_nbytes(value.mask) + 64
+    return 64
+
+
+class GlyphCache:
+    """
+    字形缓存
+
+    - 字符串包围盒按 (字体, 文本) 缓存，供水平/垂直排版测量尺寸
+    - 单个字符按 (字体, 字符) 缓存包围盒和L模式遮罩，垂直排版只需逐字粘贴
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.cache = LRUCache(max_bytes=max_bytes, sizeof=_entry_nbytes)
+        # 测量使用与原实现相同的RGB画板，保证包围盒一致
+        self._measure_draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+    def measure(self, font, text):
+        """返回文本在原点处的包围盒 (left, top, right, bottom)"""
+        key = ('bbox', font_key(font), text)
+        bbox = self.cache.get(key)
+        if bbox is None:
+            bbox = self.cache.put(key, self._measure_draw.textbbox((0, 0), text, font=font))
+        return bbox
+
+    def get_glyph(self, font, char):
+        """返回单个字符的 Glyph"""
+        key = ('glyph', font_key(font), char)
+        glyph = self.cache.get(key)
+        if glyph is None:
+            glyph = self.cache.put(key, self._rasterize(font, char))
+        return glyph
+
+    def stats(self):
+        """返回字形缓存统计信息"""
+        return self.cache.stats()
+
+    def clear(self):
+        """清空字形缓存"""
+        self.cache.clear()
+
+    def _rasterize(self, font, char):
+        """光栅化单个字符，遮罩尺寸与包围盒一致"""
+        bbox = self._measure_draw.textbbox((0, 0), char, font=font)
+        width = bbox[2] - bbox[0]
+        height = bbox[3] - bbox[1]
+        mask = None
+        if width > 0 and height > 0:
+            mask = Image.new('L', (width, height), 0)
+            ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), char, fill=255, font=font)
+        return Glyph(bbox, width, height, mask)
+
+
+# 进程级字形缓存
+glyph_cache = GlyphCache()
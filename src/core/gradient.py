@@ -0,0 +1,106 @@
+from PIL import Image
+from .render_cache import LRUCache
+
+# 支持的渐变方向
+GRADIENT_DIRECTIONS = ['horizontal', 'vertical', 'diagonal', 'radial']
+
+# 进程级渐变底图缓存，默认预算128MB（约4张4K RGBA底图）
+gradient_cache = LRUCache(max_bytes=128 * 1024 * 1024)
+
+
+def normalize_stops(color1, color2, stops=None):
+    """
+    整理渐变色标
+
+    Args:
+        color1 (tuple): 起始颜色 (r, g, b)
+        color2 (tuple): 结束颜色 (r, g, b)
+        stops (list, optional): 多色标列表 [(位置0~1, (r, g, b)), ...]，提供时忽略 color1/color2
+
+    Returns:
+        list: 按位置排序的色标列表，至少包含两个色标
+    """
+    if not stops:
+        return [(0.0, tuple(color1[:3])), (1.0, tuple(color2[:3]))]
+
+    normalized = sorted((float(pos), tuple(color[:3])) for pos, color in stops)
+    if len(normalized) == 1:
+        normalized.append((1.0, normalized[0][1]))
+    return normalized
+
+
+def color_at(stops, ratio):
+    """计算渐变在指定位置(0~1)的颜色"""
+    if ratio <= stops[0][0]:
+        return stops[0][1]
+
+    for (pos1, c1), (pos2, c2) in zip(stops, stops[1:]):
+        if ratio <= pos2:
+            if pos2 == pos1:
+                return c2
+            t = (ratio - pos1) / (pos2 - pos1)
+            # 与逐像素实现保持相同的插值公式，保证输出逐字节一致
+            return tuple(int(c1[i] * (1 - t) + c2[i] * t) for i in range(3))
+
+    return stops[-1][1]
+
+
+def _ramp_bytes(stops, length, denominator):
+    """生成一维RGBA渐变色带（第i个像素的比例为 i / denominator）"""
+    return b''.join(bytes((*color_at(stops, i / denominator), 255)) for i in range(length))
+
+
+def render_gradient(width, height, stops, direction='horizontal'):
+    """
+    渲染渐变背景
+
+    不再逐像素调用 putpixel：线性渐变先计算一维色带，再通过一次 resize
+    或按行切片拼接铺满画布；径向渐变使用 Pillow 内置的径向灰度图配合查找表着色。
+
+    Args:
+        width (int): 图片宽度
+        height (int): 图片高度
+        stops (list): 由 normalize_stops 得到的色标列表
+        direction (str): horizontal / vertical / diagonal / radial
+
+    Returns:
+        PIL.Image: RGBA 渐变图像（未知方向时返回全透明图像）
+    """
+    if direction == 'horizontal':
+        row = Image.frombytes('RGBA', (width, 1), _ramp_bytes(stops, width, width))
+        return row.resize((width, height), Image.NEAREST)
+
+    if direction == 'vertical':
+        column = Image.frombytes('RGBA', (1, height), _ramp_bytes(stops, height, height))
+        return column.resize((width, height), Image.NEAREST)
+
+    if direction == 'diagonal':
+        # 对角渐变的颜色只取决于 x + y，每一行都是同一条色带的一段连续切片
+        ramp = _ramp_bytes(stops, width + height - 1, width + height)
+        row_size = width * 4
+        data = b''.join(ramp[y * 4:y * 4 + row_size] for y in range(height))
+        return Image.frombytes('RGBA', (width, height), data)
+
+    if direction == 'radial':
+        # radial_gradient 是中心为0、四角为255的 256x256 比例图，直接拉伸到非正方形画布会变成椭圆；
+        # 改为按画布长边等比缩放后居中裁剪（box 直接取源图中对应的区域，不生成放大的中间图），
+        # 得到圆形渐变：以长边为边长的外接正方形的四角到达最后一个色标（正方形画布即画面四角）
+        scale = 127.5 / max(width, height)
+        box = (128.5 - width * scale, 128.5 - height * scale, 128.5 + width * scale, 128.5 + height * scale)
+        ratio_img = Image.radial_gradient('L').resize((width, height), Image.BILINEAR, box=box)
+        lut = [color_at(stops, v / 255) for v in range(256)]
+        channels = [ratio_img.point([color[i] for color in lut]) for i in range(3)]
+        return Image.merge('RGBA', (*channels, Image.new('L', (width, height), 255)))
+
+    return Image.new('RGBA', (width, height))
+
+
+def get_gradient(width, height, stops, direction='horizontal'):
+    """
+    获取渐变背景，命中缓存时直接返回已渲染的底图
+
+    返回的图像在所有调用方之间共享，不要原地修改；
+    GeometricCanvas.render 会在绘制前复制一份。
+    """
+    key = (width, height, tuple(stops), direction)
+    return gradient_cache.get_or_create(key, lambda: render_gradient(width, height, stops, direction))
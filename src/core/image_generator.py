@@ -1,6 +1,30 @@
-from PIL import Image, ImageDraw, ImageFont
-import os
+from contextlib import nullcontext
+from PIL import Image, ImageDraw
 from .generate_geometry import GeometricCanvas
+from .font_manager import font_manager
+from .glyph_cache import glyph_cache
+from .output import flatten
+from .render_cache import LRUCache
+
+# 横线遮罩缓存：遮罩只与尺寸、间距和边框有关，颜色在粘贴时填充
+scanline_cache = LRUCache(max_bytes=64 * 1024 * 1024)
+
+# 文字图层缓存：已完成旋转/翻转的RGBA文字图像
+sprite_cache = LRUCache(max_bytes=128 * 1024 * 1024)
+
+# 背景底图缓存：背景色、渐变、几何形状、边框和横线合成后的RGB图像
+plate_cache = LRUCache(max_bytes=256 * 1024 * 1024)
+
+def _rects_overlap(a, b):
+    """判断两个矩形 (x0, y0, x1, y1) 是否相交"""
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def _zip_longest_states(old_states, new_states):
+    """按索引配对新旧状态列表，缺少的一侧为None"""
+    for i in range(max(len(old_states), len(new_states))):
+        old = old_states[i] if i < len(old_states) else None
+        new = new_states[i] if i < len(new_states) else None
+        yield old, new
 
 class ImageGenerator:
     def __init__(self):
@@ -26,14 +50,152 @@ class ImageGenerator:
         self.gradient_color1 = "#f8f9fa"
         self.gradient_color2 = "#e9ecef"
         self.gradient_direction = "horizontal"
+        self.gradient_stops = None  # 可选多色标 [(位置0~1, "#rrggbb"), ...]
         
         # 文字方向和效果选项
         self.text_directions = ['水平 (左→右)', '垂直 (上→下)', '水平 (右→左)']
         self.flip_options = ['无', '水平翻转', '垂直翻转', '水平+垂直翻转']
         self.rotation_options = ['0°', '45°', '90°', '135°', '180°', '225°', '270°', '315°']
+        
+        # 增量渲染：保留上一帧，只重新合成发生变化的区域
+        # 开启后 create_image 会复用并原地更新上一次返回的图像
+        self.incremental_render = False
+        self.verify_incremental = False  # 调试用：每次增量渲染后与完整渲染逐字节比对
+        self.render_stats = {
+            'full_renders': 0,
+            'incremental_renders': 0,
+            'pixels_recomposited': 0,
+            'last_pixels_recomposited': 0,
+        }
+        self._last_frame = None
+        self._last_plate_key = None
+        self._last_layer_states = []
+        self._last_shape_states = []
+        
+        # 性能分析：赋值为 RenderTimings 后记录每个渲染阶段的耗时和内存分配
+        self.timings = None
     
     def create_image(self):
-        """创建完整的图像"""
+        """创建完整的图像
+        
+        渲染分为两个阶段：与文字无关的背景底图（按全部非文字设置缓存），
+        以及在底图副本上合成文字层。只修改文字时只需重新合成文字。
+        开启 incremental_render 后只重新合成变化的文字层和形状所覆盖的区域。
+        
+        增量渲染时返回的图像是生成器内部保留的上一帧，下一次调用 create_image 会原地修改它；
+        需要在之后继续使用本次结果时，调用方应自行 copy()。
+        """
+        if not self.incremental_render:
+            with self.stage('plate'):
+                img = self.get_background_plate().copy()
+            self.composite_text_layers(img)
+            return img
+        
+        plate_key = self.plate_key()
+        with self.stage('plate'):
+            plate = self.get_background_plate(plate_key)
+        placements = self.text_layer_placements()
+        layer_states = [(state, box) for state, _, box in placements]
+        shape_states = [(shape.signature(), shape.bounds()) for shape in self.geometry_shapes]
+        
+        dirty_rects = self._find_dirty_rects(plate_key, layer_states, shape_states)
+        if dirty_rects is None:
+            with self.stage('plate'):
+                frame = plate.copy()
+            self.composite_text_layers(frame, placements)
+            pixels = self.width * self.height
+            self.render_stats['full_renders'] += 1
+        else:
+            frame = self._last_frame
+            pixels = 0
+            with self.stage('paste'):
+                for rect in dirty_rects:
+                    # 从底图恢复脏区域，再按顺序合成与之重叠的文字层（粘贴时自动裁剪到区域内）
+                    region = plate.crop(rect)
+                    for _, text_img, box in placements:
+                        if box and _rects_overlap(box, rect):
+                            region.paste(text_img, (box[0] - rect[0], box[1] - rect[1]), text_img)
+                    frame.paste(region, rect[:2])
+                    pixels += (rect[2] - rect[0]) * (rect[3] - rect[1])
+            self.render_stats['incremental_renders'] += 1
+        
+        self.render_stats['pixels_recomposited'] += pixels
+        self.render_stats['last_pixels_recomposited'] = pixels
+        self._last_frame = frame
+        self._last_plate_key = plate_key
+        self._last_layer_states = layer_states
+        self._last_shape_states = shape_states
+        
+        if self.verify_incremental and dirty_rects is not None:
+            expected = self.composite_text_layers(plate.copy(), placements)
+            if expected.tobytes() != frame.tobytes():
+                raise RuntimeError(f"增量渲染结果与完整渲染不一致，脏区域: {dirty_rects}")
+        
+        return frame
+    
+    def stage(self, name):
+        """返回记录渲染阶段的上下文管理器；未开启性能分析时不做任何事"""
+        if self.timings is None:
+            return nullcontext()
+        return self.timings.stage(name)
+    
+    def _find_dirty_rects(self, plate_key, layer_states, shape_states):
+        """
+        比较本次与上一帧的状态，返回需要重新合成的矩形列表
+        
+        Returns:
+            list | None: 脏矩形列表；需要完整渲染时返回None
+        """
+        if self._last_frame is None or self._last_plate_key is None:
+            return None
+        # 除几何形状外的底图设置变化（尺寸、颜色、边框、横线、渐变）需要完整渲染
+        if plate_key[:-1] != self._last_plate_key[:-1]:
+            return None
+        
+        rects = []
+        for old, new in _zip_longest_states(self._last_shape_states, shape_states):
+            if old != new:
+                rects.extend(item[1] for item in (old, new) if item)
+        for old, new in _zip_longest_states(self._last_layer_states, layer_states):
+            if old != new:
+                rects.extend(item[1] for item in (old, new) if item and item[1])
+        
+        clipped = []
+        for x0, y0, x1, y1 in rects:
+            rect = (max(0, x0), max(0, y0), min(self.width, x1), min(self.height, y1))
+            if rect[0] < rect[2] and rect[1] < rect[3] and rect not in clipped:
+                clipped.append(rect)
+        
+        # 脏区域总面积超过整幅画面时直接完整渲染
+        area = sum((r[2] - r[0]) * (r[3] - r[1]) for r in clipped)
+        if area >= self.width * self.height:
+            return None
+        return clipped
+    
+    def plate_key(self):
+        """返回背景底图的缓存键，包含所有非文字设置"""
+        gradient = None
+        if self.enable_gradient:
+            stops = tuple(tuple(stop) for stop in self.gradient_stops) if self.gradient_stops else None
+            gradient = (self.gradient_color1, self.gradient_color2, self.gradient_direction, stops)
+        lines = None
+        if self.add_lines and self.line_spacing > 0:
+            lines = (self.line_opacity, self.line_color, self.line_spacing)
+        return (
+            self.width, self.height, self.main_color,
+            self.border_color, self.border_height,
+            lines, gradient,
+            tuple(shape.signature() for shape in self.geometry_shapes),
+        )
+    
+    def get_background_plate(self, key=None):
+        """获取背景底图（共享的缓存对象，不要原地修改）；key 为已算好的 plate_key()"""
+        if key is None:
+            key = self.plate_key()
+        return plate_cache.get_or_create(key, self.render_background)
+    
+    def render_background(self):
+        """渲染背景底图：背景色、渐变、几何形状、边框和横线"""
         # 创建几何画布
         canvas = GeometricCanvas(self.width, self.height, self.hex_to_rgb(self.main_color))
         
@@ -44,114 +206,154 @@ class ImageGenerator:
         # 创建渐变背景（如果启用）
         gradient_bg = None
         if self.enable_gradient:
-            color1 = self.hex_to_rgb(self.gradient_color1)
-            color2 = self.hex_to_rgb(self.gradient_color2)
-            gradient_bg = canvas.create_gradient_background(color1, color2, self.gradient_direction)
-        
-        # 渲染几何图形
-        if self.geometry_shapes or self.enable_gradient:
-            img = canvas.render(gradient_bg)
-            # 转换为RGB模式以便后续处理
-            if img.mode == 'RGBA':
-                background = Image.new('RGB', img.size, self.hex_to_rgb(self.main_color))
-                background.paste(img, mask=img.split()[3])
-                img = background
-        else:
-            # 创建基础图像
-            img = Image.new('RGB', (self.width, self.height), self.main_color)
-        
-        draw = ImageDraw.Draw(img)
+            with self.stage('gradient'):
+                color1 = self.hex_to_rgb(self.gradient_color1)
+                color2 = self.hex_to_rgb(self.gradient_color2)
+                stops = None
+                if self.gradient_stops:
+                    stops = [(pos, self.hex_to_rgb(color)) for pos, color in self.gradient_stops]
+                gradient_bg = canvas.create_gradient_background(color1, color2, self.gradient_direction, stops)
+        
+        # 渲染几何图形，合成到RGB底图上以便后续处理
+        main_rgb = self.hex_to_rgb(self.main_color)
+        with self.stage('geometry'):
+            if self.geometry_shapes:
+                img = canvas.render(gradient_bg, mode='RGB')
+            elif gradient_bg is not None:
+                # 没有形状时直接合成共享的渐变底图，省去 render 的整幅复制
+                img = flatten(gradient_bg, main_rgb)
+            else:
+                # 创建基础图像
+                img = Image.new('RGB', (self.width, self.height), self.main_color)
         
         # 添加上下边框
         if self.border_height > 0:
-            # 上边框
-            draw.rectangle([0, 0, self.width, self.border_height], fill=self.border_color)
-            # 下边框
-            draw.rectangle([0, self.height-self.border_height, self.width, self.height], fill=self.border_color)
+            with self.stage('border'):
+                draw = ImageDraw.Draw(img)
+                # 上边框
+                draw.rectangle([0, 0, self.width, self.border_height], fill=self.border_color)
+                # 下边框
+                draw.rectangle([0, self.height-self.border_height, self.width, self.height], fill=self.border_color)
         
         # 添加横线效果
         if self.add_lines and self.line_spacing > 0:
-            # 计算横线颜色（应用透明度）
-            main_rgb = self.hex_to_rgb(self.main_color)
-            line_rgb = self.hex_to_rgb(self.line_color)
-            
-            # 混合颜色（模拟透明度效果）
-            alpha = self.line_opacity / 100.0
-            blended_rgb = tuple(
-                int(line_rgb[i] * alpha + main_rgb[i] * (1 - alpha))
-                for i in range(3)
-            )
-            blended_color = f"#{blended_rgb[0]:02x}{blended_rgb[1]:02x}{blended_rgb[2]:02x}"
-            
-            # 绘制细横线，使用用户设定的间隔
-            for y in range(self.border_height, self.height - self.border_height, self.line_spacing):
-                draw.line([0, y, self.width, y], fill=blended_color, width=1)
+            with self.stage('scanlines'):
+                # 计算横线颜色（应用透明度）
+                main_rgb = self.hex_to_rgb(self.main_color)
+                line_rgb = self.hex_to_rgb(self.line_color)
+                
+                # 混合颜色（模拟透明度效果）
+                alpha = self.line_opacity / 100.0
+                blended_rgb = tuple(
+                    int(line_rgb[i] * alpha + main_rgb[i] * (1 - alpha))
+                    for i in range(3)
+                )
+                
+                # 一次性通过横线遮罩填充所有细横线，使用用户设定的间隔
+                img.paste(blended_rgb, (0, 0), self.get_scanline_mask())
         
-        # 渲染所有文字层
-        for layer in self.text_layers:
-            text_img = self.create_text_layer_image(layer)
+        return img
+    
+    def composite_text_layers(self, img, placements=None):
+        """把所有文字层合成到图像上（原地修改并返回img）"""
+        if placements is None:
+            placements = self.text_layer_placements()
+        
+        with self.stage('paste'):
+            for _, text_img, box in placements:
+                if text_img:
+                    # 粘贴文字图像
+                    if text_img.mode == 'RGBA':
+                        img.paste(text_img, box[:2], text_img)
+                    else:
+                        img.paste(text_img, box[:2])
+        
+        return img
+    
+    def text_layer_placements(self):
+        """
+        计算每个文字层的图像和位置
+        
+        Returns:
+            list: [(状态, 文字图像, 矩形), ...]，状态为 (图层缓存键, 矩形)，
+                  空文字层的图像和矩形为None
+        """
+        placements = []
+        for index, layer in enumerate(self.text_layers):
+            with self.stage(f'text[{index}]'):
+                key = self.text_layer_key(layer)
+                text_img = self._text_layer_image(key)
+            box = None
             if text_img:
                 # 计算粘贴位置
                 text_width, text_height = text_img.size
                 x = (self.width - text_width) // 2 + layer['x_offset']
                 y = (self.height - text_height) // 2 + layer['y_offset']
-                
-                # 粘贴文字图像
-                if text_img.mode == 'RGBA':
-                    img.paste(text_img, (x, y), text_img)
-                else:
-                    img.paste(text_img, (x, y))
-        
-        return img
+                box = (x, y, x + text_width, y + text_height)
+            placements.append(((key, box), text_img, box))
+        return placements
+    
+    def get_scanline_mask(self):
+        """获取横线遮罩（二值图，横线所在行为1），按尺寸、间距和边框缓存"""
+        key = (self.width, self.height, self.line_spacing, self.border_height)
+        
+        def build():
+            rows = range(self.border_height, self.height - self.border_height, self.line_spacing)
+            column = bytearray(self.height)
+            for y in rows:
+                if 0 <= y < self.height:
+                    column[y] = 255
+            # 单列遮罩横向拉伸到整幅宽度；二值遮罩粘贴时走整行复制，不做逐像素混合
+            column_img = Image.frombytes('L', (1, self.height), bytes(column))
+            return column_img.convert('1', dither=Image.Dither.NONE).resize(
+                (self.width, self.height), Image.NEAREST)
+        
+        return scanline_cache.get_or_create(key, build)
     
     def create_text_layer_image(self, layer):
-        """创建单个文字层的图像"""
+        """创建单个文字层的图像
+        
+        渲染结果按 (内容, 字号, 颜色, 字体, 方向, 翻转, 旋转) 缓存，
+        只改变位置或重复渲染相同场景时不会重新光栅化文字。
+        返回的图像在多次渲染之间共享，不要原地修改。
+        """
+        return self._text_layer_image(self.text_layer_key(layer))
+    
+    def _text_layer_image(self, key):
+        """按 text_layer_key() 返回的键获取文字层图像，key为None（空文字层）时返回None"""
+        if key is None:
+            return None
+        
+        text_img = sprite_cache.get(key)
+        if text_img is None:
+            text_img = self.render_text_layer(*key)
+            if text_img is not None:
+                sprite_cache.put(key, text_img)
+        return text_img
+    
+    def text_layer_key(self, layer):
+        """返回文字层图像的缓存键，空文字层返回None"""
         text_content = layer['content']
         if not text_content.strip():
             return None
         
-        text_size = layer['size']
-        text_color = layer['color']
-        font_path = layer['font_path']
-        direction = layer.get('direction', 'horizontal_ltr')
-        flip = layer.get('flip', 'none')
-        rotation = layer.get('rotation', 0)
-        
-        # 加载字体
-        try:
-            if font_path and os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, text_size)
-            else:
-                # 优先使用本地中文字体
-                try:
-                    # 尝试加载本地songti.ttc字体
-                    local_font_path = os.path.join("assets", "fonts", "Songti.ttc")
-                    if os.path.exists(local_font_path):
-                        font = ImageFont.truetype(local_font_path, text_size)
-                    else:
-                        raise FileNotFoundError("本地字体文件不存在")
-                except:
-                    try:
-                        # Windows系统字体
-                        font = ImageFont.truetype("C:/Windows/Fonts/simhei.ttf", text_size)
-                    except:
-                        try:
-                            # macOS中文字体
-                            font = ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", text_size)
-                        except:
-                            try:
-                                # 备用macOS字体
-                                font = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", text_size)
-                            except:
-                                try:
-                                    # Linux
-                                    font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", text_size)
-                                except:
-                                    # 默认字体
-                                    font = ImageFont.load_default()
-        except Exception as e:
-            print(f"字体加载失败: {e}")
-            font = ImageFont.load_default()
+        return (
+            text_content,
+            layer['size'],
+            layer['color'],
+            font_manager.resolve_path(layer['font_path']),
+            layer.get('font_index', 0),
+            layer.get('direction', 'horizontal_ltr'),
+            layer.get('flip', 'none'),
+            layer.get('rotation', 0),
+        )
+    
+    def render_text_layer(self, text_content, text_size, text_color, font_path, font_index,
+                          direction, flip, rotation):
+        """光栅化单个文字层（含旋转和翻转），不经过缓存"""
+        # 加载字体（备用字体链和字体对象均由字体管理器缓存）
+        with self.stage('font'):
+            font = font_manager.get_font(font_path, text_size, font_index)
         
         # 根据文字方向创建基础文字图像
         if direction == 'vertical':
@@ -164,26 +366,28 @@ class ImageGenerator:
         if text_img is None:
             return None
         
-        # 应用旋转
-        if rotation != 0:
-            text_img = text_img.rotate(-rotation, expand=True)  # 注意方向
+        if rotation == 0 and flip not in ('horizontal', 'vertical', 'both'):
+            return text_img
         
-        # 应用翻转
-        if flip == 'horizontal':
-            text_img = text_img.transpose(Image.FLIP_LEFT_RIGHT)
-        elif flip == 'vertical':
-            text_img = text_img.transpose(Image.FLIP_TOP_BOTTOM)
-        elif flip == 'both':
-            text_img = text_img.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.FLIP_TOP_BOTTOM)
+        with self.stage('rotate/flip'):
+            # 应用旋转
+            if rotation != 0:
+                text_img = text_img.rotate(-rotation, expand=True)  # 注意方向
+            
+            # 应用翻转
+            if flip == 'horizontal':
+                text_img = text_img.transpose(Image.FLIP_LEFT_RIGHT)
+            elif flip == 'vertical':
+                text_img = text_img.transpose(Image.FLIP_TOP_BOTTOM)
+            elif flip == 'both':
+                text_img = text_img.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.FLIP_TOP_BOTTOM)
         
         return text_img
     
     def create_horizontal_text(self, text, font, color):
         """创建水平文字图像"""
-        # 计算文字尺寸
-        temp_img = Image.new('RGB', (1, 1))
-        temp_draw = ImageDraw.Draw(temp_img)
-        bbox = temp_draw.textbbox((0, 0), text, font=font)
+        # 计算文字尺寸（包围盒由字形缓存测量并缓存）
+        bbox = glyph_cache.measure(font, text)
         text_width = bbox[2] - bbox[0]
         text_height = bbox[3] - bbox[1]
         
@@ -210,28 +414,13 @@ class ImageGenerator:
         if not text:
             return None
         
-        # 计算单个字符的最大尺寸和边界信息
-        temp_img = Image.new('RGB', (1, 1))
-        temp_draw = ImageDraw.Draw(temp_img)
-        
-        max_char_width = 0
-        char_info = []  # 存储每个字符的尺寸和边界信息
-        
-        for char in text:
-            bbox = temp_draw.textbbox((0, 0), char, font=font)
-            char_width = bbox[2] - bbox[0]
-            char_height = bbox[3] - bbox[1]
-            max_char_width = max(max_char_width, char_width)
-            char_info.append({
-                'char': char,
-                'bbox': bbox,
-                'width': char_width,
-                'height': char_height
-            })
+        # 从字形缓存获取每个字符的尺寸、边界信息和光栅化遮罩
+        char_info = [glyph_cache.get_glyph(font, char) for char in text]
+        max_char_width = max(info.width for info in char_info)
         
         # 改进间距计算
-        line_spacing = max(8, int(max([info['height'] for info in char_info]) * 0.3))
-        total_height = sum([info['height'] for info in char_info]) + (len(text) - 1) * line_spacing
+        line_spacing = max(8, int(max(info.height for info in char_info) * 0.3))
+        total_height = sum(info.height for info in char_info) + (len(text) - 1) * line_spacing
         
         if max_char_width <= 0 or total_height <= 0:
             return None
@@ -242,21 +431,15 @@ class ImageGenerator:
         
         # 创建垂直文字图像
         text_img = Image.new('RGBA', (max_char_width + padding_x * 2, total_height + padding_y * 2), (0, 0, 0, 0))
-        text_draw = ImageDraw.Draw(text_img)
         
+        # 逐字粘贴缓存的字形遮罩，不再调用FreeType
         current_y = padding_y
         for i, info in enumerate(char_info):
-            char = info['char']
-            bbox = info['bbox']
-            char_width = info['width']
-            char_height = info['height']
-            
-            # 计算字符居中位置，并补偿边界偏移
-            char_x = (max_char_width - char_width) // 2 + padding_x - bbox[0]
-            char_y = current_y - bbox[1]  # 补偿bbox的上偏移
-            
-            text_draw.text((char_x, char_y), char, fill=color, font=font)
-            current_y += char_height
+            if info.mask is not None:
+                # 字符水平居中，遮罩已按包围盒裁剪，无需再补偿边界偏移
+                char_x = (max_char_width - info.width) // 2 + padding_x
+                text_img.paste(color, (char_x, current_y), info.mask)
+            current_y += info.height
             
             # 添加间距（除了最后一个字符）
             if i < len(text) - 1:
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import OrderedDict
+from PIL import Image
+
+from .output import format_bytes
+
+# 当前线程正在计时的阶段栈
+_local = threading.local()
+_hook_lock = threading.Lock()
+# 正在计时的线程数（各线程最外层的阶段各计一次）和被替换的原始入口
+_hook_users = 0
+_original_new = None
+
+
+def _acquire_allocation_hook():
+    """
+    在 Pillow 创建图像对象的入口记录像素缓冲区分配
+
+    Pillow 的像素内存由C代码分配，tracemalloc 统计不到；所有新图像都经过
+    Image.Image._new，在这里按尺寸和模式累计字节数。钩子只在有线程正在计时时安装，
+    且只记录当前线程正在计时的阶段；与 _release_allocation_hook 成对调用。
+    """
+    global _hook_users, _original_new
+    with _hook_lock:
+        _hook_users += 1
+        if _hook_users > 1 or not hasattr(Image.Image, '_new'):
+            return
+        original_new = _original_new = Image.Image._new
+
+        def _new(self, im):
+            stack = getattr(_local, 'stack', None)
+            if stack:
+                stack[-1].record_allocation(im)
+            return original_new(self, im)
+
+        Image.Image._new = _new
+
+
+def _release_allocation_hook():
+    """最后一个计时的线程结束时恢复 Image.Image._new，计时之外的分配不再经过钩子"""
+    global _hook_users, _original_new
+    with _hook_lock:
+        _hook_users -= 1
+        if _hook_users == 0 and _original_new is not None:
+            Image.Image._new = _original_new
+            _original_new = None
+
+
+class StageStats:
+    """单个阶段的累计统计（不含嵌套子阶段）"""
+
+    __slots__ = ('calls', 'seconds', 'images', 'bytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.images = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        return {'calls': self.calls, 'seconds': self.seconds, 'images': self.images, 'bytes': self.bytes}
+
+
+class _Stage:
+    """计时上下文：退出时把自身耗时（扣除子阶段）和分配计入统计"""
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.child_seconds = 0.0
+        self.images = 0
+        self.bytes = 0
+
+    def record_allocation(self, im):
+        self.images += 1
+        width, height = im.size
+        self.bytes += width * height * Image.getmodebands(im.mode)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if not stack:
+            _acquire_allocation_hook()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].child_seconds += elapsed
+        else:
+            _release_allocation_hook()
+        self.timings._add(self.name, elapsed - self.child_seconds, self.images, self.bytes)
+        return False
+
+
+class RenderTimings:
+    """
+    渲染各阶段的耗时和内存分配统计
+
+    把实例赋给 ImageGenerator.timings 即开启记录，多次渲染累计到同一对象；
+    阶段可以嵌套，每个阶段只统计自身（扣除子阶段后）的耗时和分配。
+    分配钩子在有阶段正在计时时才安装，计时之外的渲染不受影响。
+
+    stages 为按首次出现顺序排列的 {阶段名: StageStats}。
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """返回记录指定阶段的上下文管理器"""
+        return _Stage(self, name)
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self.stages.clear()
+
+    def total_seconds(self):
+        """所有阶段的总耗时"""
+        return sum(stats.seconds for stats in self.stages.values())
+
+    def as_dict(self):
+        """返回 {阶段名: {calls, seconds, images, bytes}}"""
+        return {name: stats.as_dict() for name, stats in self.stages.items()}
+
+    def format_table(self):
+        """格式化为文本表格"""
+        total = self.total_seconds()
+        rows = [('阶段', '次数', '耗时(ms)', '占比', '新图像', '分配')]
+        for name, stats in self.stages.items():
+            share = stats.seconds / total * 100 if total else 0
+            rows.append((
+                name, str(stats.calls), f"{stats.seconds * 1000:.2f}", f"{share:.1f}%",
+                str(stats.images), format_bytes(stats.bytes),
+            ))
+        rows.append((
+            '合计', '', f"{total * 1000:.2f}", '100.0%' if total else '0.0%',
+            str(sum(s.images for s in self.stages.values())),
+            format_bytes(sum(s.bytes for s in self.stages.values())),
+        ))
+        widths = [max(_display_width(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = []
+        for index, row in enumerate(rows):
+            cells = [_pad(row[0], widths[0], left=True)]
+            cells.extend(_pad(cell, width) for cell, width in zip(row[1:], widths[1:]))
+            lines.append('  '.join(cells))
+            if index == 0 or index == len(rows) - 2:
+                lines.append('-' * (sum(widths) + 2 * (len(widths) - 1)))
+        return '\n'.join(lines)
+
+    def _add(self, name, seconds, images, nbytes):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.images += images
+            stats.bytes += nbytes
+
+
+def _display_width(text):
+    """终端显示宽度（中文字符占两列）"""
+    return sum(2 if ord(ch) > 0x2E80 else 1 for ch in text)
+
+
+def _pad(text, width, left=False):
+    padding = ' ' * (width - _display_width(text))
+    return text + padding if left else padding + text
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import re
+from .font_manager import font_manager
+from .output import temp_path
+
+# 渲染器版本：渲染结果发生变化（算法、默认值等）时递增，使旧清单全部失效
+RENDERER_VERSION = 1
+
+# 清单文件名（保存在输出目录中）
+MANIFEST_NAME = "render_manifest.json"
+
+# 断点续传日志文件名（保存在输出目录中，运行正常结束后删除）
+JOURNAL_NAME = "render_journal.jsonl"
+
+# 分片方式：index 按场景序号轮流分配，name 按场景名称哈希分配（增删场景不影响其它场景的归属）
+SHARD_MODES = ('index', 'name')
+
+# 分片清单文件名：render_manifest.shard-{i}-of-{N}.json
+_SHARD_MANIFEST_PATTERN = re.compile(r'^render_manifest\.shard-(\d+)-of-(\d+)\.json$')
+
+
+def _font_mtimes(scene_config):
+    """返回场景用到的字体文件修改时间 {路径: mtime_ns}"""
+    mtimes = {}
+    for layer in scene_config.get('text_layers', []):
+        path = font_manager.resolve_path(layer.get('font_path', ''))
+        if path and path not in mtimes:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+    return mtimes
+
+
+def scene_hash(scene_config):
+    """
+    计算场景的内容哈希
+
+    哈希覆盖完整的场景配置、所用字体文件的修改时间和渲染器版本，
+    任何一项变化都会使场景重新生成。
+    """
+    payload = {
+        'renderer_version': RENDERER_VERSION,
+        'config': scene_config,
+        'fonts': _font_mtimes(scene_config),
+    }
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _file_signature(path):
+    """返回输出文件的 (大小, mtime_ns)，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def manifest_entry(digest, output_path):
+    """生成场景的清单条目：内容哈希、输出文件名和输出文件签名"""
+    return {
+        'hash': digest,
+        'output': os.path.basename(output_path),
+        'file': _file_signature(output_path),
+    }
+
+
+def _entry_current(entry, digest, output_path):
+    """记录的哈希与输出文件是否与当前一致"""
+    if entry is None or entry.get('hash') != digest:
+        return False
+    if entry.get('output') != os.path.basename(output_path):
+        return False
+    signature = _file_signature(output_path)
+    return signature is not None and signature == entry.get('file')
+
+
+def parse_shard(spec):
+    """
+    解析分片参数 "i/N"（i 从1开始）
+
+    Returns:
+        tuple: (i, N)
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', str(spec))
+    if match is None:
+        raise ValueError(f"分片格式错误: {spec}（应为 i/N，例如 1/4）")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"分片序号超出范围: {spec}（i 应在 1 到 N 之间）")
+    return index, count
+
+
+def shard_of(position, scene_name, count, by='index'):
+    """
+    返回场景所属的分片序号（1..count）
+
+    分配只取决于场景序号或名称，与机器、进程和运行顺序无关，
+    各分片独立计算即可得到互不重叠、合起来覆盖全部场景的划分。
+
+    Args:
+        position (int): 场景在配置中的序号（从1开始）
+        scene_name (str): 场景名称
+        count (int): 分片总数
+        by (str): 分片方式，见 SHARD_MODES
+    """
+    if by == 'index':
+        return (position - 1) % count + 1
+    if by == 'name':
+        digest = hashlib.sha256(scene_name.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') % count + 1
+    raise ValueError(f"未知的分片方式: {by}（可选: {', '.join(SHARD_MODES)}）")
+
+
+def shard_manifest_name(index, count):
+    """分片清单文件名"""
+    return f"render_manifest.shard-{index}-of-{count}.json"
+
+
+def shard_journal_name(index, count):
+    """分片断点续传日志文件名"""
+    return f"render_journal.shard-{index}-of-{count}.jsonl"
+
+
+def find_shard_manifests(output_dir):
+    """
+    查找输出目录中的分片清单
+
+    Returns:
+        dict: {分片总数: {分片序号: 文件名}}
+    """
+    found = {}
+    try:
+        names = os.listdir(output_dir)
+    except OSError:
+        return found
+    for name in names:
+        match = _SHARD_MANIFEST_PATTERN.match(name)
+        if match:
+            found.setdefault(int(match.group(2)), {})[int(match.group(1))] = name
+    return found
+
+
+class RenderManifest:
+    """
+    批量渲染清单
+
+    记录每个场景的内容哈希和输出文件签名；重新运行时，哈希相同且输出文件
+    未被改动（大小和修改时间一致）的场景可以跳过。
+    """
+
+    def __init__(self, output_dir, name=MANIFEST_NAME):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, name)
+        self.scenes = {}
+        self.load()
+
+    def load(self):
+        """读取清单文件，文件不存在、损坏或渲染器版本不同时视为空清单"""
+        self.scenes = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('renderer_version') == RENDERER_VERSION:
+            self.scenes = data.get('scenes', {})
+
+    def save(self):
+        """写入清单文件（先写临时文件再替换，避免中断时留下半个文件）"""
+        data = {'renderer_version': RENDERER_VERSION, 'scenes': self.scenes}
+        # 分片和队列模式下多台机器的进程可能同时保存同一目录中的清单，临时文件按主机和进程区分
+        tmp_path = temp_path(self.path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def is_current(self, scene_name, digest, output_path):
+        """场景哈希与输出文件都未变化时返回True"""
+        return _entry_current(self.scenes.get(scene_name), digest, output_path)
+
+    def record(self, scene_name, digest, output_path):
+        """记录成功生成的场景，返回记录条目"""
+        entry = self.scenes[scene_name] = manifest_entry(digest, output_path)
+        return entry
+
+    def discard(self, scene_name):
+        """移除场景记录（生成失败时调用，下次运行会重新生成）"""
+        self.scenes.pop(scene_name, None)
+
+
+class RenderJournal:
+    """
+    断点续传日志
+
+    每完成一个场景就追加一行JSON并立即刷新到文件，进程被杀死或崩溃时
+    已完成的场景不会丢失；运行正常结束、清单保存后删除日志。
+    重新运行时使用 resume=True 读取日志，日志中哈希和输出文件都一致的场景无需重新生成。
+    """
+
+    def __init__(self, output_dir, resume=False, name=JOURNAL_NAME):
+        """
+        Args:
+            output_dir (str): 输出目录
+            resume (bool): 读取并沿用已有日志；为False时丢弃旧日志重新开始
+        """
+        self.path = os.path.join(output_dir, name)
+        self.entries = {}
+        if resume:
+            self._file = open(self.path, 'a+b')
+            # 截掉崩溃时写了一半的最后一行，否则新记录会接在残片后面，下次续传时整行无法解析
+            self._file.truncate(self._read())
+        else:
+            self._file = open(self.path, 'wb')
+
+    def is_complete(self, scene_name, digest, output_path):
+        """日志中记录的场景与当前哈希、输出文件一致时返回True"""
+        return _entry_current(self.entries.get(scene_name), digest, output_path)
+
+    def append(self, scene_name, entry):
+        """追加一个已完成场景的记录"""
+        self.entries[scene_name] = entry
+        line = json.dumps({'scene': scene_name, **entry}, ensure_ascii=False) + "\n"
+        self._file.write(line.encode('utf-8'))
+        self._file.flush()
+
+    def close(self, remove=False):
+        """关闭日志文件，remove为True时删除日志"""
+        self._file.close()
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _read(self):
+        """
+        读取日志到 entries，忽略崩溃时写了一半的最后一行
+
+        Returns:
+            int: 最后一个完整行之后的字节偏移
+        """
+        self._file.seek(0)
+        end = 0
+        for line in self._file:
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'scene' in record:
+                self.entries[record.pop('scene')] = record
+        return end
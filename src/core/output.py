@@ -0,0 +1,442 @@
+from PIL import Image
+from collections import namedtuple
+from concurrent.futures import Future
+import io
+import os
+import queue
+import re
+import socket
+import threading
+import time
+
+# 输出配置：编码格式、编码参数和默认扩展名
+# - default: 按扩展名选择格式，PNG使用Pillow默认压缩级别
+# - fast: 最低压缩级别，编码最快，适合视频中间文件
+# - small: 优化压缩，颜色数不超过256时无损保存为调色板PNG，适合归档
+# - webp-lossless: 无损WebP，体积通常远小于PNG，编码较慢
+# - raw: 不压缩的PPM（二进制RGB），编码几乎不耗时，ffmpeg可直接读取
+OUTPUT_PROFILES = {
+    'default': {'format': None, 'extension': '.png', 'params': {}},
+    'fast': {'format': 'PNG', 'extension': '.png', 'params': {'compress_level': 1}},
+    'small': {'format': 'PNG', 'extension': '.png', 'params': {'optimize': True}, 'palette': True},
+    'webp-lossless': {'format': 'WEBP', 'extension': '.webp', 'params': {'lossless': True}},
+    'raw': {'format': 'PPM', 'extension': '.ppm', 'params': {}},
+}
+
+# 不支持透明度、保存前需要合成到背景色上的格式
+OPAQUE_FORMATS = ('JPEG', 'PPM')
+
+# write_atomic 临时文件名后缀：.{主机名}.{进程号}.{线程号}.tmp
+_TEMP_FILE_PATTERN = re.compile(r'\.([A-Za-z0-9-]+)\.(\d+)\.(\d+)\.tmp$')
+
+# 临时文件名中的主机名：多台机器通过共享文件系统写同一目录时，进程号只在本机有意义
+_HOST = re.sub(r'[^A-Za-z0-9-]', '-', socket.gethostname().split('.')[0]) or 'localhost'
+
+
+def get_profile(name):
+    """获取输出配置，name为空时返回default配置"""
+    name = name or 'default'
+    if name not in OUTPUT_PROFILES:
+        raise ValueError(f"未知的输出配置: {name}（可选: {', '.join(OUTPUT_PROFILES)}）")
+    return OUTPUT_PROFILES[name]
+
+
+def profile_extension(name):
+    """返回输出配置对应的文件扩展名"""
+    return get_profile(name)['extension']
+
+
+def flatten(image, background=(255, 255, 255)):
+    """
+    把RGBA图像合成到纯色背景上
+
+    直接以图像自身作为遮罩粘贴（Pillow使用其alpha通道），不再通过 split()
+    拆出四个通道缓冲区；非RGBA图像原样返回，不产生任何复制。
+    """
+    if image.mode != 'RGBA':
+        return image
+    result = Image.new('RGB', image.size, background)
+    result.paste(image, (0, 0), image)
+    return result
+
+
+def to_palette(image, max_colors=256):
+    """
+    颜色数不超过 max_colors 时无损转换为P模式图像
+
+    调色板直接取自 getcolors() 的结果，像素按查找表映射到调色板序号，结果与原图逐像素一致，
+    不需要量化或比对；颜色过多或模式不支持时返回None。
+    """
+    if image.mode not in ('RGB', 'L'):
+        return None
+    colors = image.getcolors(max_colors)
+    if colors is None:
+        return None
+    colors = [color for _, color in colors]
+    if image.mode == 'L':
+        indexed = image.point(_index_lut(256, {value: index for index, value in enumerate(colors)}))
+        palette = [value for value in colors for _ in range(3)]
+    else:
+        indexed = _index_rgb(image, colors)
+        palette = [channel for color in colors for channel in color]
+    # putpalette 把L模式的序号图直接转为P模式，不复制像素
+    indexed.putpalette(palette)
+    return indexed
+
+
+def _index_lut(size, mapping):
+    """查找表：mapping 中的键映射到对应序号，其余为0"""
+    lut = [0] * size
+    for key, index in mapping.items():
+        lut[key] = index
+    return lut
+
+
+def _pair_key(high, low):
+    """两个L通道组成16位键 high * 256 + low（32位整数图像，可以用65536项查找表映射）"""
+    zero = Image.new('L', high.size)
+    packed = Image.merge('RGBA', (low, high, zero, zero))
+    return Image.frombuffer('I', high.size, packed.tobytes(), 'raw', 'I', 0, 1)
+
+
+def _index_rgb(image, colors):
+    """
+    把RGB图像的每个像素映射为其颜色在 colors 中的序号（L模式）
+
+    能区分全部颜色的通道越少，需要处理的整幅缓冲区越少：单个通道只需一次查表，
+    两个通道组成16位键查表；都不能区分时先把 (G, B) 压缩为序号，再与R组成16位键。
+    """
+    for band in range(3):
+        mapping = {color[band]: index for index, color in enumerate(colors)}
+        if len(mapping) == len(colors):
+            return image.getchannel(band).point(_index_lut(256, mapping))
+
+    bands = image.split()
+    for high, low in ((0, 1), (1, 2), (0, 2)):
+        mapping = {color[high] * 256 + color[low]: index for index, color in enumerate(colors)}
+        if len(mapping) == len(colors):
+            return _pair_key(bands[high], bands[low]).point(_index_lut(65536, mapping), 'L')
+
+    gb_ids = {}
+    for color in colors:
+        gb_ids.setdefault(color[1] * 256 + color[2], len(gb_ids))
+    gb = _pair_key(bands[1], bands[2]).point(_index_lut(65536, gb_ids), 'L')
+    mapping = {color[0] * 256 + gb_ids[color[1] * 256 + color[2]]: index for index, color in enumerate(colors)}
+    return _pair_key(bands[0], gb).point(_index_lut(65536, mapping), 'L')
+
+
+# 可由扩展名判断的输出格式
+EXTENSION_FORMATS = {
+    '.jpg': 'JPEG', '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.webp': 'WEBP',
+    '.ppm': 'PPM', '.pnm': 'PPM',
+}
+
+
+def detect_format(path, default='PNG'):
+    """根据文件扩展名判断输出格式"""
+    return EXTENSION_FORMATS.get(os.path.splitext(path)[1].lower(), default)
+
+
+def check_profile_extension(path, profile):
+    """
+    检查输出文件扩展名与输出配置的格式是否一致
+
+    指定了格式的输出配置（例如 webp-lossless）不能写入扩展名表示其它格式的文件，
+    否则文件内容与扩展名不符；没有扩展名或扩展名未知时按输出配置的格式保存。
+    """
+    settings = get_profile(profile)
+    extension_format = detect_format(path, None)
+    if settings['format'] and extension_format and extension_format != settings['format']:
+        raise ValueError(f"输出文件扩展名与输出配置不符: {path}（{profile} 输出 {settings['format']}，"
+                         f"请使用 {settings['extension']} 扩展名）")
+
+
+# 编码结果
+# - seconds: 编码并写入文件的耗时（不含用于对比的RGB参考编码）
+# - nbytes: 写入的文件字节数
+# - palette_colors: 保存为调色板PNG时的颜色数，否则为None
+# - rgb_nbytes: 同样参数保存为RGB时的字节数，只在要求对比时测量，否则为None
+EncodeResult = namedtuple('EncodeResult', ['seconds', 'nbytes', 'palette_colors', 'rgb_nbytes'])
+
+
+def save_image(image, path, format=None, background=(255, 255, 255), profile=None, palette=None, **params):
+    """
+    保存图像，编码时最多做一次RGBA→RGB合成
+
+    Args:
+        image (PIL.Image): 要保存的图像
+        path (str): 输出文件路径
+        format (str, optional): 输出格式，默认使用输出配置的格式或根据扩展名判断（未知扩展名使用PNG）；
+            未指定时扩展名与输出配置的格式不符会抛出 ValueError
+        background (tuple): JPEG等不支持透明度的格式合成时使用的背景色
+        profile (str, optional): 输出配置名称，见 OUTPUT_PROFILES
+        palette (bool, optional): PNG颜色数不超过256时无损保存为调色板PNG，默认由输出配置决定
+        **params: 传给 Image.save 的编码参数，优先于输出配置中的参数
+
+    Returns:
+        int: 写入的文件字节数
+    """
+    return encode_image(image, path, format, background, profile, palette, **params).nbytes
+
+
+def encode_image(image, path, format=None, background=(255, 255, 255), profile=None, palette=None,
+                 compare_rgb=False, **params):
+    """
+    保存图像并返回编码结果
+
+    参数与 save_image 相同；compare_rgb 为True且图像保存为调色板PNG时，
+    额外在内存中按RGB编码一次，用于统计调色板节省的字节数。
+
+    Returns:
+        EncodeResult: 编码结果
+    """
+    start = time.perf_counter()
+    settings = get_profile(profile)
+    params = {**settings['params'], **params}
+    if format is None:
+        check_profile_extension(path, profile)
+        format = settings['format'] or detect_format(path)
+    if palette is None:
+        palette = settings.get('palette', False)
+    if format in OPAQUE_FORMATS:
+        # JPEG/PPM不支持透明度
+        image = flatten(image, background)
+    if format == 'JPEG':
+        params.setdefault('quality', 95)
+
+    palette_colors = None
+    rgb_nbytes = None
+    reference_seconds = 0.0
+    if format == 'PNG' and palette:
+        palette_image = to_palette(image)
+        if palette_image is not None:
+            if compare_rgb:
+                reference_start = time.perf_counter()
+                buffer = io.BytesIO()
+                image.save(buffer, format, **params)
+                rgb_nbytes = buffer.tell()
+                reference_seconds = time.perf_counter() - reference_start
+            palette_colors = len(palette_image.palette.colors)
+            image = palette_image
+
+    write_atomic(image, path, format, **params)
+    seconds = time.perf_counter() - start - reference_seconds
+    return EncodeResult(seconds, os.path.getsize(path), palette_colors, rgb_nbytes)
+
+
+def temp_path(path):
+    """
+    目标文件的临时文件名：{path}.{主机名}.{进程号}.{线程号}.tmp
+
+    多台机器的多个进程、线程同时写同一目标时互不冲突，已退出进程留下的文件可由 remove_stale_temp_files 清理。
+    """
+    return f"{path}.{_HOST}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def write_atomic(image, path, format, **params):
+    """
+    先写入同目录下的临时文件再重命名为目标文件
+
+    进程在编码途中崩溃时只会留下临时文件，目标路径上要么是旧文件要么是完整的新文件。
+    """
+    tmp_path = temp_path(path)
+    try:
+        image.save(tmp_path, format, **params)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def remove_stale_temp_files(directory):
+    """
+    删除目录中由已退出进程留下的 write_atomic 临时文件
+
+    仍在运行的进程（例如同一目录下的其它分片）和其它主机上进程的临时文件不会被删除。
+    Windows 上无法安全地探测进程是否存活，不做清理。
+
+    Returns:
+        int: 删除的文件数
+    """
+    if os.name == 'nt':
+        return 0
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        match = _TEMP_FILE_PATTERN.search(name)
+        if match is None or match.group(1) != _HOST or _pid_alive(int(match.group(2))):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def _pid_alive(pid):
+    """进程是否仍在运行"""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 没有权限发送信号，说明进程存在
+        return True
+    return True
+
+
+class EncodeStats:
+    """按输出配置累计编码次数、耗时、输出字节数和调色板节省的字节数"""
+
+    def __init__(self):
+        self.profiles = {}
+
+    def add(self, profile, result):
+        """记录一次编码（result 为 EncodeResult）"""
+        entry = self.profiles.setdefault(profile or 'default', {
+            'count': 0, 'seconds': 0.0, 'bytes': 0,
+            'palette_count': 0, 'palette_bytes': 0,
+            'sampled_palette_bytes': 0, 'sampled_rgb_bytes': 0,
+        })
+        entry['count'] += 1
+        entry['seconds'] += result.seconds
+        entry['bytes'] += result.nbytes
+        if result.palette_colors is not None:
+            entry['palette_count'] += 1
+            entry['palette_bytes'] += result.nbytes
+            if result.rgb_nbytes is not None:
+                entry['sampled_palette_bytes'] += result.nbytes
+                entry['sampled_rgb_bytes'] += result.rgb_nbytes
+
+    def report(self):
+        """返回每个输出配置一行的统计文本"""
+        lines = []
+        for profile, entry in sorted(self.profiles.items()):
+            count, seconds, nbytes = entry['count'], entry['seconds'], entry['bytes']
+            line = (
+                f"{profile}: {count} 张, 编码 {seconds:.2f} 秒 (平均 {seconds / count * 1000:.1f} 毫秒), "
+                f"{format_bytes(nbytes)} (平均 {format_bytes(nbytes // count)})"
+            )
+            if entry['palette_count']:
+                line += f", 调色板PNG {entry['palette_count']} 张"
+                if entry['sampled_rgb_bytes']:
+                    # 按抽样场景的压缩比估算全部调色板图片相对RGB节省的字节数
+                    ratio = entry['sampled_palette_bytes'] / entry['sampled_rgb_bytes']
+                    saved = entry['palette_bytes'] / ratio - entry['palette_bytes'] if ratio else 0
+                    line += f"（比RGB约节省 {format_bytes(saved)}，{(1 - ratio) * 100:.0f}%）"
+            lines.append(line)
+        return lines
+
+
+def palette_summary(result):
+    """单张图片的调色板保存说明，未使用调色板时返回None"""
+    if result.palette_colors is None:
+        return None
+    text = f"调色板PNG: {result.palette_colors} 色"
+    if result.rgb_nbytes:
+        saved = result.rgb_nbytes - result.nbytes
+        text += (f"，{format_bytes(result.nbytes)}（RGB为 {format_bytes(result.rgb_nbytes)}，"
+                 f"节省 {saved / result.rgb_nbytes * 100:.0f}%）")
+    return text
+
+
+def format_bytes(nbytes):
+    """格式化字节数"""
+    for unit in ('B', 'KB', 'MB'):
+        if nbytes < 1024:
+            return f"{nbytes:.0f} {unit}" if unit == 'B' else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} GB"
+
+
+class ImageWriter:
+    """
+    后台编码/写入阶段
+
+    渲染线程通过 submit() 把图像交给编码线程保存，随即继续渲染下一张；
+    Pillow 的编码器在压缩时释放GIL，编码与渲染可以真正重叠。
+    等待队列有上限，队列满时 submit() 阻塞，内存中待写入的图像数量不会无限增长。
+    """
+
+    def __init__(self, workers=2, max_pending=4):
+        """
+        Args:
+            workers (int): 编码线程数
+            max_pending (int): 等待编码的图像数量上限（不含正在编码的图像）
+        """
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"ImageWriter-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._closed = False
+
+    @property
+    def capacity(self):
+        """同时持有的图像数量上限（等待中 + 编码中）"""
+        return self.workers + self.max_pending
+
+    def submit(self, image, path, format=None, **params):
+        """
+        提交一张待保存的图像，队列已满时阻塞直到有空位
+
+        调用方提交后不应再修改该图像。参数与 save_image 相同。
+
+        Returns:
+            concurrent.futures.Future: 保存完成时结果为 EncodeResult，失败时带有异常
+        """
+        if self._closed:
+            raise RuntimeError("ImageWriter 已关闭")
+        future = Future()
+        self._queue.put((future, image, path, format, params))
+        return future
+
+    def close(self):
+        """等待所有已提交的图像写入完成并结束编码线程"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        """编码线程主循环"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, image, path, format, params = item
+            # 不再持有图像引用，写完即可释放
+            item = None
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = encode_image(image, path, format, **params)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                image = None
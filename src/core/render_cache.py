@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+
+
+def image_nbytes(img):
+    """估算图像占用的内存字节数"""
+    return img.width * img.height * len(img.getbands())
+
+
+class LRUCache:
+    """
+    进程内的LRU缓存，按字节预算和/或条目数量淘汰最久未使用的条目
+
+    缓存的图像对象在调用方之间共享，取出后不应原地修改。
+    """
+
+    def __init__(self, max_bytes=None, max_entries=None, sizeof=image_nbytes):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """获取缓存条目，不存在时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """写入缓存条目，超出预算时淘汰最久未使用的条目"""
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            # 单个条目超出总预算时不缓存
+            if self.max_bytes is not None and size > self.max_bytes:
+                return value
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            self._evict()
+        return value
+
+    def get_or_create(self, key, factory):
+        """获取缓存条目，未命中时调用factory()创建并写入缓存"""
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, factory())
+        return value
+
+    def set_max_bytes(self, max_bytes):
+        """调整字节预算"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """清空缓存并重置统计"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _evict(self):
+        """淘汰超出预算的条目（调用方需持有锁）"""
+        while self._entries and (
+            (self.max_bytes is not None and self.current_bytes > self.max_bytes) or
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+        ):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
@@ -0,0 +1,303 @@
+import json
+import os
+import socket
+import threading
+import time
+
+# 队列目录结构：
+#   job.json       任务公共参数（基础模板、输出目录等）
+#   pending/       等待领取的任务，每个任务一个JSON文件
+#   claimed/       已被领取的任务：{任务名}.{领取者}，文件修改时间即租约心跳
+#   done/          已完成任务的结果记录
+#   failed/        失败任务的错误记录
+#   tmp/           写入中的临时文件，写完后重命名到目标目录
+#   *.lock         进程间互斥锁（例如合并结果），内容为持有者标识
+#   merged         队列清空后结果已合并的标记
+QUEUE_DIRS = ('pending', 'claimed', 'done', 'failed', 'tmp')
+
+JOB_NAME = "job.json"
+
+MERGED_NAME = "merged"
+
+# 默认租约时长（秒）：领取者超过这个时间没有心跳，任务会被其他进程收回重新排队
+DEFAULT_LEASE_SECONDS = 60
+
+# 同一任务最多被领取的次数：领取它的进程反复崩溃时不再无限重试
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def worker_id():
+    """当前进程的领取者标识：主机名-进程号"""
+    host = socket.gethostname().split('.')[0].replace('-', '_') or 'localhost'
+    return f"{host}-{os.getpid()}"
+
+
+def _write_json(directory, name, data, tmp_dir):
+    """先写入临时文件再重命名，其他进程只会看到完整的文件"""
+    tmp_path = os.path.join(tmp_dir, f"{name}.{worker_id()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class Task:
+    """一个已领取的任务"""
+
+    def __init__(self, queue, name, claim_path, data):
+        self.queue = queue
+        self.name = name
+        self.claim_path = claim_path
+        self.data = data
+
+    @property
+    def attempts(self):
+        return self.data.get('attempts', 0)
+
+
+class SpoolQueue:
+    """
+    基于共享目录的任务队列
+
+    不需要任何网络服务，多个进程（可以在共享该目录的多台机器上）同时工作：
+    - 领取：把 pending/ 中的任务文件原子重命名到 claimed/，重命名成功的进程独占该任务
+    - 心跳：处理任务期间定期更新 claimed/ 中文件的修改时间
+    - 完成：结果写入 done/（或 failed/）后删除领取文件
+    - 恢复：领取文件超过租约时长未更新（领取者已崩溃或失联）时被重命名回 pending/，
+      重命名同样是原子的，只有一个进程能收回成功
+
+    任务至少执行一次：领取者失联但仍在运行时，任务可能被重复执行，处理逻辑需要是幂等的。
+    各主机的时钟偏差应远小于租约时长。
+    """
+
+    def __init__(self, spool_dir, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.spool_dir = spool_dir
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker = worker_id()
+        for name in QUEUE_DIRS:
+            setattr(self, f"{name}_dir", os.path.join(spool_dir, name))
+
+    def create(self, job):
+        """
+        初始化队列目录并写入任务公共参数
+
+        队列中还有未完成的任务时拒绝覆盖；上一批的完成和失败记录会被清除。
+        """
+        for name in QUEUE_DIRS:
+            os.makedirs(os.path.join(self.spool_dir, name), exist_ok=True)
+        if os.listdir(self.pending_dir) or os.listdir(self.claimed_dir):
+            raise ValueError(f"队列中仍有未完成的任务: {self.spool_dir}")
+        for directory in (self.done_dir, self.failed_dir, self.tmp_dir):
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+        for name in os.listdir(self.spool_dir):
+            if name == MERGED_NAME or name.endswith('.lock'):
+                os.remove(os.path.join(self.spool_dir, name))
+        _write_json(self.spool_dir, JOB_NAME, job, self.tmp_dir)
+
+    def load_job(self):
+        """读取任务公共参数"""
+        path = os.path.join(self.spool_dir, JOB_NAME)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"队列不存在或尚未初始化: {self.spool_dir}")
+        return _read_json(path)
+
+    def put(self, name, data):
+        """加入一个任务（name 决定领取顺序，按字符串排序）"""
+        _write_json(self.pending_dir, f"{name}.json", dict(data, attempts=0), self.tmp_dir)
+
+    def claim(self):
+        """
+        领取一个任务
+
+        Returns:
+            Task: 领取到的任务；队列中没有等待的任务时返回None
+        """
+        for filename in sorted(os.listdir(self.pending_dir)):
+            if not filename.endswith('.json'):
+                continue
+            claim_path = os.path.join(self.claimed_dir, f"{filename}.{self.worker}")
+            try:
+                os.rename(os.path.join(self.pending_dir, filename), claim_path)
+            except FileNotFoundError:
+                # 被其他进程抢先领取
+                continue
+            # 重命名保留了入队时的修改时间，立即续约，否则其他进程可能把刚领取的任务当作租约过期收回
+            try:
+                os.utime(claim_path)
+            except FileNotFoundError:
+                continue
+            name = filename[:-len('.json')]
+            if os.path.exists(os.path.join(self.done_dir, filename)):
+                # 失联的领取者最终完成了任务，收回后的副本不必再执行
+                os.remove(claim_path)
+                continue
+            try:
+                data = _read_json(claim_path)
+            except FileNotFoundError:
+                # 领取文件已被收回，任务仍在 pending/ 中，由下一次领取处理
+                continue
+            except (OSError, ValueError) as e:
+                self._finish(name, claim_path, self.failed_dir, {'error': f"任务文件损坏: {e}"})
+                continue
+            data['attempts'] = data.get('attempts', 0) + 1
+            if data['attempts'] > self.max_attempts:
+                self._finish(name, claim_path, self.failed_dir, dict(
+                    data, error=f"领取者连续 {self.max_attempts} 次在处理中途退出，放弃该任务"))
+                continue
+            # 领取次数写回领取文件，任务被收回时随文件一起回到 pending/
+            _write_json(self.claimed_dir, os.path.basename(claim_path), data, self.tmp_dir)
+            return Task(self, name, claim_path, data)
+        return None
+
+    def heartbeat(self, task):
+        """续约：更新领取文件的修改时间"""
+        try:
+            os.utime(task.claim_path)
+        except FileNotFoundError:
+            pass
+
+    def complete(self, task, result):
+        """标记任务完成并记录结果"""
+        self._finish(task.name, task.claim_path, self.done_dir, dict(result, worker=self.worker))
+
+    def fail(self, task, error):
+        """标记任务失败（不再重试）"""
+        self._finish(task.name, task.claim_path, self.failed_dir, dict(task.data, error=error, worker=self.worker))
+
+    def recover_expired(self):
+        """
+        把租约过期的任务放回 pending/
+
+        Returns:
+            int: 收回的任务数
+        """
+        recovered = 0
+        now = time.time()
+        for filename in os.listdir(self.claimed_dir):
+            path = os.path.join(self.claimed_dir, filename)
+            try:
+                expired = now - os.stat(path).st_mtime > self.lease_seconds
+            except FileNotFoundError:
+                continue
+            if not expired:
+                continue
+            name = filename.split('.json.', 1)[0]
+            if os.path.exists(os.path.join(self.done_dir, f"{name}.json")):
+                # 领取者写完结果后、删除领取文件前退出
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                os.rename(path, os.path.join(self.pending_dir, f"{name}.json"))
+                recovered += 1
+            except FileNotFoundError:
+                pass
+        return recovered
+
+    def counts(self):
+        """返回各状态的任务数 {pending, claimed, done, failed}"""
+        counts = {}
+        for name in ('pending', 'claimed', 'done', 'failed'):
+            try:
+                counts[name] = sum(1 for f in os.listdir(getattr(self, f"{name}_dir")) if '.json' in f)
+            except FileNotFoundError:
+                counts[name] = 0
+        return counts
+
+    def is_drained(self):
+        """没有等待中和处理中的任务"""
+        counts = self.counts()
+        return counts['pending'] == 0 and counts['claimed'] == 0
+
+    def acquire_lock(self, name):
+        """
+        尝试取得互斥锁（以 O_EXCL 创建锁文件），不等待
+
+        锁文件超过租约时长仍未释放时视为持有者已退出，收回后重试一次。
+
+        Returns:
+            bool: 是否取得锁
+        """
+        path = os.path.join(self.spool_dir, f"{name}.lock")
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime <= self.lease_seconds:
+                        return False
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(self.worker)
+            return True
+        return False
+
+    def release_lock(self, name):
+        """释放互斥锁"""
+        try:
+            os.remove(os.path.join(self.spool_dir, f"{name}.lock"))
+        except FileNotFoundError:
+            pass
+
+    def is_merged(self):
+        """队列清空后的结果是否已经合并"""
+        return os.path.exists(os.path.join(self.spool_dir, MERGED_NAME))
+
+    def mark_merged(self):
+        """标记结果已合并（重新入队时清除）"""
+        _write_json(self.spool_dir, MERGED_NAME, {'worker': self.worker, 'time': time.time()}, self.tmp_dir)
+
+    def results(self, state='done'):
+        """读取完成（或失败）记录 {任务名: 记录}"""
+        directory = getattr(self, f"{state}_dir")
+        records = {}
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.json'):
+                try:
+                    records[filename[:-len('.json')]] = _read_json(os.path.join(directory, filename))
+                except (OSError, ValueError):
+                    pass
+        return records
+
+    def _finish(self, name, claim_path, directory, record):
+        _write_json(directory, f"{name}.json", record, self.tmp_dir)
+        try:
+            os.remove(claim_path)
+        except FileNotFoundError:
+            # 租约已过期并被收回；结果已经写入，重新排队的任务会在领取时被识别为已完成
+            pass
+
+
+class LeaseKeeper:
+    """处理任务期间在后台线程中定期续约"""
+
+    def __init__(self, queue, task):
+        self.queue = queue
+        self.task = task
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        interval = max(self.queue.lease_seconds / 3, 0.05)
+        while not self._stop.wait(interval):
+            self.queue.heartbeat(self.task)
@@ -0,0 +1,350 @@
+import heapq
+import math
+import os
+import re
+from collections import namedtuple
+
+# 台本格式（与 scripts/make_video.sh 相同）：
+#   [SETTINGS]
+#   1920x1080  30  60            # 分辨率 帧率 总时长
+#   [IMAGES]
+#   0  path/to/scene_01.png  5   # 开始时间 文件路径 持续时间
+#   [AUDIO]
+#   0  music/bgm.mp3  15         # 开始时间 文件路径 持续时间(可选)
+# 以 # 开头的行和空行被忽略；未写 [SETTINGS] 时使用默认设置。
+
+DEFAULT_RESOLUTION = (1920, 1080)
+DEFAULT_FPS = "30"
+DEFAULT_DURATION = 10.0
+
+# 换算到帧网格时的容差：0.1 * 3 之类的浮点误差不应让边界帧错位
+FRAME_EPSILON = 1e-6
+
+# 文件夹模式支持的图片扩展名
+FOLDER_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+StoryboardImage = namedtuple('StoryboardImage', ['start', 'path', 'duration', 'line'])
+# loop: 循环播放直到视频结束（文件夹模式的BGM）
+StoryboardAudio = namedtuple('StoryboardAudio', ['start', 'path', 'duration', 'line', 'loop'],
+                             defaults=(None, False))
+
+# 编码计划中的一个画面段：图片序号（黑帧为None）、起始帧、帧数
+PlanRun = namedtuple('PlanRun', ['index', 'start_frame', 'frames'])
+
+
+class Storyboard:
+    """
+    解析后的台本
+
+    fps 保留原始文本（例如 "30000/1001"、"29.97"），传给ffmpeg时不损失精度；
+    计算帧数时使用 fps_value。
+    """
+
+    def __init__(self, width=DEFAULT_RESOLUTION[0], height=DEFAULT_RESOLUTION[1],
+                 fps=DEFAULT_FPS, duration=DEFAULT_DURATION):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.duration = duration
+        self.images = []
+        self.audio = []
+
+    @property
+    def fps_value(self):
+        return parse_fps(self.fps)
+
+    @property
+    def frame_count(self):
+        """总帧数：时间 n / fps 小于总时长的所有帧（与ffmpeg的 -t 一致）"""
+        return max(0, math.ceil(self.duration * self.fps_value - FRAME_EPSILON))
+
+    def timeline(self, images=None):
+        """换算到帧网格并校验，images 为实际使用的图片（默认为全部图片）"""
+        return Timeline(self, images)
+
+
+def parse_fps(text):
+    """解析帧率，支持 "30"、"29.97" 和 "30000/1001" 形式"""
+    text = str(text)
+    if '/' in text:
+        numerator, denominator = text.split('/', 1)
+        value = float(numerator) / float(denominator)
+    else:
+        value = float(text)
+    if value <= 0:
+        raise ValueError(f"帧率必须是正数: {text}")
+    return value
+
+
+def _parse_seconds(text, what, line_number):
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError(f"台本格式错误（第{line_number}行）: {what}不是数字: {text}")
+    if value < 0:
+        raise ValueError(f"台本格式错误（第{line_number}行）: {what}不能为负数: {text}")
+    return value
+
+
+def parse_storyboard(path):
+    """
+    读取台本文件
+
+    Args:
+        path (str): 台本文件路径
+
+    Returns:
+        Storyboard: 解析结果
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_storyboard_text(f.read())
+
+
+def parse_storyboard_text(text):
+    """解析台本文本，格式错误时抛出带行号的 ValueError"""
+    storyboard = Storyboard()
+    section = None
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip().upper()
+            if section not in ('SETTINGS', 'IMAGES', 'AUDIO'):
+                raise ValueError(f"台本格式错误（第{line_number}行）: 未知的段落 {line}")
+            continue
+
+        fields = line.split()
+        if section == 'SETTINGS':
+            if len(fields) >= 1:
+                try:
+                    width, height = (int(v) for v in fields[0].lower().split('x'))
+                except ValueError:
+                    raise ValueError(f"台本格式错误（第{line_number}行）: 分辨率应为 宽x高: {fields[0]}")
+                storyboard.width, storyboard.height = width, height
+            if len(fields) >= 2:
+                try:
+                    parse_fps(fields[1])
+                except (ValueError, ZeroDivisionError):
+                    raise ValueError(f"台本格式错误（第{line_number}行）: 帧率无效: {fields[1]}")
+                storyboard.fps = fields[1]
+            if len(fields) >= 3:
+                storyboard.duration = _parse_seconds(fields[2], "总时长", line_number)
+        elif section in ('IMAGES', 'AUDIO'):
+            if len(fields) < 2 or (section == 'IMAGES' and len(fields) < 3):
+                columns = "开始时间 文件路径 持续时间" if section == 'IMAGES' else "开始时间 文件路径 [持续时间]"
+                raise ValueError(f"台本格式错误（第{line_number}行）: 应为 {columns}")
+            start = _parse_seconds(fields[0], "开始时间", line_number)
+            duration = _parse_seconds(fields[2], "持续时间", line_number) if len(fields) >= 3 else None
+            if section == 'IMAGES':
+                storyboard.images.append(StoryboardImage(start, fields[1], duration, line_number))
+            else:
+                storyboard.audio.append(StoryboardAudio(start, fields[1], duration, line_number))
+        else:
+            raise ValueError(f"台本格式错误（第{line_number}行）: 内容不在任何段落中")
+    return storyboard
+
+
+def _natural_key(name):
+    """自然排序键：scene_2 排在 scene_10 之前"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def storyboard_from_folder(folder, frame_duration=2.0, bgm=None, fps="25"):
+    """
+    把图片文件夹转换为台本：按文件名自然排序，每张图片依次显示 frame_duration 秒
+
+    Args:
+        folder (str): 图片文件夹
+        frame_duration (float): 每张图片的显示时间（秒）
+        bgm (str, optional): 背景音乐，循环播放直到视频结束
+        fps (str): 帧率
+
+    Returns:
+        Storyboard: 分辨率取第一张图片的尺寸
+    """
+    from PIL import Image
+
+    if not os.path.isdir(folder):
+        raise FileNotFoundError(f"图片文件夹不存在: {folder}")
+    if frame_duration <= 0:
+        raise ValueError(f"帧间隔时间必须是正数: {frame_duration}")
+    names = sorted((name for name in os.listdir(folder)
+                    if os.path.splitext(name)[1].lower() in FOLDER_IMAGE_EXTENSIONS), key=_natural_key)
+    if not names:
+        raise ValueError("文件夹中未找到支持的图片文件 (PNG, JPG, JPEG)")
+
+    with Image.open(os.path.join(folder, names[0])) as first:
+        width, height = first.size
+    storyboard = Storyboard(width, height, fps, frame_duration * len(names))
+    for position, name in enumerate(names):
+        storyboard.images.append(
+            StoryboardImage(position * frame_duration, os.path.join(folder, name), frame_duration, None))
+    if bgm:
+        storyboard.audio.append(StoryboardAudio(0.0, bgm, None, None, True))
+    return storyboard
+
+
+class Timeline:
+    """
+    换算到帧网格上的台本时间线
+
+    第 n 帧的时间为 n / fps；图片覆盖 start <= t <= start + duration 的所有帧，
+    同一帧被多张图片覆盖时显示台本中排在最后的一张，没有图片覆盖的帧为黑帧。
+
+    构造时完成校验：
+    - overlaps: [(前一张序号, 后一张序号, 重叠秒数), ...]，后一张遮挡前一张
+    - gaps: [(开始秒, 结束秒), ...]，没有任何图片的时间段（显示黑帧）
+    - warnings: 其它问题的说明文字（超出总时长、时长为0、音频在视频结束后才开始等）
+    """
+
+    def __init__(self, storyboard, images=None):
+        self.storyboard = storyboard
+        self.images = list(storyboard.images if images is None else images)
+        self.fps = storyboard.fps_value
+        self.frame_count = storyboard.frame_count
+        self.overlaps = []
+        self.gaps = []
+        self.warnings = []
+        self._validate()
+
+    def frame_range(self, image):
+        """图片覆盖的帧范围 (first, last)，不覆盖任何帧时 first > last"""
+        first = max(0, math.ceil(image.start * self.fps - FRAME_EPSILON))
+        last = min(self.frame_count - 1, math.floor((image.start + image.duration) * self.fps + FRAME_EPSILON))
+        return first, last
+
+    def runs(self):
+        """
+        计算每一帧显示的图片，合并为连续画面段
+
+        按区间端点扫描，耗时与图片数量成正比（O(n log n)），与总帧数无关。
+
+        Returns:
+            list: [PlanRun, ...]，覆盖 0..frame_count-1 的全部帧
+        """
+        fps, last_frame = self.fps, self.frame_count - 1
+        ceil, floor = math.ceil, math.floor
+        ranges = []
+        points = {0, self.frame_count}
+        for index, image in enumerate(self.images):
+            # 与 frame_range 相同，内联以加快上万条目的台本
+            first = max(0, ceil(image.start * fps - FRAME_EPSILON))
+            last = min(last_frame, floor((image.start + image.duration) * fps + FRAME_EPSILON))
+            if first <= last:
+                ranges.append((first, index, last))
+                points.add(first)
+                points.add(last + 1)
+        ranges.sort()
+        points = sorted(p for p in points if p <= self.frame_count)
+
+        # 只记录显示的图片发生变化的位置，最后一次性生成画面段
+        changes = []
+        active = []  # 堆：(-图片序号, 最后一帧)，后写的图片优先
+        push, pop = heapq.heappush, heapq.heappop
+        next_range = 0
+        range_count = len(ranges)
+        previous = object()
+        for start in points[:-1]:
+            while next_range < range_count and ranges[next_range][0] <= start:
+                first, index, last = ranges[next_range]
+                push(active, (-index, last))
+                next_range += 1
+            while active and active[0][1] < start:
+                pop(active)
+            current = -active[0][0] if active else None
+            if current != previous:
+                changes.append((start, current))
+                previous = current
+        changes.append((self.frame_count, None))
+        return [PlanRun(index, start, end - start)
+                for (start, index), (end, _) in zip(changes, changes[1:])]
+
+    def plan(self, key=None):
+        """生成编码计划，key(index) 相同的相邻画面段会被合并"""
+        return EncodePlan(self.runs(), key)
+
+    def _validate(self):
+        duration = self.storyboard.duration
+        if self.frame_count <= 0:
+            self.warnings.append(f"总时长 {duration}s 不足一帧，视频为空")
+        for index, image in enumerate(self.images):
+            where = f"第{image.line}行 " if image.line else ""
+            if image.duration == 0:
+                self.warnings.append(f"{where}{image.path}: 持续时间为0")
+            elif image.start >= duration:
+                self.warnings.append(f"{where}{image.path}: 开始时间 {image.start}s 超出总时长，不会显示")
+            elif image.start + image.duration > duration + FRAME_EPSILON:
+                self.warnings.append(f"{where}{image.path}: 结束时间 {image.start + image.duration:g}s "
+                                     f"超出总时长，将被截断")
+        for clip in self.storyboard.audio:
+            if clip.start >= duration:
+                where = f"第{clip.line}行 " if clip.line else ""
+                self.warnings.append(f"{where}{clip.path}: 音频开始时间 {clip.start}s 超出总时长，不会播放")
+
+        # 重叠：按开始时间排序后与之前结束最晚的图片比较；首尾相接不算重叠
+        order = sorted(range(len(self.images)), key=lambda index: self.images[index].start)
+        latest = None
+        covered_until = 0.0
+        for index in order:
+            image = self.images[index]
+            end = image.start + image.duration
+            if latest is not None:
+                latest_end = self.images[latest].start + self.images[latest].duration
+                if image.start < latest_end - FRAME_EPSILON:
+                    self.overlaps.append((latest, index, min(latest_end, end) - image.start))
+            if image.start > covered_until + FRAME_EPSILON and image.start < duration:
+                self.gaps.append((covered_until, image.start))
+            if latest is None or end > self.images[latest].start + self.images[latest].duration:
+                latest = index
+            covered_until = max(covered_until, end)
+        if covered_until < duration - FRAME_EPSILON:
+            self.gaps.append((covered_until, duration))
+
+    def report(self):
+        """校验结果的说明文字列表"""
+        lines = []
+        for earlier, later, seconds in self.overlaps:
+            a, b = self.images[earlier], self.images[later]
+            lines.append(f"重叠 {seconds:g}s: {b.path}（{b.start:g}s）遮挡 {a.path}（{a.start:g}s 起）")
+        for start, end in self.gaps:
+            lines.append(f"空白 {start:g}s - {end:g}s: 没有图片，显示黑帧")
+        lines.extend(self.warnings)
+        return lines
+
+
+class EncodePlan:
+    """
+    编码计划
+
+    - runs: 合并后的画面段 [PlanRun, ...]
+    - segments: 需要编码的不同片段 {(画面标识, 帧数): 首次出现的 PlanRun}，
+      画面和帧数都相同的画面段只需编码一次
+    """
+
+    def __init__(self, runs, key=None):
+        key = key or (lambda index: index)
+        self.key = key
+        merged = []
+        for run in runs:
+            if merged and key(merged[-1].index) == key(run.index):
+                merged[-1] = merged[-1]._replace(frames=merged[-1].frames + run.frames)
+            else:
+                merged.append(run)
+        self.runs = merged
+        self.segments = {}
+        for run in merged:
+            self.segments.setdefault(self.segment_key(run), run)
+
+    def segment_key(self, run):
+        """画面段对应的片段标识"""
+        return (self.key(run.index), run.frames)
+
+    @property
+    def frame_count(self):
+        return sum(run.frames for run in self.runs)
+
+    def summary(self):
+        """编码计划的说明文字"""
+        return (f"{self.frame_count} 帧，{len(self.runs)} 个画面段，"
+                f"需要编码 {len(self.segments)} 个不同片段")
@@ -0,0 +1,336 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from PIL import Image
+from .output import temp_path
+
+# 写入ffmpeg前排队的帧段数：每段只引用一帧的数据，内存占用与段长无关
+DEFAULT_MAX_PENDING = 4
+
+# 静止片段格式版本：片段的编码方式发生变化时递增，使缓存中的旧片段全部失效
+SEGMENT_FORMAT_VERSION = 1
+
+# 片段缓存默认的容量上限，超出时按最近使用时间淘汰
+DEFAULT_SEGMENT_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# 片段缓存中的片段文件名：{sha256}.mp4
+_SEGMENT_FILE_PATTERN = re.compile(r'^[0-9a-f]{64}\.mp4$')
+
+
+def compose_frame(image, width, height):
+    """
+    把图片居中放到黑色画布上，返回rgb24原始像素数据
+
+    尺寸与画布相同的RGB图片直接取像素数据，不经过画布复制。
+    """
+    if image.size == (width, height) and image.mode == 'RGB':
+        return image.tobytes()
+    canvas = Image.new('RGB', (width, height), (0, 0, 0))
+    x = (width - image.width) // 2
+    y = (height - image.height) // 2
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        canvas.paste(image, (x, y), image)
+    else:
+        canvas.paste(image.convert('RGB'), (x, y))
+    return canvas.tobytes()
+
+
+def _rawvideo_input(width, height, fps):
+    """从标准输入读取rgb24原始帧的输入参数"""
+    return ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-framerate', str(fps), '-i', '-']
+
+
+def _audio_args(audio):
+    """
+    音频输入和混音参数（视频为第0个输入）
+
+    Returns:
+        tuple: (输入参数, 映射和编码参数)
+    """
+    inputs = []
+    filters = []
+    for index, clip in enumerate(audio):
+        if clip.loop:
+            inputs += ['-stream_loop', '-1']
+        inputs += ['-i', clip.path]
+        delay_ms = int(round(clip.start * 1000))
+        # 先截取音频本身的时长再延迟到开始时间
+        trim = f"atrim=duration={clip.duration}," if clip.duration is not None else ""
+        filters.append(f"[{index + 1}:a]{trim}adelay={delay_ms}|{delay_ms}[a{index}]")
+    if not audio:
+        return inputs, []
+    mix = "".join(f"[a{index}]" for index in range(len(audio)))
+    filters.append(f"{mix}amix=inputs={len(audio)}[final_a]")
+    return inputs, ['-filter_complex', ";".join(filters), '-map', '[final_a]', '-c:a', 'aac', '-b:a', '192k']
+
+
+def _quality_args(crf):
+    """x264质量参数（crf 为None时使用x264默认值）"""
+    return ['-crf', str(crf)] if crf is not None else []
+
+
+def ffmpeg_command(output_path, width, height, fps, duration, audio=(), ffmpeg='ffmpeg', crf=None):
+    """
+    生成从标准输入读取rgb24原始帧的ffmpeg命令
+
+    Args:
+        output_path (str): 输出视频路径
+        width, height (int): 帧尺寸
+        fps (str): 帧率（原样传给ffmpeg）
+        duration (float): 总时长（秒）
+        audio (list): 台本音频列表（带 start、path、duration 属性）
+        ffmpeg (str): ffmpeg可执行文件
+        crf (int, optional): x264质量参数，默认使用x264的默认值
+
+    Returns:
+        list: 命令参数列表
+    """
+    audio_inputs, audio_output = _audio_args(audio)
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y']
+    command += _rawvideo_input(width, height, fps) + audio_inputs
+    command += ['-map', '0:v'] + audio_output
+    command += ['-c:v', 'libx264'] + _quality_args(crf)
+    command += ['-pix_fmt', 'yuv420p', '-r', str(fps), '-t', str(duration), output_path]
+    return command
+
+
+def segment_encoder_args(crf=None):
+    """静止片段的编码参数（也是片段缓存键的一部分）"""
+    return ['-c:v', 'libx264', '-tune', 'stillimage', '-bf', '0'] + _quality_args(crf) + ['-pix_fmt', 'yuv420p']
+
+
+def hold_segment_command(output_path, width, height, fps, frames, ffmpeg='ffmpeg', crf=None, threads=None):
+    """
+    生成静止画面片段的ffmpeg命令：从标准输入读取一帧，保持 frames 帧
+
+    画面只做一次颜色空间转换，之后由 tpad 复制已转换的帧；静止帧在x264中几乎全部是跳过块，
+    编码耗时远低于逐帧送入完整画面。不使用B帧，片段的显示时间戳从0开始，
+    拼接后每个片段的起点与帧网格严格对齐。输出固定为MP4格式，与文件扩展名无关。
+
+    threads 为每个编码进程的线程数（默认由x264按CPU核数决定），只影响编码速度，不属于片段缓存键。
+    """
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y']
+    command += _rawvideo_input(width, height, fps)
+    command += [
+        '-vf', f'format=yuv420p,tpad=stop_mode=clone:stop={frames - 1}',
+        '-frames:v', str(frames), '-r', str(fps),
+    ] + segment_encoder_args(crf)
+    if threads:
+        command += ['-threads', str(threads)]
+    command += ['-an', '-f', 'mp4', output_path]
+    return command
+
+
+def segment_digest(content_key, frames, width, height, fps, encoder_args):
+    """
+    计算静止片段的缓存键
+
+    覆盖画面内容、帧数（即时长）、分辨率、帧率和编码参数，任何一项变化都会得到新的片段。
+
+    Args:
+        content_key (str): 画面内容的哈希
+        encoder_args (list): segment_encoder_args 返回的编码参数
+    """
+    payload = {
+        'version': SEGMENT_FORMAT_VERSION,
+        'content': content_key,
+        'frames': frames,
+        'size': [width, height],
+        'fps': str(fps),
+        'encoder': encoder_args,
+    }
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def encode_hold_segment(path, frame, width, height, fps, frames, ffmpeg='ffmpeg', crf=None, threads=None):
+    """
+    编码静止片段
+
+    先写入同目录下的临时文件再重命名，中断时片段缓存中不会留下不完整的片段；
+    多个进程同时编码同一片段时，后完成的覆盖先完成的，内容相同。
+
+    Returns:
+        float: 编码耗时（秒）
+    """
+    tmp_path = temp_path(path)
+    start = time.perf_counter()
+    try:
+        run_encoder(hold_segment_command(tmp_path, width, height, fps, frames, ffmpeg, crf, threads), frame)
+        os.replace(tmp_path, path)
+        return time.perf_counter() - start
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def prune_segment_cache(cache_dir, max_bytes, keep=()):
+    """
+    片段缓存超出容量上限时，按修改时间从旧到新删除片段（复用片段时会更新修改时间）
+
+    只删除片段缓存命名的文件，keep 中的片段（本次生成用到的）不会被删除。
+
+    Returns:
+        tuple: (删除的片段数, 释放的字节数)
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    segments = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if not _SEGMENT_FILE_PATTERN.match(entry.name):
+            continue
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        total += st.st_size
+        if os.path.abspath(entry.path) not in keep:
+            segments.append((st.st_mtime, st.st_size, entry.path))
+    removed = 0
+    freed = 0
+    for _, size, path in sorted(segments):
+        if total - freed <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+def concat_command(list_path, output_path, duration, audio=(), ffmpeg='ffmpeg'):
+    """
+    生成拼接片段的ffmpeg命令：视频直接复制码流，不重新编码
+
+    Args:
+        list_path (str): write_concat_list 写出的片段列表
+    """
+    audio_inputs, audio_output = _audio_args(audio)
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+    command += audio_inputs
+    command += ['-map', '0:v'] + audio_output
+    command += ['-c:v', 'copy', '-t', str(duration), '-movflags', '+faststart', output_path]
+    return command
+
+
+def write_concat_list(list_path, segment_paths):
+    """写出ffmpeg concat分离器的片段列表（同一片段可以出现多次）"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write("ffconcat version 1.0\n")
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def run_encoder(command, frame):
+    """把一帧原始数据写入编码进程并等待其结束，失败时抛出 RuntimeError"""
+    result = subprocess.run(command, input=frame, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        details = "\n".join(result.stderr.decode('utf-8', 'replace').strip().splitlines()[-20:])
+        name = os.path.basename(command[0])
+        raise RuntimeError(f"{name} 编码失败（退出码 {result.returncode}）" + (f":\n{details}" if details else ""))
+
+
+class FramePipe:
+    """
+    把原始帧写入编码进程的标准输入
+
+    写入在后台线程中进行，调用方提交帧段后立即返回继续渲染下一张图片；
+    排队的帧段数有上限，编码跟不上时 write() 阻塞，形成背压。
+    """
+
+    def __init__(self, command, max_pending=DEFAULT_MAX_PENDING):
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.frames_written = 0
+        self.bytes_written = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._stderr = deque(maxlen=20)
+        self._stderr_thread = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr_thread.start()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, frame, count=1):
+        """提交 count 帧相同的画面（frame 为rgb24字节数据）"""
+        if self._error is not None:
+            raise self._failure()
+        self._queue.put((frame, count))
+
+    def close(self):
+        """
+        等待全部帧写入并关闭标准输入，等待编码进程结束
+
+        编码进程失败时抛出 RuntimeError，包含其错误输出的最后几行。
+        """
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        returncode = self.process.wait()
+        self._stderr_thread.join()
+        if self._error is not None or returncode != 0:
+            raise self._failure(returncode)
+
+    def abort(self):
+        """终止编码进程（渲染出错时调用）"""
+        self.process.kill()
+        # 进程结束后写线程的写入立即失败，队列中剩余的帧段很快被取完
+        self._queue.put(None)
+        self._thread.join()
+        self.process.wait()
+        self._stderr_thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _run(self):
+        stdin = self.process.stdin
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            frame, count = item
+            try:
+                for _ in range(count):
+                    stdin.write(frame)
+            except OSError as e:
+                # 编码进程提前退出（参数错误、磁盘已满等），之后的帧全部丢弃
+                self._error = e
+                continue
+            self.frames_written += count
+            self.bytes_written += len(frame) * count
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            self._stderr.append(line.decode('utf-8', 'replace').rstrip())
+
+    def _failure(self, returncode=None):
+        name = os.path.basename(self.command[0])
+        details = "\n".join(self._stderr)
+        status = f"退出码 {returncode}" if returncode is not None else str(self._error)
+        return RuntimeError(f"{name} 编码失败（{status}）" + (f":\n{details}" if details else ""))
@@ -117,7 +117,7 @@ class GeometryTab:
         ttk.Label(gradient_frame, text="方向:").grid(row=2, column=0, sticky="w")
         self.gradient_direction_var = tk.StringVar(value="horizontal")
         direction_combo = ttk.Combobox(gradient_frame, textvariable=self.gradient_direction_var,
-                                     values=["horizontal", "vertical", "diagonal"],
+                                     values=["horizontal", "vertical", "diagonal", "radial"],
                                      state="readonly", width=10)
         direction_combo.grid(row=2, column=1, padx=5)
         direction_combo.bind('<<ComboboxSelected>>', lambda e: self.sync_gradient_settings())
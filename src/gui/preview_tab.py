@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
+from core.output import OUTPUT_PROFILES, profile_extension, save_image
 
 class PreviewTab:
     def __init__(self, parent, generator):
@@ -109,6 +110,16 @@ class PreviewTab:
                                   textvariable=self.quality_var, width=5)
         quality_spin.pack(side="right")
         
+        # 输出配置（default 时使用上面的格式设置）
+        profile_frame = ttk.Frame(save_frame)
+        profile_frame.pack(fill="x", pady=2)
+        
+        ttk.Label(profile_frame, text="输出配置:").pack(side="left")
+        self.profile_var = tk.StringVar(value="default")
+        profile_combo = ttk.Combobox(profile_frame, textvariable=self.profile_var,
+                                     values=list(OUTPUT_PROFILES), state="readonly", width=14)
+        profile_combo.pack(side="right")
+        
         # 保存按钮
         ttk.Button(save_frame, text="保存图像", 
                   command=self.save_image).pack(fill="x", pady=(10, 0))
@@ -259,7 +270,11 @@ class PreviewTab:
         try:
             # 选择保存格式
             format_type = self.format_var.get()
-            if format_type == "PNG":
+            profile = self.profile_var.get()
+            if profile != "default":
+                default_ext = profile_extension(profile)
+                filetypes = [(f'{profile} files', f'*{default_ext}'), ('All files', '*.*')]
+            elif format_type == "PNG":
                 filetypes = [('PNG files', '*.png'), ('All files', '*.*')]
                 default_ext = '.png'
             else:
@@ -273,18 +288,14 @@ class PreviewTab:
             )
             
             if filename:
-                if format_type == "JPEG":
-                    # JPEG需要转换为RGB模式
-                    if self.current_image.mode == 'RGBA':
-                        rgb_image = Image.new('RGB', self.current_image.size, (255, 255, 255))
-                        rgb_image.paste(self.current_image, mask=self.current_image.split()[-1])
-                        quality = int(self.quality_var.get())
-                        rgb_image.save(filename, 'JPEG', quality=quality)
-                    else:
-                        quality = int(self.quality_var.get())
-                        self.current_image.save(filename, 'JPEG', quality=quality)
+                if profile != "default":
+                    save_image(self.current_image, filename, profile=profile)
+                elif format_type == "JPEG":
+                    # JPEG在编码时才去除透明度
+                    quality = int(self.quality_var.get())
+                    save_image(self.current_image, filename, 'JPEG', quality=quality)
                 else:
-                    self.current_image.save(filename, 'PNG')
+                    save_image(self.current_image, filename, 'PNG')
                 
                 messagebox.showinfo("成功", f"图片已保存到: {filename}")
                 
@@ -14,6 +14,8 @@ class ShinboBackgroundGenerator:
         
         # 初始化图像生成器
         self.generator = ImageGenerator()
+        # 交互预览时只重新合成变化的区域
+        self.generator.incremental_render = True
         
         # 创建标签页控件
         self.notebook = ttk.Notebook(root)
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+台本视频生成器
+根据批量配置和台本直接渲染视频帧交给ffmpeg编码，不经过中间PNG文件
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from batch_generator import build_scene_config, load_scene_source
+from cli_generator import generate_image_from_config
+from core.manifest import scene_hash
+from core.render_cache import LRUCache
+from core.storyboard import Storyboard, parse_storyboard, storyboard_from_folder
+from core.output import remove_stale_temp_files
+from core.video import (DEFAULT_SEGMENT_CACHE_BYTES, FramePipe, compose_frame, concat_command, encode_hold_segment,
+                        ffmpeg_command, prune_segment_cache, segment_digest, segment_encoder_args,
+                        write_concat_list)
+
+# 已渲染画面的缓存预算：台本中反复出现的场景不必重新渲染
+FRAME_CACHE_BYTES = 256 * 1024 * 1024
+
+# 编码模式
+# - segments: 每个画面段编码为一个静止片段（只送入一帧），再无损拼接，编码量与画面数成正比
+# - stream: 逐帧通过管道送入一个ffmpeg进程，不写入任何中间文件
+VIDEO_MODES = ('segments', 'stream')
+
+# 片段模式下已渲染、等待编码的画面数上限（在正在编码的片段之外）
+MAX_PENDING_SEGMENTS = 2
+
+# 片段缓存目录名（默认位于输出视频所在目录）
+SEGMENT_CACHE_NAME = ".segment_cache"
+
+
+class StoryboardSources:
+    """
+    台本中各画面的来源和渲染
+
+    台本 [IMAGES] 中的路径按文件名（不含扩展名）匹配批量配置中的场景名称，
+    匹配到的场景在内存中渲染；匹配不到时读取该路径的图片文件，文件也不存在时跳过。
+    """
+
+    def __init__(self, storyboard, base_template, scene_map):
+        self.storyboard = storyboard
+        self.base_template = base_template
+        self.images = []
+        self.keys = []
+        self._sources = []
+        self._cache = LRUCache(max_bytes=FRAME_CACHE_BYTES, sizeof=len)
+        self._content_keys = {}
+        self.rendered = 0
+        self.render_seconds = 0.0
+
+        for entry in storyboard.images:
+            scene_name = os.path.splitext(os.path.basename(entry.path))[0]
+            if scene_name in scene_map:
+                print(f"  + 场景: {scene_name} (开始: {entry.start}s, 持续: {entry.duration}s)")
+                self._sources.append(('scene', scene_map[scene_name]))
+                self.keys.append(('scene', scene_name))
+            elif os.path.isfile(entry.path):
+                print(f"  + 图片: {entry.path} (开始: {entry.start}s, 持续: {entry.duration}s)")
+                self._sources.append(('file', entry.path))
+                self.keys.append(('file', os.path.abspath(entry.path)))
+            else:
+                print(f"警告: 配置中没有该场景，图片文件也不存在，已跳过: {entry.path}")
+                continue
+            self.images.append(entry)
+
+    def key(self, index):
+        """画面的标识：同一场景或同一文件在台本中多次出现时相同；黑帧为None"""
+        return self.keys[index] if index is not None else None
+
+    def label(self, index):
+        """画面在报告中的名称：场景名称或图片路径"""
+        if index is None:
+            return "黑帧"
+        kind, name = self.keys[index]
+        return name if kind == 'scene' else self.images[index].path
+
+    def content_key(self, index):
+        """
+        画面内容的哈希，用作片段缓存键的一部分，计算时不需要渲染
+
+        场景使用与批量生成清单相同的场景哈希（配置、字体和渲染器版本），图片文件使用文件内容的哈希。
+        """
+        key = self.key(index)
+        if key is None:
+            return 'black'
+        digest = self._content_keys.get(key)
+        if digest is None:
+            kind, value = self._sources[index]
+            if kind == 'scene':
+                digest = 'scene:' + scene_hash(build_scene_config(self.base_template, value))
+            else:
+                sha = hashlib.sha256()
+                with open(value, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        sha.update(chunk)
+                digest = 'file:' + sha.hexdigest()
+            self._content_keys[key] = digest
+        return digest
+
+    def frame(self, index):
+        """返回第 index 张画面的rgb24数据（index 为None时为黑帧）"""
+        width, height = self.storyboard.width, self.storyboard.height
+        key = self.key(index)
+        frame = self._cache.get(key)
+        if frame is None:
+            start = time.perf_counter()
+            if index is None:
+                frame = bytes(width * height * 3)
+            else:
+                frame = compose_frame(self._render(index), width, height)
+                self.rendered += 1
+            self.render_seconds += time.perf_counter() - start
+            self._cache.put(key, frame)
+        return frame
+
+    def _render(self, index):
+        kind, value = self._sources[index]
+        if kind == 'scene':
+            with contextlib.redirect_stdout(io.StringIO()):
+                return generate_image_from_config(build_scene_config(self.base_template, value))
+        with Image.open(value) as image:
+            image.load()
+        return image
+
+
+def generate_video(config_file, storyboard, output_file, ffmpeg='ffmpeg', mode='segments', crf=None,
+                   plan_only=False, segment_cache=None, jobs=0, threads=None,
+                   segment_cache_bytes=DEFAULT_SEGMENT_CACHE_BYTES):
+    """
+    根据批量配置和台本生成视频
+
+    台本先换算为帧网格上的时间线并校验（重叠、空白、超出总时长等），再生成编码计划；
+    每张画面只渲染一次，两种编码模式的帧时间完全相同。
+
+    Args:
+        config_file (str, optional): 批量配置文件（JSON或JSON Lines）；为None时台本中的图片全部从文件读取
+        storyboard (str or Storyboard): 台本文件路径或已解析的台本
+        output_file (str): 输出视频路径
+        ffmpeg (str): ffmpeg可执行文件
+        mode (str): 编码模式，见 VIDEO_MODES
+        crf (int, optional): x264质量参数
+        plan_only (bool): 只输出时间线校验结果和编码计划，不渲染、不编码
+        segment_cache (str, optional): 片段缓存目录（segments模式），默认为输出目录下的 .segment_cache；
+            为空字符串时不缓存，片段写入临时目录并在结束后删除
+        segment_cache_bytes (int): 片段缓存的容量上限（字节），生成后按最近使用时间淘汰超出的片段；0表示不限制
+        jobs (int): segments模式同时运行的ffmpeg进程数，0或负数表示使用全部CPU核心
+        threads (int, optional): segments模式每个ffmpeg进程的编码线程数，
+            默认按CPU核数平均分给各进程（只有一个进程时由x264决定）
+
+    Returns:
+        EncodePlan: 编码计划
+    """
+    if mode not in VIDEO_MODES:
+        raise ValueError(f"未知的编码模式: {mode}（可选: {', '.join(VIDEO_MODES)}）")
+    if not plan_only and shutil.which(ffmpeg) is None:
+        raise FileNotFoundError(f"未找到ffmpeg，请先安装ffmpeg: {ffmpeg}")
+
+    if not isinstance(storyboard, Storyboard):
+        storyboard = parse_storyboard(storyboard)
+    base_template = {}
+    scene_map = {}
+    if config_file:
+        base_template, scenes, _ = load_scene_source(config_file)
+        for position, scene in enumerate(scenes, 1):
+            scene_map[scene.get('name', f'scene_{position:03d}')] = scene
+
+    print("视频设置:")
+    print(f"  分辨率: {storyboard.width}x{storyboard.height}")
+    print(f"  帧率: {storyboard.fps}")
+    print(f"  总时长: {storyboard.duration}s")
+
+    print("\n处理图片序列...")
+    sources = StoryboardSources(storyboard, base_template, scene_map)
+
+    print("\n处理音频轨道...")
+    audio = []
+    for clip in storyboard.audio:
+        if not os.path.isfile(clip.path):
+            print(f"警告: 音频文件不存在，已跳过: {clip.path}")
+            continue
+        length = f"{clip.duration}s" if clip.duration is not None else ("循环" if clip.loop else "完整")
+        print(f"  + 音频: {clip.path} (开始: {clip.start}s, 持续: {length})")
+        audio.append(clip)
+
+    timeline = storyboard.timeline(sources.images)
+    report = timeline.report()
+    if report:
+        print("\n时间线检查:")
+        for line in report:
+            print(f"  ⚠️ {line}")
+    plan = timeline.plan(key=sources.key)
+    print(f"\n编码计划: {plan.summary()}")
+    if plan_only:
+        return plan
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    print(f"\n开始渲染并编码（{mode}）...")
+    start = time.perf_counter()
+    if mode == 'stream':
+        _encode_stream(storyboard, sources, plan, audio, output_file, ffmpeg, crf)
+    else:
+        if segment_cache is None:
+            segment_cache = os.path.join(output_dir or '.', SEGMENT_CACHE_NAME)
+        _encode_segments(storyboard, sources, plan, audio, output_file, ffmpeg, crf, segment_cache, jobs, threads,
+                         segment_cache_bytes)
+    elapsed = time.perf_counter() - start
+
+    print(f"渲染画面: {sources.rendered} 张，耗时 {sources.render_seconds:.2f} 秒")
+    print(f"总耗时: {elapsed:.2f} 秒")
+    print(f"✅ 台本视频生成成功: {output_file}")
+    return plan
+
+
+def _encode_stream(storyboard, sources, plan, audio, output_file, ffmpeg, crf):
+    """逐帧写入一个ffmpeg进程；写管道在后台线程中进行，与渲染下一张画面重叠"""
+    command = ffmpeg_command(output_file, storyboard.width, storyboard.height, storyboard.fps,
+                             storyboard.duration, audio, ffmpeg, crf)
+    with FramePipe(command) as pipe:
+        for run in plan.runs:
+            pipe.write(sources.frame(run.index), run.frames)
+    print(f"写入ffmpeg: {pipe.frames_written} 帧，{pipe.bytes_written / 1024 / 1024:.1f} MB 原始RGB数据")
+
+
+def _encode_segments(storyboard, sources, plan, audio, output_file, ffmpeg, crf, segment_cache, jobs, threads,
+                     segment_cache_bytes):
+    """
+    每个画面段编码为一个静止片段，再用concat分离器复制码流拼接
+
+    片段只送入一帧，时长由帧数精确决定。片段按画面内容、帧数、分辨率、帧率和编码参数的哈希
+    命名并保存在片段缓存目录中：修改台本中的一个画面后重新生成，只有变化的片段需要渲染和编码，
+    其余片段直接复用。缺少的片段由多个ffmpeg进程并行编码。
+    拼接完成后缓存超出容量上限时，按最近使用时间淘汰本次没有用到的片段。
+    """
+    width, height, fps = storyboard.width, storyboard.height, storyboard.fps
+    encoder_args = segment_encoder_args(crf)
+    with tempfile.TemporaryDirectory(prefix='.segments_', dir=os.path.dirname(output_file) or '.') as tmp_dir:
+        cache_dir = segment_cache or tmp_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        # 清理上次运行中断时留下的片段临时文件
+        remove_stale_temp_files(cache_dir)
+        segments = {}
+        # 不同场景可能渲染出相同的画面，片段标识不同但缓存路径相同，每个路径只编码一次
+        seen_paths = set()
+        order = []
+        missing = []
+        for run in plan.runs:
+            key = plan.segment_key(run)
+            path = segments.get(key)
+            if path is None:
+                digest = segment_digest(sources.content_key(run.index), run.frames, width, height, fps, encoder_args)
+                path = segments[key] = os.path.join(cache_dir, f"{digest}.mp4")
+            if path not in seen_paths:
+                seen_paths.add(path)
+                if os.path.exists(path):
+                    # 更新修改时间，超出容量上限时最近用过的片段最后被淘汰
+                    os.utime(path)
+                else:
+                    missing.append((run, path))
+            order.append(path)
+        print(f"静止片段: {len(seen_paths)} 个（{len(plan.runs)} 个画面段），"
+              f"缓存命中 {len(seen_paths) - len(missing)} 个，新编码 {len(missing)} 个")
+        if missing:
+            _encode_missing_segments(storyboard, sources, missing, ffmpeg, crf, jobs, threads)
+
+        list_path = os.path.join(tmp_dir, "segments.ffconcat")
+        write_concat_list(list_path, order)
+        command = concat_command(list_path, output_file, storyboard.duration, audio, ffmpeg)
+        start = time.perf_counter()
+        result = subprocess.run(command, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"拼接片段失败（退出码 {result.returncode}）:\n"
+                               + result.stderr.decode('utf-8', 'replace').strip())
+        print(f"拼接: {len(order)} 个片段，复制码流用时 {time.perf_counter() - start:.2f} 秒")
+
+    if segment_cache and segment_cache_bytes > 0:
+        removed, freed = prune_segment_cache(segment_cache, segment_cache_bytes, keep=order)
+        if removed:
+            print(f"片段缓存超出上限，淘汰最久未用的片段 {removed} 个，释放 {freed / 1024 / 1024:.1f} MB")
+
+
+def _encode_missing_segments(storyboard, sources, missing, ffmpeg, crf, jobs, threads):
+    """
+    并行编码缓存中没有的片段，逐个报告编码耗时
+
+    各片段互不依赖，由 jobs 个ffmpeg进程同时编码；主线程继续渲染下一张画面，
+    在途片段数超出上限时等待最早的片段完成。短的静止片段在单个x264进程中很难用满多核，
+    多个进程各用少量线程并行编码的总吞吐量更高。
+    """
+    cpus = os.cpu_count() or 1
+    if jobs is None or jobs <= 0:
+        jobs = cpus
+    jobs = max(1, min(jobs, len(missing)))
+    if threads is None and jobs > 1:
+        threads = max(1, cpus // jobs)
+    threads_note = f"，每个进程 {threads} 线程" if threads else ""
+    print(f"并行编码进程数: {jobs}{threads_note}")
+
+    timings = []
+
+    def finish(label, frames, future):
+        seconds = future.result()
+        timings.append((seconds, label))
+        print(f"  片段 {len(timings)}/{len(missing)}: {label}，{frames} 帧，编码 {seconds:.2f} 秒")
+
+    width, height, fps = storyboard.width, storyboard.height, storyboard.fps
+    max_in_flight = jobs + MAX_PENDING_SEGMENTS
+    pending = deque()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for run, path in missing:
+            future = executor.submit(encode_hold_segment, path, sources.frame(run.index),
+                                     width, height, fps, run.frames, ffmpeg, crf, threads)
+            pending.append((sources.label(run.index), run.frames, future))
+            # 输出已完成的片段；在途片段超出上限时等待最早的片段完成，已渲染的画面数不随台本长度增长
+            while pending and (len(pending) > max_in_flight or pending[0][-1].done()):
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    elapsed = time.perf_counter() - start
+
+    total = sum(seconds for seconds, _ in timings)
+    slowest = max(timings)
+    print(f"片段编码: 合计 {total:.2f} 秒，实际用时 {elapsed:.2f} 秒（平均并行度 {total / max(elapsed, 1e-9):.1f}），"
+          f"最慢: {slowest[1]} {slowest[0]:.2f} 秒")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="根据台本或图片文件夹生成视频（不经过中间PNG文件）")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-s", "--storyboard", help="台本文件路径")
+    source.add_argument("--folder", help="图片文件夹：按文件名自然排序，每张图片依次显示 --frame-duration 秒")
+    parser.add_argument("-c", "--config", help="批量配置文件路径（JSON或JSON Lines），台本中的场景直接在内存中渲染")
+    parser.add_argument("-o", "--output", help="输出视频文件（默认：台本为storyboard_output.mp4，文件夹为output_video.mp4）")
+    parser.add_argument("--frame-duration", type=float, default=2.0, help="文件夹模式每张图片的显示时间（秒，默认：2.0）")
+    parser.add_argument("--bgm", help="文件夹模式的背景音乐，循环播放直到视频结束")
+    parser.add_argument("--mode", choices=VIDEO_MODES, default="segments",
+                       help="编码模式: segments 每个画面编码一个静止片段后拼接（默认）/ stream 逐帧管道输入，不写临时文件")
+    parser.add_argument("--crf", type=int, help="x264质量参数（默认：台本为x264默认值，文件夹为18）")
+    parser.add_argument("--segment-cache", metavar="DIR",
+                       help=f"片段缓存目录（默认：输出视频所在目录下的 {SEGMENT_CACHE_NAME}），未变化的画面直接复用已编码的片段")
+    parser.add_argument("--no-segment-cache", action="store_true", help="不使用片段缓存，片段写入临时目录")
+    parser.add_argument("--segment-cache-mb", type=int, default=DEFAULT_SEGMENT_CACHE_BYTES // (1024 * 1024),
+                       help="片段缓存的容量上限（MB，默认：%(default)s），超出时淘汰最久未用的片段；0表示不限制")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                       help="segments模式同时编码片段的ffmpeg进程数（默认：0，使用全部CPU核心）")
+    parser.add_argument("--threads", type=int,
+                       help="segments模式每个ffmpeg进程的编码线程数（默认：CPU核数平均分给各进程）")
+    parser.add_argument("--plan", action="store_true", help="只检查台本并输出编码计划，不生成视频")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="ffmpeg可执行文件（默认：ffmpeg）")
+
+    args = parser.parse_args()
+
+    try:
+        if args.folder:
+            storyboard = storyboard_from_folder(args.folder, args.frame_duration, args.bgm)
+            output = args.output or "output_video.mp4"
+            crf = args.crf if args.crf is not None else 18
+        else:
+            storyboard = args.storyboard
+            output = args.output or "storyboard_output.mp4"
+            crf = args.crf
+        segment_cache = "" if args.no_segment_cache else args.segment_cache
+        generate_video(args.config, storyboard, output, ffmpeg=args.ffmpeg, mode=args.mode, crf=crf,
+                       plan_only=args.plan, segment_cache=segment_cache, jobs=args.jobs, threads=args.threads,
+                       segment_cache_bytes=args.segment_cache_mb * 1024 * 1024)
+    except Exception as e:
+        print(f"❌ 视频生成失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
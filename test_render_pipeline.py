@@ -0,0 +1,946 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试渲染管线的优化实现与原始实现输出一致
+"""
+
+import multiprocessing
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+# 与 src/ 下的脚本一致，以 src 为导入根目录（core.*、batch_generator 等）；
+# 混用 src.core.* 会把同一模块加载两份，各自持有独立的缓存和字体管理器
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from core.generate_geometry import GeometricCanvas
+from core.gradient import gradient_cache
+from core.generate_geometry import Circle
+from core.image_generator import ImageGenerator, plate_cache, sprite_cache
+from core.font_manager import FontManager
+from core.render_cache import LRUCache
+
+
+def _reference_gradient(width, height, color1, color2, direction):
+    """逐像素实现的参考渐变（与优化前的实现相同）"""
+    img = Image.new('RGBA', (width, height))
+    for x in range(width):
+        for y in range(height):
+            if direction == 'horizontal':
+                ratio = x / width
+            elif direction == 'vertical':
+                ratio = y / height
+            else:
+                ratio = (x + y) / (width + height)
+            color = tuple(int(color1[i] * (1 - ratio) + color2[i] * ratio) for i in range(3))
+            img.putpixel((x, y), (*color, 255))
+    return img
+
+
+def test_gradient_matches_reference():
+    """测试线性渐变与逐像素实现逐字节一致"""
+    color1, color2 = (248, 249, 250), (12, 200, 37)
+    for direction in ['horizontal', 'vertical', 'diagonal']:
+        canvas = GeometricCanvas(97, 41)
+        expected = _reference_gradient(97, 41, color1, color2, direction)
+        actual = canvas.create_gradient_background(color1, color2, direction)
+        assert actual.tobytes() == expected.tobytes(), direction
+
+
+def test_gradient_stops():
+    """测试多色标和径向渐变"""
+    canvas = GeometricCanvas(200, 100)
+    stops = [(0, (255, 0, 0)), (0.5, (0, 255, 0)), (1, (0, 0, 255))]
+
+    img = canvas.create_gradient_background(None, None, 'horizontal', stops)
+    assert img.getpixel((0, 50)) == (255, 0, 0, 255)
+    assert img.getpixel((100, 50)) == (0, 255, 0, 255)
+
+    img = canvas.create_gradient_background(None, None, 'radial', stops)
+    r, g, b, _ = img.getpixel((100, 50))
+    assert r > 240 and b == 0
+    # 非正方形画布上也是圆形（不随画布拉伸成椭圆）：到中心距离相同的点颜色相同
+    for a_point, b_point in (((150, 50), (100, 0)), ((50, 50), (100, 99)), ((135, 85), (64, 14))):
+        assert all(abs(x - y) <= 3 for x, y in zip(img.getpixel(a_point), img.getpixel(b_point)))
+    assert img.getpixel((0, 50))[2] < 255
+
+    square = GeometricCanvas(100, 100).create_gradient_background(None, None, 'radial', stops)
+    assert square.getpixel((0, 0)) == square.getpixel((99, 99))
+    assert square.getpixel((0, 0))[0] == 0 and square.getpixel((0, 0))[2] > 245
+
+
+def test_gradient_cache_hits():
+    """测试相同参数的渐变底图命中缓存"""
+    gradient_cache.clear()
+    canvas = GeometricCanvas(64, 32)
+    first = canvas.create_gradient_background((0, 0, 0), (255, 255, 255), 'diagonal')
+    second = canvas.create_gradient_background((0, 0, 0), (255, 255, 255), 'diagonal')
+    assert first is second
+    assert gradient_cache.stats()['hits'] == 1
+    assert gradient_cache.stats()['misses'] == 1
+
+    # render 返回副本，不会污染缓存中的底图
+    rendered = canvas.render(first)
+    rendered.putpixel((0, 0), (1, 2, 3, 255))
+    assert first.getpixel((0, 0)) == (0, 0, 0, 255)
+
+
+def test_lru_cache_byte_budget():
+    """测试按字节预算淘汰最久未使用的条目"""
+    cache = LRUCache(max_bytes=3 * 10 * 10 * 4)
+    for i in range(3):
+        cache.put(i, Image.new('RGBA', (10, 10)))
+    cache.get(0)
+    cache.put(3, Image.new('RGBA', (10, 10)))
+    assert 1 not in cache
+    assert 0 in cache and 3 in cache
+    assert cache.stats()['evictions'] == 1
+
+
+def test_scanline_mask_matches_lines():
+    """测试横线遮罩与逐行 draw.line 的效果逐像素一致"""
+    generator = ImageGenerator()
+    generator.width, generator.height = 120, 90
+    generator.border_height = 10
+    generator.add_lines = True
+    generator.line_spacing = 3
+
+    expected = Image.new('RGB', (120, 90), generator.main_color)
+    draw = ImageDraw.Draw(expected)
+    draw.rectangle([0, 0, 120, 10], fill=generator.border_color)
+    draw.rectangle([0, 80, 120, 90], fill=generator.border_color)
+    for y in range(10, 80, 3):
+        draw.line([0, y, 120, y], fill=(30, 30, 30), width=1)
+
+    assert generator.create_image().tobytes() == expected.tobytes()
+
+
+def test_font_manager_caches_fonts(monkeypatch):
+    """测试字体对象按 (路径, 字号, 索引) 缓存，备用字体链只探测一次"""
+    manager = FontManager(max_fonts=2)
+    first = manager.get_font('', 32)
+    assert manager.get_font(None, 32) is first
+    manager.get_font('', 40)
+    manager.get_font('', 48)
+    stats = manager.stats()
+    assert stats['hits'] == 1
+    assert stats['entries'] == 2
+    assert stats['evictions'] == 1
+
+    # 字体路径只检查一次是否存在，之后的渲染不访问文件系统
+    checked = []
+    exists = os.path.exists
+    monkeypatch.setattr(os.path, 'exists', lambda path: checked.append(path) or exists(path))
+    for _ in range(3):
+        assert manager.resolve_path("missing/font.ttf") == manager.resolve_path('')
+    assert checked == ["missing/font.ttf"]
+
+
+def test_text_sprite_reused_when_layer_moves():
+    """测试只移动文字层时复用已光栅化的文字图像"""
+    generator = ImageGenerator()
+    layer = {'content': '新房', 'size': 40, 'color': '#FFFFFF', 'font_path': '',
+             'x_offset': 0, 'y_offset': 0, 'rotation': 45}
+    first = generator.create_text_layer_image(layer)
+    layer['x_offset'] = 25
+    assert generator.create_text_layer_image(layer) is first
+    layer['color'] = '#FF0000'
+    assert generator.create_text_layer_image(layer) is not first
+
+
+def test_vertical_text_glyph_blit():
+    """测试垂直文字由缓存字形拼接，与逐字 draw.text 的结果一致"""
+    generator = ImageGenerator()
+    font = FontManager().get_font('', 36)
+    text = 'Ag世界'
+
+    temp_draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    bboxes = [temp_draw.textbbox((0, 0), char, font=font) for char in text]
+    max_width = max(b[2] - b[0] for b in bboxes)
+    heights = [b[3] - b[1] for b in bboxes]
+    spacing = max(8, int(max(heights) * 0.3))
+    padding_x = max(30, max_width // 2)
+    expected = Image.new('RGBA', (max_width + padding_x * 2, sum(heights) + spacing * (len(text) - 1) + 80))
+    draw = ImageDraw.Draw(expected)
+    y = 40
+    for char, bbox, height in zip(text, bboxes, heights):
+        x = (max_width - (bbox[2] - bbox[0])) // 2 + padding_x - bbox[0]
+        draw.text((x, y - bbox[1]), char, fill='#ffc048', font=font)
+        y += height + spacing
+
+    assert generator.create_vertical_text(text, font, '#ffc048').tobytes() == expected.tobytes()
+
+
+def test_background_plate_reused_for_text_edits():
+    """测试只修改文字时复用背景底图，修改形状时重新渲染"""
+    generator = ImageGenerator()
+    generator.width, generator.height = 160, 90
+    generator.geometry_shapes = [Circle(50, 40, 20, (200, 0, 0), 128)]
+    generator.text_layers = [{'content': 'A', 'size': 20, 'color': '#FFFFFF', 'font_path': '',
+                              'x_offset': 0, 'y_offset': 0}]
+    plate = generator.get_background_plate()
+    generator.text_layers[0]['content'] = 'B'
+    generator.create_image()
+    assert generator.get_background_plate() is plate
+
+    generator.geometry_shapes[0].alpha = 255
+    assert generator.get_background_plate() is not plate
+
+
+def test_incremental_render_matches_full_render():
+    """测试移动文字层时只重新合成脏区域，且结果与完整渲染一致"""
+    generator = ImageGenerator()
+    generator.width, generator.height = 320, 180
+    generator.add_lines = True
+    generator.geometry_shapes = [Circle(80, 60, 30, (0, 120, 200), 200)]
+    generator.text_layers = [{'content': 'Move', 'size': 24, 'color': '#FFFFFF', 'font_path': '',
+                              'x_offset': 0, 'y_offset': 0}]
+    generator.incremental_render = True
+    generator.verify_incremental = True
+
+    generator.create_image()
+    generator.text_layers[0]['x_offset'] = 15
+    generator.geometry_shapes[0].x = 90
+    frame = generator.create_image()
+
+    assert generator.render_stats['incremental_renders'] == 1
+    assert 0 < generator.render_stats['last_pixels_recomposited'] < 320 * 180
+    # 增量渲染原地更新并返回同一图像：结果只在下一次渲染之前有效，需要保留时由调用方复制
+    kept = frame.copy()
+    generator.text_layers[0]['x_offset'] = 40
+    assert generator.create_image() is frame
+    assert frame.tobytes() != kept.tobytes()
+
+    generator.incremental_render = False
+    assert frame.tobytes() == generator.create_image().tobytes()
+
+
+def test_render_allocation_count(monkeypatch):
+    """测试每次渲染分配的整幅缓冲区数量（冷底图3次，热底图只复制1次）"""
+    size = (400, 300)
+    allocations = []
+    original_new = Image.Image._new
+
+    def counting_new(self, im):
+        result = original_new(self, im)
+        if result.size == size:
+            allocations.append(result.mode)
+        return result
+
+    generator = ImageGenerator()
+    generator.width, generator.height = size
+    generator.enable_gradient = True
+    generator.gradient_color1 = '#123456'
+    generator.add_lines = True
+    generator.geometry_shapes = [Circle(100, 100, 40, (255, 0, 0), 120)]
+    generator.text_layers = [{'content': 'Alloc', 'size': 30, 'color': '#FFFFFF', 'font_path': '',
+                              'x_offset': 0, 'y_offset': 0}]
+    generator.create_image()  # 预热渐变、横线遮罩和文字缓存
+    plate_cache.clear()
+
+    monkeypatch.setattr(Image.Image, '_new', counting_new)
+    generator.create_image()
+    # 合成底图(RGB) + 可复用的图层缓冲区(RGBA) + 当前帧副本(RGB)，不再有 split() 的四个通道缓冲区
+    assert allocations == ['RGB', 'RGBA', 'RGB']
+
+    allocations.clear()
+    generator.create_image()
+    assert allocations == ['RGB']
+
+
+def test_translucent_shapes_blend_over_gradient():
+    """测试半透明形状与渐变背景做alpha混合，同一图层的多个形状只合成一次"""
+    canvas = GeometricCanvas(200, 100, (255, 255, 255))
+    gradient = canvas.create_gradient_background((0, 0, 255), (0, 0, 255), 'horizontal')
+    canvas.add_shape(Circle(50, 50, 20, (255, 0, 0), alpha=128), 0)
+    canvas.add_shape(Circle(150, 50, 20, (0, 255, 0), alpha=128), 0)
+
+    rgba = canvas.render(gradient)
+    rgb = canvas.render(gradient, mode='RGB')
+    assert rgba.getpixel((50, 50)) == (128, 0, 127, 255)
+    assert rgba.getpixel((150, 50)) == (0, 128, 127, 255)
+    assert rgb.tobytes() == rgba.convert('RGB').tobytes()
+
+
+def test_parallel_batch_matches_serial(tmp_path):
+    """多进程批量生成的输出与逐个生成一致，失败场景被单独记录"""
+    from batch_generator import generate_batch_scenes
+    import json
+
+    scenes = [
+        {"name": f"scene_{i}", "text_layers": [{"text": f"第{i}话", "size": 40, "x_offset": 10 * i}]}
+        for i in range(4)
+    ]
+    scenes.append({"name": "broken", "background_color": "not-a-color",
+                   "text_layers": [{"text": "x", "size": "big"}]})
+    config = {"base_template": {"width": 160, "height": 90}, "scenes": scenes}
+    config_file = tmp_path / "batch.json"
+    config_file.write_text(json.dumps(config, ensure_ascii=False), encoding='utf-8')
+
+    generate_batch_scenes(str(config_file), str(tmp_path / "serial"))
+    generate_batch_scenes(str(config_file), str(tmp_path / "parallel"), jobs=2)
+
+    for i in range(4):
+        serial = (tmp_path / "serial" / f"scene_{i}.png").read_bytes()
+        assert serial == (tmp_path / "parallel" / f"scene_{i}.png").read_bytes()
+    assert not (tmp_path / "parallel" / "broken.png").exists()
+
+
+def test_batch_manifest_skips_unchanged_scenes(tmp_path, capsys):
+    """渲染清单：只重新生成配置变化或输出文件被改动的场景"""
+    from batch_generator import generate_batch_scenes
+    import json
+
+    scenes = [{"name": f"scene_{i}", "text_layers": [{"text": f"第{i}话", "size": 40}]} for i in range(3)]
+    config_file = tmp_path / "batch.json"
+    output_dir = tmp_path / "out"
+
+    def run(**kwargs):
+        config = {"base_template": {"width": 160, "height": 90}, "scenes": scenes}
+        config_file.write_text(json.dumps(config, ensure_ascii=False), encoding='utf-8')
+        capsys.readouterr()
+        generate_batch_scenes(str(config_file), str(output_dir), **kwargs)
+        return capsys.readouterr().out
+
+    assert "重新生成: 3 个场景" in run()
+    assert "重新生成: 0 个场景，跳过未变化: 3 个场景" in run()
+
+    scenes[1]["text_layers"][0]["color"] = "#FF0000"
+    (output_dir / "scene_2.png").unlink()
+    out = run()
+    assert "重新生成: 2 个场景" in out
+    assert "跳过未变化场景: scene_0" in out
+
+    assert "重新生成: 3 个场景" in run(force=True)
+
+
+def test_jsonl_scene_stream_matches_json(tmp_path):
+    """JSON Lines场景流与JSON配置生成相同的图片"""
+    from batch_generator import generate_batch_scenes, load_scene_source
+    import json
+
+    base_template = {"width": 160, "height": 90, "border_height": 10}
+    scenes = [{"name": f"scene_{i}", "text_layers": [{"text": f"第{i}话", "size": 30}]} for i in range(3)]
+    json_file = tmp_path / "batch.json"
+    json_file.write_text(json.dumps({"base_template": base_template, "scenes": scenes}), encoding='utf-8')
+    jsonl_file = tmp_path / "batch.jsonl"
+    lines = [json.dumps({"base_template": base_template})] + [json.dumps(scene) for scene in scenes]
+    jsonl_file.write_text("\n".join(lines) + "\n\n", encoding='utf-8')
+
+    template, stream, total = load_scene_source(str(jsonl_file))
+    assert template == base_template and total is None
+    assert not isinstance(stream, list)
+
+    generate_batch_scenes(str(json_file), str(tmp_path / "json"))
+    generate_batch_scenes(str(jsonl_file), str(tmp_path / "jsonl"), jobs=2)
+    for i in range(3):
+        expected = (tmp_path / "json" / f"scene_{i}.png").read_bytes()
+        assert expected == (tmp_path / "jsonl" / f"scene_{i}.png").read_bytes()
+
+
+def test_image_writer_saves_in_background(tmp_path):
+    """后台写入与直接保存的文件一致，保存失败通过 Future 报告"""
+    from core.output import ImageWriter, save_image
+
+    image = Image.new('RGBA', (64, 32), (200, 100, 50, 128))
+    save_image(image, str(tmp_path / "direct.png"))
+
+    with ImageWriter(workers=1, max_pending=1) as writer:
+        futures = [writer.submit(image, str(tmp_path / f"bg_{i}.png")) for i in range(3)]
+        failed = writer.submit(image, str(tmp_path / "missing" / "x.png"))
+        assert futures[0].result()[1] == (tmp_path / "bg_0.png").stat().st_size
+        assert failed.exception() is not None
+
+    expected = (tmp_path / "direct.png").read_bytes()
+    for i in range(3):
+        assert (tmp_path / f"bg_{i}.png").read_bytes() == expected
+
+
+def test_batch_background_writer_matches_direct_save(tmp_path):
+    """批量生成使用后台写入时输出与直接保存一致"""
+    from batch_generator import generate_batch_scenes
+    import json
+
+    config_file = tmp_path / "batch.json"
+    scenes = [{"name": f"scene_{i}", "text_layers": [{"text": f"第{i}话", "size": 30}]} for i in range(4)]
+    config_file.write_text(json.dumps({"base_template": {"width": 160, "height": 90}, "scenes": scenes}),
+                           encoding='utf-8')
+    generate_batch_scenes(str(config_file), str(tmp_path / "sync"), encode_threads=0)
+    generate_batch_scenes(str(config_file), str(tmp_path / "async"), encode_threads=2)
+    for i in range(4):
+        assert (tmp_path / "sync" / f"scene_{i}.png").read_bytes() == \
+            (tmp_path / "async" / f"scene_{i}.png").read_bytes()
+
+
+def test_output_profiles(tmp_path):
+    """输出配置：small 调色板无损，raw/webp-lossless 像素不变"""
+    from core.output import save_image, profile_extension
+
+    image = Image.new('RGB', (120, 60), (20, 20, 120))
+    ImageDraw.Draw(image).text((10, 10), "Shaft", fill=(255, 255, 255))
+
+    for profile in ('default', 'fast', 'small', 'webp-lossless', 'raw'):
+        path = tmp_path / f"out_{profile}{profile_extension(profile)}"
+        assert save_image(image, str(path), profile=profile) == path.stat().st_size
+        with Image.open(path) as saved:
+            if profile == 'small':
+                assert saved.mode == 'P'
+            assert ImageChops.difference(saved.convert('RGB'), image).getbbox() is None
+
+    # 颜色超过256种时 small 保存为RGB
+    noisy = Image.frombytes('RGB', (64, 64), bytes(v for y in range(64) for x in range(64) for v in (x * 4, y * 4, 0)))
+    save_image(noisy, str(tmp_path / "noisy.png"), profile='small')
+    with Image.open(tmp_path / "noisy.png") as saved:
+        assert saved.mode == 'RGB'
+
+
+def test_palette_output_reports_savings(tmp_path):
+    """调色板模式：少色画面保存为P模式PNG并统计节省，颜色过多时保存为RGB"""
+    from core.output import EncodeStats, encode_image
+
+    image = Image.new('RGB', (200, 100), (139, 0, 0))
+    ImageDraw.Draw(image).text((20, 40), "Bakemonogatari", fill=(255, 255, 255))
+
+    result = encode_image(image, str(tmp_path / "flat.png"), palette=True, compare_rgb=True)
+    assert result.palette_colors == len(image.getcolors(256))
+    assert result.rgb_nbytes > result.nbytes
+    with Image.open(tmp_path / "flat.png") as saved:
+        assert saved.mode == 'P'
+        assert ImageChops.difference(saved.convert('RGB'), image).getbbox() is None
+
+    noisy = Image.frombytes('RGB', (64, 64), bytes(v for y in range(64) for x in range(64) for v in (x * 4, y * 4, 0)))
+    fallback = encode_image(noisy, str(tmp_path / "noisy.png"), palette=True, compare_rgb=True)
+    assert fallback.palette_colors is None and fallback.rgb_nbytes is None
+
+    stats = EncodeStats()
+    stats.add(None, result)
+    stats.add(None, fallback)
+    report = stats.report()
+    assert report[0].startswith("default: 2 张") and "调色板PNG 1 张" in report[0]
+
+
+def test_profile_rejects_mismatched_extension(tmp_path):
+    """输出配置：显式扩展名与输出配置的格式不符时报错，不写出内容与扩展名不符的文件"""
+    from core.output import save_image
+    from cli_generator import generate_image_from_config
+
+    image = Image.new('RGB', (16, 16), (139, 0, 0))
+    for profile, name in (('webp-lossless', "out.png"), ('raw', "out.webp"), ('fast', "out.jpg")):
+        try:
+            save_image(image, str(tmp_path / name), profile=profile)
+        except ValueError as e:
+            assert "扩展名" in str(e)
+        else:
+            raise AssertionError(f"{profile} 不应写入 {name}")
+        assert not (tmp_path / name).exists()
+
+    save_image(image, str(tmp_path / "out.webp"), profile='webp-lossless')
+    save_image(image, str(tmp_path / "noext"), profile='raw')
+    save_image(image, str(tmp_path / "any.jpg"), profile='default')
+    with Image.open(tmp_path / "noext") as saved:
+        assert saved.format == 'PPM'
+    # 显式指定格式时不检查扩展名
+    save_image(image, str(tmp_path / "explicit.bin"), 'PNG', profile='raw')
+
+    try:
+        generate_image_from_config({'output': {'profile': 'webp-lossless'}}, str(tmp_path / "scene.png"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("扩展名与输出配置不符时应在渲染前报错")
+
+
+def test_palette_conversion_is_exact():
+    """调色板转换：颜色逐一对应，差1的相近颜色和需要三个通道才能区分的颜色都不会被合并"""
+    from core.output import to_palette
+
+    cases = [
+        [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)],                       # 两个通道组成的键
+        [(r, g, b) for r in range(6) for g in range(6) for b in range(6)],  # 216色，需要三个通道
+        [(v, v, v) for v in range(0, 256, 3)],                              # 单个通道
+    ]
+    for colors in cases:
+        image = Image.new('RGB', (len(colors), 3))
+        image.putdata([colors[(x + y) % len(colors)] for y in range(3) for x in range(len(colors))])
+        indexed = to_palette(image)
+        assert indexed.mode == 'P'
+        assert indexed.convert('RGB').tobytes() == image.tobytes()
+
+    grey = Image.new('L', (4, 1))
+    grey.putdata([0, 1, 254, 1])
+    assert to_palette(grey).convert('L').tobytes() == grey.tobytes()
+    assert to_palette(Image.new('RGBA', (2, 2))) is None
+
+
+def test_render_timings_records_stages():
+    """性能分析：记录各阶段耗时和分配，且不改变渲染结果"""
+    from core.instrumentation import RenderTimings
+
+    def make_generator():
+        generator = ImageGenerator()
+        generator.width, generator.height = 320, 180
+        generator.border_height = 10
+        generator.add_lines = True
+        generator.enable_gradient = True
+        generator.gradient_color1 = "#102030"
+        generator.text_layers = [
+            {'content': 'Timing', 'size': 30, 'color': '#FFFFFF', 'font_path': '', 'x_offset': 0, 'y_offset': 0,
+             'rotation': 90},
+        ]
+        return generator
+
+    plate_cache.clear()
+    sprite_cache.clear()
+    gradient_cache.clear()
+    original_new = Image.Image._new
+    generator = make_generator()
+    generator.timings = RenderTimings()
+    profiled = generator.create_image()
+    # 分配钩子只在计时期间安装，结束后恢复 Pillow 的原始入口
+    assert Image.Image._new is original_new
+    with RenderTimings().stage('outer'):
+        assert Image.Image._new is not original_new
+    assert Image.Image._new is original_new
+
+    stages = generator.timings.as_dict()
+    for name in ('gradient', 'geometry', 'border', 'scanlines', 'plate', 'font', 'text[0]', 'rotate/flip', 'paste'):
+        assert stages[name]['calls'] == 1, name
+    # plate 阶段只统计自身的复制，底图的各个步骤计入子阶段
+    assert stages['plate']['images'] == 1
+    assert stages['plate']['bytes'] == 320 * 180 * 3
+    assert abs(generator.timings.total_seconds() - sum(s['seconds'] for s in stages.values())) < 1e-9
+    assert 'text[0]' in generator.timings.format_table()
+    # 耗时表与编码报告使用同一个格式化函数，超过1GB时换算为GB
+    from core.output import format_bytes
+    assert format_bytes(3 * 1024 ** 3) == "3.0 GB" and format_bytes(512) == "512 B"
+
+    assert profiled.tobytes() == make_generator().create_image().tobytes()
+
+
+def test_batch_resume_from_journal(tmp_path, monkeypatch, capsys):
+    """断点续传：崩溃后 --resume 只生成日志中未完成的场景"""
+    import batch_generator
+    import json
+
+    scenes = [{"name": f"scene_{i}", "text_layers": [{"text": f"第{i}话", "size": 30}]} for i in range(4)]
+    config_file = tmp_path / "batch.json"
+    config_file.write_text(json.dumps({"base_template": {"width": 160, "height": 90}, "scenes": scenes}),
+                           encoding='utf-8')
+    output_dir = tmp_path / "out"
+
+    # 第3个场景保存时进程“崩溃”
+    original_save = batch_generator.save_generated_image
+    calls = []
+
+    def crashing_save(*args, **kwargs):
+        calls.append(args[1])
+        if len(calls) == 3:
+            raise SystemExit("killed")
+        return original_save(*args, **kwargs)
+
+    monkeypatch.setattr(batch_generator, 'save_generated_image', crashing_save)
+    try:
+        batch_generator.generate_batch_scenes(str(config_file), str(output_dir), encode_threads=0)
+    except SystemExit:
+        pass
+    monkeypatch.setattr(batch_generator, 'save_generated_image', original_save)
+
+    journal = output_dir / "render_journal.jsonl"
+    assert len(journal.read_text(encoding='utf-8').splitlines()) == 2
+    # 被强制杀死的进程来不及保存清单
+    (output_dir / "render_manifest.json").unlink()
+    # 崩溃时写了一半的最后一行会被忽略
+    with open(journal, 'a', encoding='utf-8') as f:
+        f.write('{"scene": "scene_2", "ha')
+
+    capsys.readouterr()
+    batch_generator.generate_batch_scenes(str(config_file), str(output_dir), encode_threads=0, resume=True)
+    out = capsys.readouterr().out
+    assert "重新生成: 2 个场景，跳过未变化: 2 个场景" in out
+    assert "已完成（断点续传）: scene_1" in out
+    assert not journal.exists()
+    assert not [name for name in os.listdir(output_dir) if name.endswith('.tmp')]
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="需要 fork 启动方式")
+def test_batch_survives_dead_worker_process(tmp_path, monkeypatch, capsys):
+    """并行生成：渲染进程被杀死时只记为场景失败，之后的场景在新的进程池中继续生成"""
+    import batch_generator
+    import json
+
+    scenes = [{"name": f"scene_{i}", "text_layers": [{"text": "CRASH" if i == 1 else f"第{i}话", "size": 30}]}
+              for i in range(12)]
+    config_file = tmp_path / "batch.json"
+    config_file.write_text(json.dumps({"base_template": {"width": 160, "height": 90}, "scenes": scenes}),
+                           encoding='utf-8')
+    output_dir = tmp_path / "out"
+
+    # 固定用 fork 创建工作进程，子进程才能继承替换后的渲染函数（spawn/forkserver 会重新导入原函数）
+    monkeypatch.setattr(batch_generator, 'POOL_CONTEXT', multiprocessing.get_context('fork'))
+    original_generate = batch_generator.generate_image_from_config
+
+    def dying_generate(config):
+        if any(layer['content'] == "CRASH" for layer in config['text_layers']):
+            os._exit(1)
+        return original_generate(config)
+
+    monkeypatch.setattr(batch_generator, 'generate_image_from_config', dying_generate)
+    batch_generator.generate_batch_scenes(str(config_file), str(output_dir), jobs=2)
+    out = capsys.readouterr().out
+    assert "渲染进程意外退出" in out
+    assert "scene_1" in out.split("失败的场景:")[1]
+    # 在途上限为 jobs * 2，进程池损坏之后提交的场景全部成功
+    for i in range(7, 12):
+        assert (output_dir / f"scene_{i}.png").exists()
+    manifest = json.loads((output_dir / "render_manifest.json").read_text(encoding='utf-8'))
+    assert "scene_1" not in manifest['scenes'] and "scene_11" in manifest['scenes']
+
+
+def test_journal_resume_drops_partial_tail(tmp_path):
+    """断点续传日志：崩溃留下的半行被截掉，续传后追加的记录不会与残片拼成无法解析的一行"""
+    from core.manifest import RenderJournal
+
+    journal = RenderJournal(str(tmp_path))
+    journal.append("scene_0", {'hash': "a"})
+    journal.close()
+    with open(journal.path, 'ab') as f:
+        f.write('{"scene": "scene_1", "ha'.encode('utf-8'))
+
+    for name in ("scene_1", "scene_2"):
+        journal = RenderJournal(str(tmp_path), resume=True)
+        journal.append(name, {'hash': "b"})
+        journal.close()
+
+    journal = RenderJournal(str(tmp_path), resume=True)
+    journal.close()
+    assert sorted(journal.entries) == ["scene_0", "scene_1", "scene_2"]
+    with open(journal.path, encoding='utf-8') as f:
+        assert len(f.read().splitlines()) == 3
+
+
+def test_write_atomic_leaves_no_partial_file(tmp_path):
+    """原子写入：编码失败时不留下目标文件和临时文件"""
+    from core.output import write_atomic
+
+    target = tmp_path / "frame.png"
+    try:
+        write_atomic(Image.new('RGB', (8, 8)), str(target), 'PNG', compress_level=99)
+    except Exception:
+        pass
+    assert os.listdir(tmp_path) == []
+
+
+def test_batch_shards_merge_exactly_once(tmp_path, capsys):
+    """分片生成：各分片互不重叠，合并后核对每个场景恰好生成一次"""
+    import batch_generator
+    import json
+    from core.manifest import shard_of
+
+    scenes = [{"name": f"scene_{i}", "text_layers": [{"text": f"第{i}话", "size": 30}]} for i in range(7)]
+    config_file = tmp_path / "batch.json"
+    config_file.write_text(json.dumps({"base_template": {"width": 160, "height": 90}, "scenes": scenes}),
+                           encoding='utf-8')
+    output_dir = tmp_path / "out"
+
+    for by in ('index', 'name'):
+        owners = [shard_of(i + 1, scene["name"], 3, by) for i, scene in enumerate(scenes)]
+        assert set(owners) <= {1, 2, 3}
+        assert owners == [shard_of(i + 1, scene["name"], 3, by) for i, scene in enumerate(scenes)]
+
+    for index in (1, 2, 3):
+        batch_generator.generate_batch_scenes(str(config_file), str(output_dir), encode_threads=0,
+                                              shard=(index, 3), shard_by='name')
+    assert sorted(name for name in os.listdir(output_dir) if name.endswith('.png')) == \
+        [f"scene_{i}.png" for i in range(7)]
+    assert batch_generator.merge_shard_manifests(str(config_file), str(output_dir))
+    merged = json.loads((output_dir / "render_manifest.json").read_text(encoding='utf-8'))
+    assert sorted(merged['scenes']) == [f"scene_{i}" for i in range(7)]
+
+    # 合并后不分片运行全部跳过
+    capsys.readouterr()
+    batch_generator.generate_batch_scenes(str(config_file), str(output_dir), encode_threads=0)
+    assert "重新生成: 0 个场景" in capsys.readouterr().out
+
+    # 换了分片方式重跑一个分片：部分场景被两个分片记录
+    batch_generator.generate_batch_scenes(str(config_file), str(output_dir), encode_threads=0,
+                                          shard=(1, 3), shard_by='index')
+    capsys.readouterr()
+    assert not batch_generator.merge_shard_manifests(str(config_file), str(output_dir))
+    assert "场景被多个分片生成" in capsys.readouterr().out
+
+    # 缺少分片清单时报告未生成的场景
+    (output_dir / "render_manifest.shard-2-of-3.json").unlink()
+    (output_dir / "render_manifest.shard-1-of-3.json").unlink()
+    assert not batch_generator.merge_shard_manifests(str(config_file), str(output_dir))
+    out = capsys.readouterr().out
+    assert "缺少分片清单: 1/3, 2/3" in out
+    assert "场景未生成" in out
+
+
+def test_spool_queue_recovers_dead_worker(tmp_path, capsys):
+    """任务队列：崩溃进程的租约过期后任务被重新分配，反复崩溃的任务最终标记失败"""
+    import batch_generator
+    import json
+    from core.spool import SpoolQueue
+
+    scenes = [{"name": f"scene_{i}", "text_layers": [{"text": f"第{i}话", "size": 30}]} for i in range(4)]
+    scenes.append({"name": "broken", "background_color": "not-a-color"})
+    config_file = tmp_path / "batch.json"
+    config_file.write_text(json.dumps({"base_template": {"width": 160, "height": 90}, "scenes": scenes}),
+                           encoding='utf-8')
+    spool_dir = str(tmp_path / "spool")
+    output_dir = tmp_path / "out"
+    assert batch_generator.enqueue_scenes(str(config_file), spool_dir, str(output_dir)) == 5
+
+    # 领取了第一个任务后失联的进程
+    dead = SpoolQueue(spool_dir)
+    dead.worker = "otherhost-1"
+    task = dead.claim()
+    assert task.data['name'] == "scene_0"
+    os.utime(task.claim_path, (0, 0))
+
+    assert batch_generator.run_queue_worker(spool_dir, lease_seconds=5, poll_seconds=0.01) == (4, 1)
+    queue = SpoolQueue(spool_dir)
+    assert queue.counts() == {'pending': 0, 'claimed': 0, 'done': 4, 'failed': 1}
+    assert queue.results('done')['00000001']['scene'] == "scene_0"
+    manifest = json.loads((output_dir / "render_manifest.json").read_text(encoding='utf-8'))
+    assert sorted(manifest['scenes']) == [f"scene_{i}" for i in range(4)]
+
+    # 清单只由一个进程合并一次；锁被占用或已合并时其余进程不再重写清单
+    assert queue.is_merged()
+    assert not batch_generator._save_queue_manifest(queue, str(output_dir))
+    queue2 = SpoolQueue(spool_dir)
+    assert queue2.acquire_lock("test") and not queue.acquire_lock("test")
+    queue2.release_lock("test")
+
+    # 已入队且未变化的场景不再入队；队列清空后才能重新入队
+    capsys.readouterr()
+    assert batch_generator.enqueue_scenes(str(config_file), spool_dir, str(output_dir)) == 1
+
+    queue = SpoolQueue(spool_dir, lease_seconds=5, max_attempts=1)
+    task = queue.claim()
+    assert task.name == "00000005"
+    os.utime(task.claim_path, (0, 0))
+    assert queue.recover_expired() == 1
+    assert queue.claim() is None
+    assert queue.counts()['failed'] == 1
+    assert "放弃该任务" in queue.results('failed')['00000005']['error']
+
+
+def test_spool_claim_renews_lease_before_reading(tmp_path, monkeypatch):
+    """任务队列：刚领取的任务保留入队时的修改时间，不能在读取前被其他进程当作过期收回"""
+    import core.spool as spool
+
+    queue = spool.SpoolQueue(str(tmp_path / "spool"), lease_seconds=5)
+    queue.create({})
+    queue.put("00000001", {'name': "scene_1"})
+    os.utime(os.path.join(queue.pending_dir, "00000001.json"), (0, 0))
+
+    # 领取者重命名之后、读取之前，另一个进程扫描过期的领取文件
+    other = spool.SpoolQueue(queue.spool_dir, lease_seconds=5)
+    read_json = spool._read_json
+    monkeypatch.setattr(spool, '_read_json', lambda path: (other.recover_expired(), read_json(path))[1])
+    task = queue.claim()
+    assert task is not None and task.attempts == 1
+    assert queue.counts() == {'pending': 0, 'claimed': 1, 'done': 0, 'failed': 0}
+
+    # 领取文件确实被收回时放弃本次领取，任务留在队列中，不记为损坏
+    queue.complete(task, {})
+    queue.put("00000002", {'name': "scene_2"})
+    other.lease_seconds = -1
+    assert queue.claim() is None
+    assert queue.counts() == {'pending': 1, 'claimed': 0, 'done': 1, 'failed': 0}
+    monkeypatch.setattr(spool, '_read_json', read_json)
+    assert queue.claim().name == "00000002"
+
+
+def test_storyboard_frames_stream_through_pipe(tmp_path):
+    """台本视频：按帧时间选择画面，帧段通过管道写入编码进程"""
+    from core.storyboard import parse_storyboard_text
+    from core.video import FramePipe, compose_frame
+
+    storyboard = parse_storyboard_text(
+        "[SETTINGS]\n4x2  10  1.0\n"
+        "[IMAGES]\n"
+        "0    a.png  0.3   # 0.3秒处与b重叠，后写的b优先\n"
+        "0.3  b.png  0.2\n"
+        "0.8  c.png  5\n"
+        "[AUDIO]\n0  bgm.mp3\n"
+    )
+    assert (storyboard.width, storyboard.height, storyboard.frame_count) == (4, 2, 10)
+    assert storyboard.audio[0].duration is None
+    runs = [(run.index, run.frames) for run in storyboard.timeline().runs()]
+    assert runs == [(0, 3), (1, 3), (None, 2), (2, 2)]
+
+    frames = [compose_frame(Image.new('RGB', (2, 2), color), 4, 2) for color in ('red', 'lime', 'blue')]
+    assert len(frames[0]) == 4 * 2 * 3
+    assert frames[0][:3] == bytes(3) and frames[0][3:6] == bytes([255, 0, 0])
+
+    sink = tmp_path / "frames.rgb"
+    command = [sys.executable, "-c",
+               "import sys; open(sys.argv[1], 'wb').write(sys.stdin.buffer.read())", str(sink)]
+    with FramePipe(command, max_pending=1) as pipe:
+        for index, count in runs:
+            pipe.write(frames[index] if index is not None else bytes(24), count)
+    assert pipe.frames_written == 10
+    expected = b"".join((frames[index] if index is not None else bytes(24)) * count for index, count in runs)
+    assert sink.read_bytes() == expected
+
+    failing = [sys.executable, "-c", "import sys; sys.stderr.write('bad option'); sys.exit(3)"]
+    try:
+        with FramePipe(failing) as pipe:
+            pipe.write(bytes(24), 1000)
+    except RuntimeError as e:
+        assert "退出码 3" in str(e) and "bad option" in str(e)
+    else:
+        raise AssertionError("编码进程失败时应抛出 RuntimeError")
+
+
+def test_hold_segment_commands(tmp_path):
+    """静止片段：每段只送入一帧、按帧数保持，拼接时复制码流"""
+    from core.storyboard import StoryboardAudio
+    from core.video import concat_command, hold_segment_command, run_encoder, write_concat_list
+
+    command = hold_segment_command("seg.mp4", 1920, 1080, "30000/1001", 45)
+    assert command[command.index('-vf') + 1] == "format=yuv420p,tpad=stop_mode=clone:stop=44"
+    assert command[command.index('-frames:v') + 1] == "45"
+    assert command[command.index('-framerate') + 1] == "30000/1001"
+    assert '-threads' not in command
+    command = hold_segment_command("seg.mp4", 1920, 1080, "30", 45, threads=2)
+    assert command[command.index('-threads') + 1] == "2" and command[-1] == "seg.mp4"
+
+    list_path = tmp_path / "segments.ffconcat"
+    write_concat_list(str(list_path), ["a.mp4", "it's.mp4", "a.mp4"])
+    lines = list_path.read_text(encoding='utf-8').splitlines()
+    assert lines[0] == "ffconcat version 1.0"
+    assert len(lines) == 4 and lines[1] == lines[3]
+    assert lines[2].endswith("it'\\''s.mp4'")
+
+    audio = [StoryboardAudio(1.5, "bgm.mp3", 2.0, 1)]
+    command = concat_command(str(list_path), "out.mp4", 5.5, audio)
+    assert command[command.index('-c:v') + 1] == "copy"
+    assert "[1:a]atrim=duration=2.0,adelay=1500|1500[a0]" in command[command.index('-filter_complex') + 1]
+
+    try:
+        run_encoder([sys.executable, "-c", "import sys; sys.stdin.buffer.read(); sys.exit(2)"], bytes(12))
+    except RuntimeError as e:
+        assert "退出码 2" in str(e)
+    else:
+        raise AssertionError("编码进程失败时应抛出 RuntimeError")
+
+
+def test_storyboard_timeline_validation_and_plan(tmp_path):
+    """台本时间线：检测重叠、空白和越界，编码计划合并相同画面并去重片段"""
+    from core.storyboard import parse_storyboard_text, storyboard_from_folder
+
+    storyboard = parse_storyboard_text(
+        "[SETTINGS]\n1280x720  25  10\n"
+        "[IMAGES]\n"
+        "0    a.png  2\n"
+        "1.5  b.png  1.5\n"   # 与a重叠0.5秒
+        "4    a.png  2\n"     # 3秒到4秒空白
+        "6    a.png  2\n"     # 与上一条首尾相接，画面相同
+        "9    c.png  3\n"     # 超出总时长
+        "[AUDIO]\n12  late.mp3\n"
+    )
+    timeline = storyboard.timeline()
+    assert timeline.overlaps == [(0, 1, 0.5)]
+    assert timeline.gaps == [(3.0, 4.0), (8.0, 9.0)]
+    assert len(timeline.warnings) == 2
+    assert any("c.png" in line and "截断" in line for line in timeline.warnings)
+    assert len(timeline.report()) == 5
+
+    plan = timeline.plan(key=lambda index: storyboard.images[index].path if index is not None else None)
+    runs = [(storyboard.images[run.index].path if run.index is not None else None, run.start_frame, run.frames)
+            for run in plan.runs]
+    assert runs == [("a.png", 0, 38), ("b.png", 38, 38), (None, 76, 24), ("a.png", 100, 101),
+                    (None, 201, 24), ("c.png", 225, 25)]
+    assert plan.frame_count == storyboard.frame_count == 250
+    assert len(plan.segments) == 5
+
+    # 上万条目的台本：扫描耗时与帧数无关
+    lines = ["[SETTINGS]", "1920x1080 30 20000", "[IMAGES]"]
+    lines += [f"{i * 2} out/scene_{i % 100:03d}.png 2" for i in range(10000)]
+    big = parse_storyboard_text("\n".join(lines)).timeline()
+    assert not big.overlaps and not big.gaps
+    assert big.plan().frame_count == 600000
+
+    for i in (10, 2, 1):
+        Image.new('RGB', (32, 18)).save(tmp_path / f"s_{i}.png")
+    folder = storyboard_from_folder(str(tmp_path), 1.5, bgm="bgm.mp3")
+    assert [os.path.basename(image.path) for image in folder.images] == ["s_1.png", "s_2.png", "s_10.png"]
+    assert (folder.width, folder.height, folder.frame_count) == (32, 18, 113)
+    assert folder.audio[0].loop
+
+
+def test_segment_cache_reuses_unchanged_segments(tmp_path, capsys):
+    """片段缓存：缓存键覆盖画面内容和编码参数，重新生成时只编码变化的画面"""
+    import stat
+    from core.storyboard import storyboard_from_folder
+    from core.video import segment_digest, segment_encoder_args
+    from video_generator import generate_video
+
+    args = segment_encoder_args(18)
+    digest = segment_digest("file:abc", 50, 1920, 1080, "25", args)
+    assert digest == segment_digest("file:abc", 50, 1920, 1080, "25", list(args))
+    assert len({digest,
+                segment_digest("file:abd", 50, 1920, 1080, "25", args),
+                segment_digest("file:abc", 51, 1920, 1080, "25", args),
+                segment_digest("file:abc", 50, 1280, 720, "25", args),
+                segment_digest("file:abc", 50, 1920, 1080, "30", args),
+                segment_digest("file:abc", 50, 1920, 1080, "25", segment_encoder_args(23))}) == 6
+
+    # 代替ffmpeg的脚本：片段写入收到的原始帧，拼接时写入片段列表
+    encoder = tmp_path / "fake_ffmpeg"
+    encoder.write_text(
+        f"#!{sys.executable}\n"
+        "import sys\n"
+        "args = sys.argv[1:]\n"
+        "data = open(args[args.index('-i') + 1]).read() if 'concat' in args else sys.stdin.buffer.read()\n"
+        "open(args[-1], 'w' if 'concat' in args else 'wb').write(data)\n")
+    encoder.chmod(encoder.stat().st_mode | stat.S_IEXEC)
+
+    images = tmp_path / "images"
+    images.mkdir()
+    for i, color in enumerate(('red', 'lime', 'blue')):
+        Image.new('RGB', (8, 4), color).save(images / f"s_{i}.png")
+    cache_dir = tmp_path / "cache"
+
+    def build():
+        capsys.readouterr()
+        storyboard = storyboard_from_folder(str(images), 1.0)
+        generate_video(None, storyboard, str(tmp_path / "out.mp4"), ffmpeg=str(encoder),
+                       segment_cache=str(cache_dir), jobs=2)
+        return capsys.readouterr().out
+
+    assert "缓存命中 0 个，新编码 3 个" in build()
+    assert len(list(cache_dir.iterdir())) == 3
+    assert "缓存命中 3 个，新编码 0 个" in build()
+
+    Image.new('RGB', (8, 4), 'white').save(images / "s_1.png")
+    out = build()
+    assert "缓存命中 2 个，新编码 1 个" in out and "渲染画面: 1 张" in out
+    assert "片段 1/1: " in out and "s_1.png，25 帧" in out
+    assert len(list(cache_dir.iterdir())) == 4
+    segments = [line for line in (tmp_path / "out.mp4").read_text().splitlines() if line.startswith("file")]
+    assert len(segments) == 3 and all(str(cache_dir) in line for line in segments)
+
+    # 超出容量上限时按修改时间淘汰，本次用到的片段和非片段文件不删除
+    from core.video import prune_segment_cache
+    (cache_dir / "notes.txt").write_text("x" * 1000)
+    used = sorted(cache_dir.glob("*.mp4"), key=lambda path: path.stat().st_mtime)
+    for age, path in enumerate(used):
+        os.utime(path, (1000 + age, 1000 + age))
+    stale_bytes = sum(path.stat().st_size for path in used[:3])
+    assert prune_segment_cache(str(cache_dir), 0, keep=[str(used[-1])]) == (3, stale_bytes)
+    assert sorted(path.name for path in cache_dir.iterdir()) == sorted([used[-1].name, "notes.txt"])
+
+    # 内容相同的不同图片得到同一个片段路径，只编码一次
+    import shutil
+    shutil.copy(images / "s_0.png", images / "s_3.png")
+    shutil.rmtree(cache_dir)
+    out = build()
+    assert "静止片段: 3 个（4 个画面段），缓存命中 0 个，新编码 3 个" in out
+    assert len(list(cache_dir.iterdir())) == 3